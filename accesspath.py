@@ -0,0 +1,134 @@
+import math
+from constants import SCANS, JOINS
+from selectivity import split_select, estimate_selectivities
+
+# Entries of an inner btree page, to estimate the height of an index from its pages
+btree_fanout = 256
+# Index methods and the predicates they can serve
+index_operators = {
+    "btree": ("=", "<", ">", "<=", ">=", "BETWEEN", "IN"),
+    "hash": ("=", "IN")
+}
+
+def index_levels(index):
+    '''
+    Pages read to descend a btree from its root to its first leaf
+    '''
+    pages = index["pages"] or 1
+    if pages <= 1:
+        return 1
+    return 1 + math.ceil(math.log(pages) / math.log(btree_fanout))
+
+def access_path(catalog, table, index):
+    '''
+    Access path through an index: the index from pgconn.get_indexes with its height and the correlation
+    of its leading column (pg_stats, 0 when unknown: rows in random heap order)
+    '''
+    column_stats = catalog.get_column_stats(table, index["columns"][0]) or {}
+    return dict(index, levels=index_levels(index), correlation=column_stats.get("correlation") or 0)
+
+def usable_index(indexes, column, operator="="):
+    '''
+    Smallest index whose leading column is column and whose method serves the operator, None if there is none
+    '''
+    usable = [index for index in indexes if index["columns"] and index["columns"][0] == column
+              and operator.upper() in index_operators.get(index["method"], ())]
+    return min(usable, key=lambda index: index["pages"] or 0) if usable else None
+
+def referenced_columns(query_dict, alias):
+    '''
+    Columns of a relation referenced by the joins and selections of the query
+    '''
+    columns = set()
+    for join in query_dict["joins"]:
+        for side in join:
+            if side["alias"] == alias:
+                columns.add(side["on"])
+    for select in query_dict["selects"]:
+        if select["alias"] == alias:
+            columns.add(split_select(select)[0])
+    return columns
+
+def scan_access_path(query_dict, alias, table, catalog):
+    '''
+    Access path of an index or bitmap scan of a relation: the index serving the most selective selection column
+    - catalog: statistics provider (pgconn or a pgconn.StatsSnapshot)
+    returns: (access path, selectivity of the predicates on the indexed column), (None, None) without usable index
+    '''
+    indexes = catalog.get_indexes(table)
+    select_items = [select for select in query_dict["selects"] if select["alias"] == alias]
+    if not indexes or not select_items:
+        return None, None
+    column_selectivity = {}
+    column_index = {}
+    for select_item, (column, selectivity) in zip(select_items, estimate_selectivities(select_items, table, catalog)):
+        index = usable_index(indexes, column, split_select(select_item)[1])
+        if index is not None:
+            column_index.setdefault(column, index)
+            column_selectivity[column] = column_selectivity.get(column, 1.0) * selectivity
+    if not column_index:
+        return None, None
+    column = min(column_selectivity, key=column_selectivity.get)
+    return access_path(catalog, table, column_index[column]), column_selectivity[column]
+
+def join_access_path(catalog, table, column):
+    '''
+    Access path probing the rows of a relation matching a join column value, None without usable index
+    '''
+    index = usable_index(catalog.get_indexes(table) or [], column)
+    return access_path(catalog, table, index) if index is not None else None
+
+def index_scan_IO(path, number_of_blocks, tuples, selectivity, scan_type):
+    '''
+    Blocks read by an index, index only or bitmap scan fetching a fraction of a relation
+    - path: access path from access_path
+    - number_of_blocks, tuples: size of the relation
+    - selectivity: fraction of the tuples fetched
+    The index is descended once and its matching leaf pages read. An index scan reads one heap block
+    per tuple when the heap is in random order and only the matching share of the blocks when it is in
+    index order, interpolated with the squared correlation (as cost_index). A bitmap scan reads every
+    matching heap block once, an index only scan does not read the heap.
+    '''
+    fetched = selectivity * tuples
+    IO = path["levels"] + math.ceil(selectivity * (path["pages"] or 0))
+    if scan_type == JOINS[4]:
+        return IO
+    if scan_type == SCANS[1]:
+        if number_of_blocks:
+            IO += math.ceil(min(2 * number_of_blocks * fetched / (2 * number_of_blocks + fetched), number_of_blocks))
+        return IO
+    max_IO = fetched
+    min_IO = math.ceil(selectivity * number_of_blocks)
+    return IO + max_IO + path["correlation"] ** 2 * (min_IO - max_IO)
+
+def feasible_scan_types(query_dict, alias, table, catalog):
+    '''
+    Scan types of a relation that can be executed: index and bitmap scans need an index serving one of its selections
+    (every type when the indexes cannot be read)
+    '''
+    if catalog.get_indexes(table) is None:
+        return list(SCANS)
+    if scan_access_path(query_dict, alias, table, catalog)[0] is None:
+        return [SCANS[0]]
+    return list(SCANS)
+
+def feasible_join_types(query_dict, join, catalog):
+    '''
+    Join types of a join that can be executed: an index join needs an index on the join column of one side,
+    an index only join one that also holds every column of that relation the query references
+    (every type when the indexes cannot be read)
+    '''
+    index_join = False
+    index_only_join = False
+    for side in join:
+        indexes = catalog.get_indexes(side["table"])
+        if indexes is None:
+            return list(JOINS)
+        index = usable_index(indexes, side["on"])
+        if index is not None:
+            index_join = True
+            needed = referenced_columns(query_dict, side["alias"])
+            index_only_join |= any(needed <= set(candidate["columns"]) for candidate in indexes
+                                   if candidate["columns"] and candidate["columns"][0] == side["on"])
+    return [join_type for join_type in JOINS
+            if (join_type != JOINS[3] or index_join) and (join_type != JOINS[4] or index_only_join)]
@@ -0,0 +1,205 @@
+import numpy as np
+from whatif import build_leaf, total_IO_cost, get_stats_source, generate_valid_join_orders, block_size, tuple_overhead
+from accesspath import join_access_path
+from constants import JOINS
+
+# Join type codes of the vectorized model (index in JOINS, anything else is costed as an index join)
+HASH_JOIN, NESTED_LOOP, MERGE_JOIN, INDEX_ONLY_JOIN = 0, 1, 2, 4
+# Orders evaluated per NumPy batch, bounds the memory of the intermediate arrays
+batch_size = 65536
+
+def prepare_cost_inputs(query_dict, Tuples, M, stats=None):
+    '''
+    Evaluate the join order independent parts of the whatif model once
+    - query_dict: the processed query from preprocessing.py
+    - Tuples, M: the same inputs as build_query_tree
+    - stats: optional StatsSnapshot of the query
+    returns: dict of plain lists/floats (picklable, no database access needed afterwards)
+      aliases, leaf_tuples, leaf_IO, leaf_width (per relation, NaN when unknown), join_aliases (alias index of both sides per join),
+      join_blocks (of the base relations), join_unique (n_distinct of both join columns, NaN when unknown),
+      join_paths ([levels, pages, correlation] of the index on both join columns, NaN when there is none), join_types, M
+    '''
+    catalog = get_stats_source(stats)
+    aliases = [source["alias"] for source in query_dict["source"]]
+    alias_index = {alias: i for i, alias in enumerate(aliases)}
+    leaf_tuples = []
+    leaf_IO = []
+    leaf_width = []
+    for source in query_dict["source"]:
+        leaf = build_leaf(query_dict, source["alias"], source["table"], False, Tuples, stats)
+        leaf_tuples.append(float(leaf.get_tuples()))
+        leaf_IO.append(float(total_IO_cost(leaf)))
+        leaf_width.append(float("nan") if leaf.width is None else float(leaf.width))
+    join_aliases, join_blocks, join_unique, join_paths, join_types = [], [], [], [], []
+    for join in query_dict["joins"]:
+        join_aliases.append([alias_index[join[0]["alias"]], alias_index[join[1]["alias"]]])
+        join_blocks.append([float(catalog.get_blocks(side["table"]) or 0) for side in join])
+        unique = []
+        for side in join:
+            unique_count = catalog.get_unique_count(side["table"], side["on"])
+            unique.append(float("nan") if unique_count is None else float(unique_count))
+        join_unique.append(unique)
+        paths = []
+        for side in join:
+            path = join_access_path(catalog, side["table"], side["on"])
+            paths.append([float("nan")] * 3 if path is None else [float(path["levels"]), float(path["pages"] or 0), float(path["correlation"])])
+        join_paths.append(paths)
+        join_types.append(JOINS.index(join[0]["type"]) if join[0]["type"] in JOINS else len(JOINS))
+    return {
+        "aliases": aliases,
+        "leaf_tuples": leaf_tuples,
+        "leaf_IO": leaf_IO,
+        "leaf_width": leaf_width,
+        "join_aliases": join_aliases,
+        "join_blocks": join_blocks,
+        "join_unique": join_unique,
+        "join_paths": join_paths,
+        "join_types": join_types,
+        "M": float(M)
+    }
+
+def encode_join_orders(orders, n_joins):
+    '''
+    Encode join orders as an integer matrix, one order (a permutation of the join indexes) per row
+    '''
+    matrix = np.array(list(orders), dtype=np.int64)
+    return matrix.reshape(-1, n_joins)
+
+def index_probe_IO(join_type, path, blocks, tuples, V):
+    '''
+    Vectorized accesspath.index_scan_IO of one probe fetching the tuples of a join column value
+    - path: (levels, pages, correlation) arrays of the probed index
+    '''
+    levels, pages, correlation = path
+    selectivity = 1 / np.maximum(V, 1)
+    IO = levels + np.ceil(selectivity * pages)
+    fetched = selectivity * tuples
+    heap = fetched + correlation ** 2 * (np.ceil(selectivity * blocks) - fetched)
+    return np.where(join_type == INDEX_ONLY_JOIN, IO, IO + heap)
+
+def join_IO(join_type, block_1, block_2, tuples_1, tuples_2, V_1, V_2, M, path_1=None, path_2=None):
+    '''
+    Vectorized IO of set_join_tuple_and_IO (side 1 is the side of the first join column)
+    - path_n: (levels, pages, correlation) arrays of the index probed on side n, NaN levels where there is none
+    '''
+    smaller_first = block_1 < block_2
+    both = block_1 + block_2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        nested_loop = np.where(smaller_first, block_1, block_2) + (block_1 * block_2) / (M - 1)
+        index = np.where(smaller_first, block_1 + (tuples_1 * block_2) / V_2, block_2 + (tuples_2 * block_1) / V_1)
+        # Index joins probing an index (whatif.IOCostModel.join_cost): the cheaper side with an index is probed
+        if path_1 is not None and path_2 is not None:
+            probe_2 = np.where(np.isnan(path_2[0]), np.inf, block_1 + tuples_1 * index_probe_IO(join_type, path_2, block_2, tuples_2, V_2))
+            probe_1 = np.where(np.isnan(path_1[0]), np.inf, block_2 + tuples_2 * index_probe_IO(join_type, path_1, block_1, tuples_1, V_1))
+            probe = np.minimum(probe_1, probe_2)
+            index = np.where(np.isinf(probe), index, probe)
+        # Hash (whatif.hash_join_IO): one pass, or Grace/hybrid partitioning passes
+        build_blocks = np.minimum(block_1, block_2)
+        fanout = max(M - 1, 2)
+        passes = np.maximum(np.ceil(np.log(build_blocks / fanout) / np.log(fanout)), 1)
+        in_memory = np.minimum((M - 1) / build_blocks, 1)
+        hash_join = np.where(build_blocks <= M - 1, both, (2 * passes + 1 - 2 * in_memory) * both)
+        # Merge (whatif.sort_merge_join_IO): in memory, or runs and merge passes of an external sort
+        runs_1, runs_2 = np.ceil(block_1 / M), np.ceil(block_2 / M)
+        runs_merged = max((M - 1) // 2, 1)
+        merge_passes_1 = np.where(runs_1 <= runs_merged, 0, np.maximum(np.ceil(np.log(runs_1 / runs_merged) / np.log(fanout)), 1))
+        merge_passes_2 = np.where(runs_2 <= runs_merged, 0, np.maximum(np.ceil(np.log(runs_2 / runs_merged) / np.log(fanout)), 1))
+        sort_merge = np.select(
+            [both <= M, runs_1 + runs_2 <= M - 1],
+            [both, 3 * both],
+            default=(3 + 2 * merge_passes_1) * block_1 + (3 + 2 * merge_passes_2) * block_2
+        )
+    return np.select(
+        [join_type == HASH_JOIN, join_type == NESTED_LOOP, join_type == MERGE_JOIN],
+        [hash_join, nested_loop, sort_merge],
+        default=index
+    )
+
+def evaluate_join_orders(inputs, orders):
+    '''
+    Cost many join orders at once with the whatif formulas, in NumPy
+    - inputs: output of prepare_cost_inputs
+    - orders: integer matrix from encode_join_orders
+    returns: (total IO cost, estimated output tuples, valid) arrays with one entry per order
+    An order is valid when it builds a single tree, as build_query_tree would (intermediate
+    relations are tracked as components of the aliases joined so far).
+    '''
+    orders = np.asarray(orders, dtype=np.int64)
+    n_orders, n_steps = orders.shape
+    n_relations = len(inputs["aliases"])
+    rows = np.arange(n_orders)
+    join_aliases = np.asarray(inputs["join_aliases"], dtype=np.int64).reshape(-1, 2)
+    join_blocks = np.asarray(inputs["join_blocks"], dtype=float).reshape(-1, 2)
+    join_unique = np.asarray(inputs["join_unique"], dtype=float).reshape(-1, 2)
+    join_paths = np.asarray(inputs["join_paths"], dtype=float).reshape(-1, 2, 3)
+    join_types = np.asarray(inputs["join_types"], dtype=np.int64)
+    M = inputs["M"]
+
+    # component[r, a]: representative alias of the intermediate relation holding alias a in order r
+    component = np.tile(np.arange(n_relations), (n_orders, 1))
+    tuples = np.tile(np.asarray(inputs["leaf_tuples"], dtype=float), (n_orders, 1))
+    io = np.full(n_orders, float(np.sum(inputs["leaf_IO"])))
+    # Width of each intermediate relation and whether it is a join result (sized from its tuples and width)
+    width = np.tile(np.asarray(inputs["leaf_width"], dtype=float), (n_orders, 1))
+    joined = np.zeros((n_orders, n_relations), dtype=bool)
+    valid = np.ones(n_orders, dtype=bool)
+    for step in range(n_steps):
+        join = orders[:, step]
+        component_1 = component[rows, join_aliases[join, 0]]
+        component_2 = component[rows, join_aliases[join, 1]]
+        # Both sides already in the same intermediate relation: build_query_tree cannot join them
+        valid &= component_1 != component_2
+        tuples_1 = tuples[rows, component_1]
+        tuples_2 = tuples[rows, component_2]
+        # Unknown n_distinct: the join column is treated as a key (as many values as tuples)
+        V_1 = np.where(np.isnan(join_unique[join, 0]), tuples_1, join_unique[join, 0])
+        V_2 = np.where(np.isnan(join_unique[join, 1]), tuples_2, join_unique[join, 1])
+        width_1 = width[rows, component_1]
+        width_2 = width[rows, component_2]
+        # Intermediate results are sized from their tuples and width (whatif.intermediate_blocks)
+        block_1 = np.where(joined[rows, component_1] & ~np.isnan(width_1), np.ceil(tuples_1 * (width_1 + tuple_overhead) / block_size), join_blocks[join, 0])
+        block_2 = np.where(joined[rows, component_2] & ~np.isnan(width_2), np.ceil(tuples_2 * (width_2 + tuple_overhead) / block_size), join_blocks[join, 1])
+        # Only a base relation can be probed through its index
+        path_1 = tuple(np.where(joined[rows, component_1], np.nan, join_paths[join, 0, k]) for k in range(3))
+        path_2 = tuple(np.where(joined[rows, component_2], np.nan, join_paths[join, 1, k]) for k in range(3))
+        io += join_IO(join_types[join], block_1, block_2, tuples_1, tuples_2, V_1, V_2, M, path_1, path_2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            tuples[rows, component_1] = (tuples_1 * tuples_2) / np.maximum(V_1, V_2)
+        width[rows, component_1] = width_1 + width_2
+        joined[rows, component_1] = True
+        component = np.where(component == component_2[:, None], component_1[:, None], component)
+    if n_steps:
+        final_tuples = tuples[rows, component[:, 0]]
+        valid &= np.all(component == component[:, :1], axis=1)
+    else:
+        final_tuples = tuples[:, 0]
+    return io, final_tuples, valid
+
+def rank_join_orders(query_dict, Tuples, M, stats=None, orders=None, inputs=None):
+    '''
+    Cost every valid join order of a query in one call and rank them
+    - orders: join orders to evaluate, defaults to all valid join orders (generate_valid_join_orders)
+    - inputs: precomputed prepare_cost_inputs output, computed when None
+    returns: list of (join order, total IO cost, estimated tuples), cheapest first
+    '''
+    if inputs is None:
+        inputs = prepare_cost_inputs(query_dict, Tuples, M, stats)
+    n_joins = len(query_dict["joins"])
+    if orders is None:
+        orders = generate_valid_join_orders(query_dict["joins"])
+    ranked = []
+    batch = []
+    def flush():
+        matrix = encode_join_orders(batch, n_joins)
+        io, tuples, valid = evaluate_join_orders(inputs, matrix)
+        for row in np.flatnonzero(valid):
+            ranked.append((tuple(int(j) for j in matrix[row]), float(io[row]), float(tuples[row])))
+        batch.clear()
+    for order in orders:
+        batch.append(order)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    ranked.sort(key=lambda entry: entry[1])
+    return ranked
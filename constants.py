@@ -1,6 +1,8 @@
 JOINS=['Hash Join','Nested Loop','Merge Join', "Index Scan", "Index Only Scan"]
 SCANS=['Seq Scan','Bitmap Heap Scan','Index Scan']
 FILTERS = ['Filter','Hash Cond','Index Cond']
+# Condition keys of EXPLAIN (FORMAT JSON) plan nodes, in the order they are attached to a node
+JSON_FILTERS = ['Filter','Hash Cond','Index Cond','Merge Cond','Join Filter','Recheck Cond']
 query_input_1 = {
     'operation': 'SELECT + Join',
     'source': [
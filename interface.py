@@ -1,30 +1,63 @@
+import copy
 import tkinter as tk
 from tkinter import ttk
-from whatif import get_nodes_and_edges, build_query_tree,total_IO_cost
+from tkinter import font as tkfont
+from whatif import get_nodes_and_edges, build_query_tree,total_IO_cost,SubplanMemo,get_join_validity,generate_valid_join_orders,build_leaf,recost_join_node,QueryTreeIndex,get_cost_model,IOCostModel,get_stats_source
 from preprocessing import process_query_plan_full,preprocess_query
 from constants import query_input_1,JOINS,SCANS,FILTERS
-import itertools
+from optimizer import optimize_join_order,join_order_from_plan
+from search import heuristic_join_order,heuristic_threshold
+from pgcost import PostgresCostModel
+from accesspath import feasible_scan_types,feasible_join_types
+from topk import top_k_plans,apply_plan,default_k,default_time_budget
+from layout import TextMetrics,layout_tree,box_padding
+from navigator import JoinOrderNavigator,rank_limit
+from viewport import SpatialGrid,collapse_subtrees,zoom_levels,default_zoom,viewport_margin
 from functools import partial
 #{'lineitem': 6001215, 'orders': 1500000, 'part': 200000, 'partsupp': 800000, 'customer': 150000, 'supplier': 10000, 'region': 5, 'nation': 25}
 
 
 class TreeVisualizer:
-    def __init__(self, root,query_dict,use_dict_IO_tuples,disable_buttons,screen_ratio,Tuples,M):
+    def __init__(self, root,query_dict,use_dict_IO_tuples,disable_buttons,screen_ratio,Tuples,M,stats=None,cost_model=None,executor=None):
         self.root = root
         self.nodes = None
         self.edges = None
+        self.shown_root = None
         self.query_dict = query_dict
         self.use_dict_IO_tuples=use_dict_IO_tuples
         self.buttons = []
         self.join_order = list(range(len(query_dict["joins"])))
-        self.original_join_order = list(range(len(query_dict["joins"])))
-        #self.permutations = itertools.permutations(self.join_order)
-        self.permutations = self.generate_valid_join_orders(query_dict["joins"])
-        self.current_permutation=None
+        # Random access to the valid join orders (lazily materialized, optionally sorted by cost)
+        self.navigator = JoinOrderNavigator(query_dict["joins"])
         self.disable_buttons = disable_buttons
         self.screen_ratio = screen_ratio
         self.Tuples = Tuples
         self.M=M
+        # Prefetched catalog statistics of the query (pgconn.StatsSnapshot), None to query pgconn lazily
+        self.stats=stats
+        # Cost model of the estimates (whatif.IOCostModel when None, pgcost.PostgresCostModel for planner units)
+        self.cost_model=cost_model
+        # Background executor of the costing and searches (tasks.TaskExecutor), None to run them on the Tk thread
+        self.executor=executor
+        # Costed subtrees shared by the join orders and type toggles of this query
+        self.memo=SubplanMemo() if use_dict_IO_tuples is False else None
+        # Parent links of the displayed tree and its join order, for incremental type toggles
+        self.tree_index=None
+        self.shown_order=None
+        # Type toggles clicked since the displayed tree, applied by the next costing (refresh)
+        self.pending_toggles=[]
+        self.tree_IO_cost=0
+        self.texts={}
+        # Zoom level (viewport.zoom_levels), layouts of the displayed tree per zoom level and the canvas items
+        # of the nodes and edges drawn in the viewport
+        self.zoom=default_zoom
+        self.zoom_layouts={}
+        self.drawn={}
+        self.item_nodes={}
+        self.viewport_pending=False
+        # Node texts are measured once with the canvas font and wrap width, for the layout and the in place updates
+        node_font = tkfont.Font(root=root, family="Arial", size=10)
+        self.text_metrics = TextMetrics(node_font.measure, node_font.metrics("linespace"), 150)
          # Get the screen dimensions
         screen_width = root.winfo_screenwidth()
         screen_height = root.winfo_screenheight()
@@ -44,10 +77,23 @@ class TreeVisualizer:
         self.frame.grid_rowconfigure(0, weight=1)
         self.frame.grid_columnconfigure(0, weight=1)
         # Create a canvas with scrollbars
-        self.canvas = tk.Canvas(self.frame, bg='white',width=canvas_width-200, height=canvas_height, scrollregion=(0, 0, 5000, 5000))
+        self.canvas = tk.Canvas(self.frame, bg='white',width=canvas_width-200, height=canvas_height, scrollregion=(0, 0, canvas_width-200, canvas_height))
         self.h_scrollbar = ttk.Scrollbar(self.frame, orient="horizontal", command=self.canvas.xview)
         self.v_scrollbar = ttk.Scrollbar(self.frame, orient="vertical", command=self.canvas.yview)
-        self.canvas.configure(xscrollcommand=self.h_scrollbar.set, yscrollcommand=self.v_scrollbar.set)
+        # Every scroll and resize draws the nodes coming into the viewport (only the visible part of the tree has canvas items)
+        self.canvas.configure(xscrollcommand=lambda *args: (self.h_scrollbar.set(*args), self.schedule_viewport()),
+                              yscrollcommand=lambda *args: (self.v_scrollbar.set(*args), self.schedule_viewport()))
+        self.canvas.bind("<Configure>", lambda event: self.schedule_viewport())
+        # Wheel scrolls, Shift+wheel scrolls sideways, Ctrl+wheel zooms around the pointer
+        self.canvas.bind("<MouseWheel>", lambda event: self.canvas.yview_scroll(-1 if event.delta > 0 else 1, "units"))
+        self.canvas.bind("<Shift-MouseWheel>", lambda event: self.canvas.xview_scroll(-1 if event.delta > 0 else 1, "units"))
+        self.canvas.bind("<Control-MouseWheel>", lambda event: self.set_zoom(self.zoom + (1 if event.delta > 0 else -1), event.x, event.y))
+        self.canvas.bind("<Button-4>", lambda event: self.canvas.yview_scroll(-1, "units"))
+        self.canvas.bind("<Button-5>", lambda event: self.canvas.yview_scroll(1, "units"))
+        self.canvas.bind("<Control-Button-4>", lambda event: self.set_zoom(self.zoom + 1, event.x, event.y))
+        self.canvas.bind("<Control-Button-5>", lambda event: self.set_zoom(self.zoom - 1, event.x, event.y))
+        # Double click on a summary box zooms in on the collapsed subtree
+        self.canvas.bind("<Double-Button-1>", self.expand_summary)
 
         # Position scrollbars: vertical on the left, horizontal at the bottom
         self.v_scrollbar.grid(row=0, column=0, sticky="ns")
@@ -67,35 +113,44 @@ class TreeVisualizer:
             self.create_option_buttons(self.options_frame)  # Only create options once
             self.create_join_buttons()
             self.create_scan_buttons()
-        self.node_positions = {}
 
-        self.next_permutation()
-        # Initial run to display the tree
+        # Initial run to display the tree (the first valid join order)
+        self.join_order = self.navigator.current()
         self.run()
 
     def create_tree_visualization(self):
-        self.canvas.delete("all")
+        self.shown_order = list(self.join_order)
+        self.show_tree(self.build_tree(self.join_order))
+
+    def build_tree(self, join_order, query_dict=None, memo=None, stats=None):
+        """Cost the tree of a join order (runs on a worker when there is an executor).
+        query_dict, memo and stats default to the ones of the visualizer, worker tasks pass the ones they were submitted with."""
+        query_dict = self.query_dict if query_dict is None else query_dict
+        memo = self.memo if memo is None else memo
+        stats = self.stats if stats is None else stats
+        return build_query_tree(query_dict, join_order,self.use_dict_IO_tuples,self.Tuples,self.M,stats,memo,self.cost_model)
+
+    def snapshot(self):
+        """Copy of the query and a memo of its own for a search task: the Tk thread keeps changing
+        self.query_dict and the tree costing keeps filling self.memo while the task runs."""
+        if self.executor is None:
+            return self.query_dict, self.memo
+        return copy.deepcopy(self.query_dict), (SubplanMemo() if self.memo is not None else None)
 
-        query_tree,intermediate_relations = build_query_tree(self.query_dict, self.join_order,self.use_dict_IO_tuples,self.Tuples,self.M)
+    def show_tree(self, built_tree):
+        """Draw a tree returned by build_tree."""
+        self.canvas.delete("all")
+        self.drawn = {}
+        self.item_nodes = {}
+        query_tree,intermediate_relations = built_tree
+        # Only a complete tree can be updated in place, an invalid one is rebuilt on every change
+        self.tree_index = QueryTreeIndex(query_tree, self.memo.ids if self.memo is not None else None) if len(intermediate_relations) <= 1 else None
         
+        self.shown_root = query_tree
         self.nodes, self.edges = get_nodes_and_edges(query_tree)
-        # Draw the root node
-        start_x = 500
-        start_y = 50
-        self.draw_node(self.nodes[0], start_x, start_y,self.use_dict_IO_tuples)
-        # Draw edges with updated arrow direction
-        for edge in self.edges:
-            parent_id, child_id = edge
-            parent_pos = self.node_positions[parent_id]
-            child_pos = self.node_positions[child_id]
-            self.canvas.create_line(child_pos[0], child_pos[1] - 30,
-                                    parent_pos[0], parent_pos[1] + 35, arrow=tk.LAST)
+        self.draw_tree(self.use_dict_IO_tuples)
         # Add the statistics
-        tree_IO_cost=total_IO_cost(query_tree)
-        est_tuples = query_tree.get_tuples()
-        # Remove old bottom label if it exists
-        if hasattr(self, 'bottom_label') and self.bottom_label.winfo_exists():
-            self.bottom_label.destroy()
+        self.tree_IO_cost=total_IO_cost(query_tree)
         if len(intermediate_relations) > 1:
             invalid_text=self.canvas.create_text(
                 500, 50,  # Position in the center of the canvas
@@ -124,15 +179,25 @@ class TreeVisualizer:
             
             # Ensure the rectangle is behind the text
             self.canvas.tag_lower(background, invalid_text)
+        self.update_statistics_label(self.tree_IO_cost, query_tree.get_tuples())
+        self.update_order_label()
+
+    def update_statistics_label(self, tree_IO_cost, est_tuples):
+        """Show the IO cost and tuples of the tree in the bottom label."""
+        # Remove old bottom label if it exists
+        if hasattr(self, 'bottom_label') and self.bottom_label.winfo_exists():
+            self.bottom_label.destroy()
         # Add the updated statistics as a new label
         if self.disable_buttons is True:
             mode = "Original"
+            # Plans retrieved without EXPLAIN ANALYSE (estimate mode, bounded fallback) only have planner estimates
+            measure = "Actual" if self.query_dict.get("analyzed", True) else "Estimated"
             # Round the IO cost and tuples to 2 decimal places
             rounded_tree_IO_cost = round(tree_IO_cost, 2)
             rounded_est_tuples = round(est_tuples, 2)
             self.bottom_label = tk.Label(
                 self.options_frame,
-                text=f"{mode}: \nActual IO cost: {rounded_tree_IO_cost} \nActual tuples: {rounded_est_tuples}",
+                text=f"{mode}: \n{measure} IO cost: {rounded_tree_IO_cost} \n{measure} tuples: {rounded_est_tuples}",
                 anchor="e",
                 bg="lightgray",
                 font=("Arial", 10, "bold")
@@ -144,7 +209,7 @@ class TreeVisualizer:
             rounded_est_tuples = round(est_tuples, 2)
             self.bottom_label = tk.Label(
                 self.options_frame,
-                text=f"{mode}: \nEstimated IO cost: {rounded_tree_IO_cost} \nEstimated tuples: {rounded_est_tuples}",
+                text=f"{mode}: \nEstimated {get_cost_model(self.cost_model).cost_label} cost: {rounded_tree_IO_cost} \nEstimated tuples: {rounded_est_tuples} \nSubplan memo hit rate: {self.memo.hit_rate():.0%} ({len(self.memo)} subtrees)",
                 anchor="e",
                 bg="lightgray",
                 font=("Arial", 10, "bold")
@@ -191,9 +256,9 @@ class TreeVisualizer:
             )
             btn.pack(side=tk.LEFT, padx=1, pady=1)
     
-    def _toggle_type(self, mode, index, options_list):
-        """Helper function to toggle between types in a given list."""
-        current_item = self.query_dict[mode][index]
+    def _toggle_type(self, mode, index, options_list, query_dict=None):
+        """Helper function to toggle between types in a given list (the feasible types of the item)."""
+        current_item = (self.query_dict if query_dict is None else query_dict)[mode][index]
         if(mode=="joins"):
             current_type = current_item[0]["type"]
             current_type = current_item[1]["type"]
@@ -201,8 +266,10 @@ class TreeVisualizer:
             current_type = current_item["type"]
         
         # Find the current type's index and toggle to the next one, looping around
-        current_index = options_list.index(current_type)
-        new_index = (current_index + 1) % len(options_list)
+        if current_type in options_list:
+            new_index = (options_list.index(current_type) + 1) % len(options_list)
+        else:
+            new_index = 0
         
         # Update the type
         if(mode=="joins"):
@@ -213,83 +280,312 @@ class TreeVisualizer:
 
     def update_join_type(self, join_index):
         """Toggle the join type for the selected join."""
-        self._toggle_type('joins', join_index, JOINS)
-        self.run()
+        self.pending_toggles.append(('joins', join_index))
+        self.refresh(incremental=True)
 
     def update_scan_types(self, mode, index):
         """Toggle the scan type for the selected scan."""
-        self._toggle_type(mode, index, SCANS)
-        self.run()
-    
-    def draw_node(self, node, x, y, use_dict_IO_tuples,level=0):
+        self.pending_toggles.append((mode, index))
+        self.refresh(incremental=True)
+
+    def toggle_types(self, query_dict, toggles, index, memo, stats):
+        """Apply type toggles to query_dict (runs on a worker when there is an executor).
+        Only the toggled nodes and their ancestors are recosted in index, a copy of the index of the displayed tree,
+        with the memo and statistics of the visualizer when the task was submitted.
+        returns: [(old node, new node)] replaced in index, None if the tree must be rebuilt"""
+        replaced = []
+        for mode, item_index in toggles:
+            if mode == "joins":
+                # Only the join types with a usable index are offered
+                self._toggle_type(mode, item_index, feasible_join_types(query_dict, query_dict["joins"][item_index], get_stats_source(stats)), query_dict)
+                if index is None or item_index not in index.joins:
+                    index = None
+                    continue
+                # Only the join node and its ancestors are recosted
+                node = index.joins[item_index]
+                new_node = recost_join_node(query_dict, node, node.get_children(), self.use_dict_IO_tuples, self.M, stats, memo, self.cost_model)
+                replaced += index.replace(query_dict, node, new_node, self.use_dict_IO_tuples, self.M, stats, memo, self.cost_model)
+                continue
+            alias = query_dict[mode][item_index]["alias"]
+            table = next((source["table"] for source in query_dict["source"] if source["alias"] == alias), alias)
+            # Only the scan types with a usable index are offered
+            self._toggle_type(mode, item_index, feasible_scan_types(query_dict, alias, table, get_stats_source(stats)), query_dict)
+            if index is None or alias not in index.leaves:
+                index = None
+                continue
+            # Only the leaf of the relation and its ancestors are recosted
+            new_leaf = build_leaf(query_dict, alias, table, self.use_dict_IO_tuples, self.Tuples, stats, memo, self.cost_model)
+            replaced += index.replace(query_dict, index.leaves[alias], new_leaf, self.use_dict_IO_tuples, self.M, stats, memo, self.cost_model)
+        return replaced if index is not None else None
+
+    def refresh(self, incremental=False):
+        """Apply the pending type toggles and cost the tree of the join order, in the background when there is an executor.
+        - incremental: update the displayed tree in place when it has the join order, rebuild it otherwise
+        The task works on a copy of the query, the toggled types are copied back once its tree is shown."""
+        join_order = list(self.join_order)
+        toggles = list(self.pending_toggles)
+        query_dict = self.query_dict if self.executor is None else copy.deepcopy(self.query_dict)
+        index = self.tree_index.copy() if incremental and self.tree_index is not None and join_order == self.shown_order else None
+        # set_stats replaces the memo and the statistics, a task it cancelled keeps using the old ones
+        memo, stats = self.memo, self.stats
+        def work():
+            replaced = self.toggle_types(query_dict, toggles, index, memo, stats)
+            if replaced is not None:
+                return index, replaced
+            return None, self.build_tree(join_order, query_dict, memo, stats)
+        def done(result):
+            for mode, item_index in toggles:
+                if mode == "joins":
+                    for side in (0, 1):
+                        self.query_dict[mode][item_index][side]["type"] = query_dict[mode][item_index][side]["type"]
+                else:
+                    self.query_dict[mode][item_index]["type"] = query_dict[mode][item_index]["type"]
+            del self.pending_toggles[:len(toggles)]
+            self.shown_order = join_order
+            new_index, built = result
+            if new_index is None:
+                self.show_tree(built)
+                return
+            self.tree_index = new_index
+            self.redraw_replaced(built)
+        message = "Recosting the toggled types" if toggles else "Costing the modified plan"
+        self.background("tree", message, work, done)
+
+    def redraw_replaced(self, replaced):
+        """Update the drawing and the statistics after the nodes replaced by QueryTreeIndex.replace."""
+        pairs = []
+        for old, new in replaced:
+            if old.get_node_type() == "Join":
+                pairs.append((old, new))
+                continue
+            # A leaf is replaced with its source node, both subtrees have the same shape
+            while old is not None:
+                pairs.append((old, new))
+                old = old.get_children()[0] if old.get_children() else None
+                new = new.get_children()[0] if new.get_children() else None
+        for old, new in pairs:
+            self.tree_IO_cost += new.get_IO_cost() - old.get_IO_cost()
+        self.shown_root = self.tree_index.root
+        if not self.update_in_place(pairs):
+            # A box changed size: the layouts are recomputed (linear) and only the nodes in the viewport are drawn again
+            self.nodes, self.edges = get_nodes_and_edges(self.tree_index.root)
+            self.draw_tree(self.use_dict_IO_tuples)
+        self.update_statistics_label(self.tree_IO_cost, self.tree_index.root.get_tuples())
+        self.update_order_label()
+
+    def update_in_place(self, pairs):
+        """Give the replaced nodes their new ids and texts in the layout of the current zoom level and in their canvas items.
+        The other zoom levels are laid out again when shown.
+        returns: False when a box changes size or a replaced node is in a collapsed subtree, the tree must then be laid out again"""
+        layout = self.zoom_layout()
+        line_count = zoom_levels[self.zoom][1]
+        texts = {}
+        for old, new in pairs:
+            if old.id not in layout["positions"] or old.id in layout["collapsed"]:
+                return False
+            text = self.node_text((new.id, new.node_type, new.value, new.IO_cost, new.tuples, new.Q_type), self.use_dict_IO_tuples)
+            zoom_text = text if line_count is None else "\n".join(text.split("\n")[:line_count])
+            width, height = self.text_metrics.size(zoom_text)
+            if (width + 2 * box_padding, height + 2 * box_padding) != layout["box_sizes"][old.id]:
+                return False
+            texts[old.id] = (text, zoom_text)
+        self.zoom_layouts = {self.zoom: layout}
+        # The nodes and edges are listed again when another zoom level is laid out
+        self.nodes = self.edges = None
+        for old, new in pairs:
+            self.texts.pop(old.id)
+            layout["texts"].pop(old.id)
+            self.texts[new.id], layout["texts"][new.id] = texts[old.id]
+            width, height = layout["box_sizes"][new.id] = layout["box_sizes"].pop(old.id)
+            x, y = layout["positions"][new.id] = layout["positions"].pop(old.id)
+            layout["grid"].rename(("node", old.id), ("node", new.id), x - width / 2, y - height / 2, x + width / 2, y + height / 2)
+            items = self.drawn.pop(("node", old.id), None)
+            if items is not None:
+                rectangle, text_item = items
+                self.canvas.itemconfigure(text_item, text="\n".join(self.text_metrics.wrap(layout["texts"][new.id])))
+                self.drawn[("node", new.id)] = items
+                self.item_nodes[rectangle] = self.item_nodes[text_item] = new.id
+        # Every edge with a replaced child has a replaced parent (the replaced nodes are paths to the root)
+        for old, new in pairs:
+            for old_child, new_child in zip(old.get_children(), new.get_children()):
+                old_key, new_key = ("edge", old.id, old_child.id), ("edge", new.id, new_child.id)
+                (parent_x, parent_y), (child_x, child_y) = layout["positions"][new.id], layout["positions"][new_child.id]
+                layout["grid"].rename(old_key, new_key, min(parent_x, child_x), parent_y, max(parent_x, child_x), child_y)
+                if old_key in self.drawn:
+                    self.drawn[new_key] = self.drawn.pop(old_key)
+        return True
+
+    def node_text(self, node, use_dict_IO_tuples):
+        """Text of a node (a tuple from get_nodes_and_edges)."""
         node_id, node_type, value, IO_cost,tuples,Q_type = node
         if(use_dict_IO_tuples):
-            text = f"{node_type}: {value}\n IO: {IO_cost}, Tup:{tuples} \n Type: {Q_type}"
-        else:
-            text = f"{node_type}: {value}\n Est IO: {IO_cost}, Est Tup:{tuples} \n Type: {Q_type}"
-        # each node is represented by rectangle
-        text_width=150
-        text_item=self.canvas.create_text(
-        x, y,
-        text=text,
-        font=("Arial", 10),
-        width=text_width,  
-        anchor="center"  
-        )
-        # Get the bounding box of the text to adjust the rectangle size
-        text_bbox = self.canvas.bbox(text_item)
-        text_width = text_bbox[2] - text_bbox[0]  
-        text_height = text_bbox[3] - text_bbox[1]  
-        # Define padding for the rectangle
-        padding = 10
-        
-        # Create the rectangle based on the text's bounding box size
-        self.canvas.create_rectangle(
-            x - text_width / 2 - padding, y - text_height / 2 - padding,
-            x + text_width / 2 + padding, y + text_height / 2 + padding,
-            fill="lightblue", outline="black"
-        )
-        
-        self.canvas.delete(text_item)
-        self.canvas.create_text(
-        x, y,
-        text=text,
-        font=("Arial", 10),
-        width=text_width,  
-        anchor="center",
-        )
-        self.node_positions[node_id] = (x, y)
-        # Draw each child node
-        children = [edge[1] for edge in self.edges if edge[0] == node_id]
-        if children:
-            # Define child spacing for the horizontal and vertical positioning
-            k = 1  # Custom level threshold for spacing adjustments
-            if level < k:
-                child_spacing = 450  # Wider horizontal spacing for shallow levels
-            else:
-                child_spacing = 250  # Narrower horizontal spacing for deeper levels
-            
-            total_width = (len(children) - 1) * child_spacing
-            child_x = x - total_width // 2  # Center children horizontally around the parent
+            return f"{node_type}: {value}\n IO: {IO_cost}, Tup:{tuples} \n Type: {Q_type}"
+        return f"{node_type}: {value}\n Est {get_cost_model(self.cost_model).cost_label}: {IO_cost}, Est Tup:{tuples} \n Type: {Q_type}"
+    
+    def draw_tree(self, use_dict_IO_tuples):
+        """Set the nodes and edges of get_nodes_and_edges to draw, only the part in the viewport gets canvas items."""
+        self.texts = {node[0]: self.node_text(node, use_dict_IO_tuples) for node in self.nodes}
+        self.zoom_layouts = {}
+        self.clear_drawn()
+        self.configure_scrollregion()
+        self.render_viewport()
 
-            # Calculate dynamic vertical spacing based on level
-            if len(children) <= 1:
-                
-                vertical_spacing = 70 + (level * 12)  # Move single child slightly up
+    def zoom_layout(self):
+        """Layout (layout.layout_tree) of the tree at the current zoom level, with its texts and a spatial index of its items.
+        Nodes keep the lines of the zoom level, the subtrees collapsed at this level are drawn as one summary box."""
+        if self.zoom in self.zoom_layouts:
+            return self.zoom_layouts[self.zoom]
+        if self.nodes is None:
+            self.nodes, self.edges = get_nodes_and_edges(self.shown_root)
+        _, line_count, collapse_depth = zoom_levels[self.zoom]
+        nodes, edges, collapsed = collapse_subtrees(self.nodes, self.edges, collapse_depth)
+        cost_label = "IO" if self.use_dict_IO_tuples else get_cost_model(self.cost_model).cost_label
+        texts = {}
+        for node in nodes:
+            node_id, node_type, value = node[:3]
+            if node_id in collapsed:
+                members = collapsed[node_id]
+                texts[node_id] = (f"{node_type}: {value} (+{len(members) - 1} nodes)\n"
+                                  f"{cost_label}: {sum(member[3] or 0 for member in members):.2f}")
+            elif line_count is not None:
+                texts[node_id] = "\n".join(self.texts[node_id].split("\n")[:line_count])
             else:
-                vertical_spacing = 100 + (level * 25)  # Move multiple children further down
+                texts[node_id] = self.texts[node_id]
+        box_sizes = {}
+        for node_id, text in texts.items():
+            width, height = self.text_metrics.size(text)
+            box_sizes[node_id] = (width + 2 * box_padding, height + 2 * box_padding)
+        positions, size = layout_tree(nodes, edges, box_sizes)
+        grid = SpatialGrid()
+        for node_id, (x, y) in positions.items():
+            width, height = box_sizes[node_id]
+            grid.insert(("node", node_id), x - width / 2, y - height / 2, x + width / 2, y + height / 2)
+        for parent_id, child_id in edges:
+            (parent_x, parent_y), (child_x, child_y) = positions[parent_id], positions[child_id]
+            grid.insert(("edge", parent_id, child_id), min(parent_x, child_x), parent_y, max(parent_x, child_x), child_y)
+        self.zoom_layouts[self.zoom] = dict(texts=texts, box_sizes=box_sizes, positions=positions, size=size,
+                                            grid=grid, collapsed=collapsed)
+        return self.zoom_layouts[self.zoom]
 
-            for child_id in children:
-                child_node = next(n for n in self.nodes if n[0] == child_id)
-                # Recursively draw each child node with adjusted x and y, and increased level
-                self.draw_node(child_node, child_x, y + vertical_spacing, use_dict_IO_tuples, level + 1)
-                child_x += child_spacing  # Move child_x position for the next child
+    def configure_scrollregion(self):
+        scale = zoom_levels[self.zoom][0]
+        width, height = self.zoom_layout()["size"]
+        self.canvas.configure(scrollregion=(0, 0, max(width * scale, self.canvas.winfo_width()), max(height * scale, self.canvas.winfo_height())))
 
+    def schedule_viewport(self):
+        """Draw the viewport once the pending events are handled (one redraw for a burst of scroll events)."""
+        if not self.viewport_pending:
+            self.viewport_pending = True
+            self.canvas.after_idle(self.render_viewport)
 
+    def clear_drawn(self):
+        for items in self.drawn.values():
+            for item in items:
+                self.canvas.delete(item)
+                self.item_nodes.pop(item, None)
+        self.drawn = {}
+
+    def render_viewport(self):
+        """Create the canvas items of the nodes and edges intersecting the viewport and delete the ones that left it."""
+        self.viewport_pending = False
+        if not self.texts:
+            return
+        layout = self.zoom_layout()
+        scale = zoom_levels[self.zoom][0]
+        x1 = (self.canvas.canvasx(0) - viewport_margin) / scale
+        y1 = (self.canvas.canvasy(0) - viewport_margin) / scale
+        x2 = (self.canvas.canvasx(self.canvas.winfo_width()) + viewport_margin) / scale
+        y2 = (self.canvas.canvasy(self.canvas.winfo_height()) + viewport_margin) / scale
+        visible = layout["grid"].query(x1, y1, x2, y2)
+        for key in [key for key in self.drawn if key not in visible]:
+            for item in self.drawn.pop(key):
+                self.canvas.delete(item)
+                self.item_nodes.pop(item, None)
+        positions = layout["positions"]
+        box_sizes = layout["box_sizes"]
+        font = ("Arial", max(1, round(10 * scale)))
+        for key in visible:
+            if key in self.drawn:
+                continue
+            if key[0] == "edge":
+                # Edge from the top of the child box to the bottom of its parent box
+                _, parent_id, child_id = key
+                (parent_x, parent_y), (child_x, child_y) = positions[parent_id], positions[child_id]
+                self.drawn[key] = (self.canvas.create_line(
+                    child_x * scale, (child_y - box_sizes[child_id][1] / 2) * scale,
+                    parent_x * scale, (parent_y + box_sizes[parent_id][1] / 2) * scale, arrow=tk.LAST),)
+                continue
+            node_id = key[1]
+            x, y = positions[node_id]
+            width, height = box_sizes[node_id]
+            # each node is represented by rectangle, collapsed subtrees by a darker one
+            rectangle = self.canvas.create_rectangle(
+                (x - width / 2) * scale, (y - height / 2) * scale,
+                (x + width / 2) * scale, (y + height / 2) * scale,
+                fill="lightsteelblue" if node_id in layout["collapsed"] else "lightblue", outline="black"
+            )
+            # The text is wrapped by the text metrics already, the canvas does not wrap it again
+            text_item = self.canvas.create_text(
+                x * scale, y * scale,
+                text="\n".join(self.text_metrics.wrap(layout["texts"][node_id])),
+                font=font,
+                anchor="center",
+            )
+            self.drawn[key] = (rectangle, text_item)
+            self.item_nodes[rectangle] = node_id
+            self.item_nodes[text_item] = node_id
+
+    def set_zoom(self, zoom, x=None, y=None):
+        """Change the zoom level keeping the point (x, y) of the canvas widget in place (its centre by default)."""
+        zoom = min(max(zoom, 0), len(zoom_levels) - 1)
+        if zoom == self.zoom or not self.texts:
+            return
+        x = self.canvas.winfo_width() / 2 if x is None else x
+        y = self.canvas.winfo_height() / 2 if y is None else y
+        old_scale = zoom_levels[self.zoom][0]
+        old_width, old_height = self.zoom_layout()["size"]
+        # Fraction of the tree under the point, the layouts of two levels differ once subtrees are collapsed
+        fraction_x = self.canvas.canvasx(x) / old_scale / old_width
+        fraction_y = self.canvas.canvasy(y) / old_scale / old_height
+        self.zoom = zoom
+        self.clear_drawn()
+        width, height = self.zoom_layout()["size"]
+        self.center_view(fraction_x * width, fraction_y * height, x, y)
+
+    def center_view(self, layout_x, layout_y, x=None, y=None):
+        """Scroll so that a point of the layout is at the point (x, y) of the canvas widget (its centre by default)."""
+        scale = zoom_levels[self.zoom][0]
+        x = self.canvas.winfo_width() / 2 if x is None else x
+        y = self.canvas.winfo_height() / 2 if y is None else y
+        self.configure_scrollregion()
+        _, _, region_width, region_height = (float(value) for value in self.canvas.cget("scrollregion").split())
+        self.canvas.xview_moveto(max(layout_x * scale - x, 0) / region_width)
+        self.canvas.yview_moveto(max(layout_y * scale - y, 0) / region_height)
+        self.render_viewport()
+
+    def expand_summary(self, event):
+        """Zoom in on the subtree collapsed in the summary box under the pointer."""
+        items = self.canvas.find_withtag("current")
+        node_id = self.item_nodes.get(items[0]) if items else None
+        if node_id is None or node_id not in self.zoom_layout()["collapsed"]:
+            return
+        # The closest level that shows the subtree
+        self.zoom = next(level for level in range(self.zoom, len(zoom_levels)) if zoom_levels[level][2] is None)
+        self.clear_drawn()
+        self.center_view(*self.zoom_layout()["positions"][node_id])
 
     def create_option_buttons(self, frame):
             options = ["Rotate Join Order ->", "<- Rotate Join Order"]
             
+            prev_btn = tk.Button(frame, text=options[1],
+                            command=self.previous_permutation,
+                            font=("Arial", 8),
+                            padx=2,
+                            pady=2,
+                            width=15,
+                            height=1
+                            )
+            prev_btn.pack(side=tk.LEFT, padx=1, pady=1)
             btn = tk.Button(frame, text=options[0], 
                             command=lambda o=options[0]: self.next_permutation(),
                             font=("Arial", 8),  # Smaller font size
@@ -299,67 +595,237 @@ class TreeVisualizer:
                             height=1   # Set a fixed smaller height
                             )
             btn.pack(side=tk.LEFT, padx=1, pady=1)
-    def next_permutation(self):
-        """Move to the next permutation in the list."""
-        try:
-            # Get the next permutation
-            self.current_permutation = next(self.permutations)
-            self.join_order = list(self.current_permutation)  # Update the current order
-            self.run()
-        except StopIteration:
-            print("reset")
-            self.reset_permutations()
-            self.current_permutation = next(self.permutations)
-            self.join_order = list(self.current_permutation)
+            # Position of the displayed order among the valid join orders, and a position to jump to
+            self.order_label = tk.Label(frame, text="", font=("Arial", 8), width=28)
+            self.order_label.pack(side=tk.LEFT, padx=1, pady=1)
+            self.jump_entry = tk.Entry(frame, font=("Arial", 8), width=8)
+            self.jump_entry.pack(side=tk.LEFT, padx=1, pady=1)
+            self.jump_entry.bind("<Return>", lambda event: self.jump_to_permutation())
+            jump_btn = tk.Button(frame, text="Jump",
+                            command=self.jump_to_permutation,
+                            font=("Arial", 8),
+                            padx=2,
+                            pady=2,
+                            width=6,
+                            height=1
+                            )
+            jump_btn.pack(side=tk.LEFT, padx=1, pady=1)
+            sort_btn = tk.Button(frame, text="Sort by Cost",
+                            command=self.toggle_sort_by_cost,
+                            font=("Arial", 8),
+                            padx=2,
+                            pady=2,
+                            width=15,
+                            height=1
+                            )
+            sort_btn.pack(side=tk.LEFT, padx=1, pady=1)
+            best_btn = tk.Button(frame, text="Best Join Order",
+                            command=self.jump_to_best_order,
+                            font=("Arial", 8),
+                            padx=2,
+                            pady=2,
+                            width=15,
+                            height=1
+                            )
+            best_btn.pack(side=tk.LEFT, padx=1, pady=1)
+            cost_model_btn = tk.Button(frame, text="Cost Model",
+                            command=self.toggle_cost_model,
+                            font=("Arial", 8),
+                            padx=2,
+                            pady=2,
+                            width=15,
+                            height=1
+                            )
+            cost_model_btn.pack(side=tk.LEFT, padx=1, pady=1)
+            top_plans_btn = tk.Button(frame, text="Top Plans",
+                            command=self.show_top_plans,
+                            font=("Arial", 8),
+                            padx=2,
+                            pady=2,
+                            width=15,
+                            height=1
+                            )
+            top_plans_btn.pack(side=tk.LEFT, padx=1, pady=1)
+            for text, step in (("Zoom -", -1), ("Zoom +", 1)):
+                zoom_btn = tk.Button(frame, text=text,
+                                command=lambda step=step: self.set_zoom(self.zoom + step),
+                                font=("Arial", 8),
+                                padx=2,
+                                pady=2,
+                                width=6,
+                                height=1
+                                )
+                zoom_btn.pack(side=tk.LEFT, padx=1, pady=1)
+    def show_top_plans(self):
+        """List the cheapest modified plans (branch and bound search) in a panel, selecting one displays it."""
+        query_dict, _ = self.snapshot()
+        self.background("search", "Ranking the top plans",
+                        lambda: top_k_plans(query_dict, self.Tuples, self.M, default_k, self.stats, self.cost_model, default_time_budget),
+                        self.show_top_plans_panel)
+
+    def show_top_plans_panel(self, result):
+        plans, counters = result
+        if hasattr(self, 'top_plans_window') and self.top_plans_window.winfo_exists():
+            self.top_plans_window.destroy()
+        self.top_plans_window = tk.Toplevel(self.root)
+        self.top_plans_window.title(f"Top {len(plans)} plans")
+        tk.Label(self.top_plans_window,
+                 text=f"{counters['expanded']} joins costed, {counters['pruned']} branches pruned",
+                 font=("Arial", 8)).pack(fill=tk.X)
+        listbox = tk.Listbox(self.top_plans_window, width=150, height=len(plans) or 1, font=("Arial", 8))
+        for rank, plan in enumerate(plans, 1):
+            listbox.insert(tk.END, f"{rank}. {plan.describe()}")
+        listbox.pack(fill=tk.BOTH, expand=True)
+        def show_plan(event):
+            selection = listbox.curselection()
+            if not selection:
+                return
+            self.join_order = apply_plan(self.query_dict, plans[selection[0]])
             self.run()
+        listbox.bind("<<ListboxSelect>>", show_plan)
+    def toggle_cost_model(self):
+        """Switch the estimates between the textbook IO model and the Postgres planner cost model."""
+        if isinstance(get_cost_model(self.cost_model), IOCostModel):
+            # Planner settings of the connected database, Postgres defaults if they cannot be read
+            self.background("settings", "Reading the planner settings", PostgresCostModel.from_database, self.set_cost_model)
+        else:
+            self.set_cost_model(None)
+
+    def set_stats(self, stats):
+        """Re-estimate the tree with new catalog statistics (e.g. after ANALYZE)."""
+        # A costing still finishing on a worker keeps filling the old memo, the subtrees costed with the old
+        # statistics are dropped with it (the node ids continue so that they stay unique)
+        self.cancel_tasks()
+        self.stats = stats
+        if self.memo is not None:
+            memo = SubplanMemo()
+            memo.ids = self.memo.ids
+            self.memo = memo
+        # The displayed tree was costed with the old statistics, the next toggles rebuild the tree
+        self.tree_index = None
+        self.run()
+
+    def set_cost_model(self, cost_model):
+        self.cost_model = cost_model
+        self.run()
+    def jump_to_best_order(self):
+        """Jump to the cheapest join order found by the dynamic programming optimizer (heuristic search for large queries)."""
+        query_dict, _ = self.snapshot()
+        if len(query_dict["source"]) >= heuristic_threshold:
+            self.background("search", "Searching the best join order",
+                            lambda: heuristic_join_order(query_dict, self.Tuples, self.M, self.stats, cost_model=self.cost_model)[0],
+                            self.show_join_order)
+            return
+        self.background("search", "Searching the best join order",
+                        lambda: optimize_join_order(query_dict, self.Tuples, self.M, self.stats, cost_model=self.cost_model),
+                        self.show_best_plan)
+
+    def show_best_plan(self, plan):
+        if plan is None:
+            print("No join order covers every relation of the query")
+            return
+        join_order = join_order_from_plan(plan, self.query_dict)
+        if join_order is None:
+            print("Error: the join graph of the query has cycles, the best plan has no join order the modified QEP can build")
+            return
+        self.show_join_order(join_order)
+
+    def show_join_order(self, join_order):
+        self.join_order = join_order
+        self.run()
+    def next_permutation(self):
+        """Move to the next valid join order, back to the first one after the last."""
+        self.join_order = self.navigator.step(1)
+        self.run()
+
+    def previous_permutation(self):
+        """Move to the previous valid join order, to the last one before the first."""
+        self.join_order = self.navigator.step(-1)
+        self.run()
 
     def reset_permutations(self):
-        self.permutations = itertools.permutations(self.original_join_order)
-        self.current_permutation = self.original_join_order
-        
+        self.join_order = self.navigator.jump(0)
+        self.run()
+
+    def jump_to_permutation(self):
+        """Jump to the position typed in the entry (from 1)."""
+        try:
+            self.join_order = self.navigator.jump(int(self.jump_entry.get()) - 1)
+        except (ValueError, IndexError) as e:
+            print(f"Error: {e}")
+            return
+        self.run()
+
+    def cost_state(self):
+        """What the costs of the join orders depend on: the join and scan types and the cost model."""
+        return (get_cost_model(self.cost_model).name, id(self.stats),
+                tuple(join[0]["type"] for join in self.query_dict["joins"]),
+                tuple(item["type"] for item in self.query_dict["source"] + self.query_dict["selects"]))
+
+    def toggle_sort_by_cost(self):
+        """Order the positions of the join orders by their cost (costing every valid order once), or back."""
+        if self.navigator.check_costs(self.cost_state()):
+            self.navigator.unsort()
+            self.update_order_label()
+            return
+        if len(self.navigator) > rank_limit:
+            print(f"Error: {len(self.navigator)} valid join orders, sorting by cost is limited to {rank_limit}")
+            return
+        state = self.cost_state()
+        query_dict, memo = self.snapshot()
+        self.background("search", "Costing every join order",
+                        lambda: self.navigator.rank(lambda join_order: total_IO_cost(self.build_tree(join_order, query_dict, memo)[0])),
+                        lambda result: self.show_ranking(result, state))
+
+    def show_ranking(self, result, state):
+        orders, costs = result
+        self.navigator.set_ranking(orders, costs, state)
+        self.show_join_order(self.navigator.jump(0))
+
+    def update_order_label(self):
+        if not hasattr(self, 'order_label'):
+            return
+        # The ranking is dropped once a type or the cost model changed
+        self.navigator.check_costs(self.cost_state())
+        if self.join_order == self.navigator.current() or self.navigator.locate(self.join_order):
+            self.order_label.config(text=self.navigator.describe())
+        else:
+            self.order_label.config(text=f"Order not valid ({len(self.navigator)} valid orders)")
+
     def run(self):
         """Runs the visualization setup and updates tree visualization."""
-        self.create_tree_visualization()
+        self.refresh()
+
+    def background(self, name, message, func, on_done):
+        """Run func() on the executor and on_done(result) on the Tk thread once it is done (right away without executor).
+        A newer call of the same name supersedes the running one, whose result is discarded."""
+        if self.executor is None:
+            on_done(func())
+            return
+        def work(task):
+            task.report(message)
+            return func()
+        self.executor.submit((name, id(self)), work, on_done=on_done)
+
+    def cancel_tasks(self):
+        """Cancel the background work of this visualizer, e.g. before its frame is destroyed."""
+        if self.executor is not None:
+            for name in ("tree", "search", "settings"):
+                self.executor.cancel((name, id(self)))
 
     def get_join_validity(self, joins, order):
         """
         Determine the validity between joins based on the tables involved for a given order.
         The order is valid if each join contains at least one table from the previous join's dependency.
         """
-        dependencies = [[] for _ in range(len(joins))]
-        
-        # Iterate through each join in the given order
-        for i, idx in enumerate(order):
-            temp = []  # List to hold the tables in the current join
-            
-            # Collect all tables (aliases) from the current join
-            for table_info in joins[idx]:
-                temp.append(table_info["alias"])
-            
-            # Check validity
-            if i > 0:  # If it's not the first join
-                # Check if the previous dependency has at least one table from the current join
-                if not any(table in dependencies[i-1] for table in temp):
-                    return False  # If no table in the previous dependency matches the current temp, invalid order
-
-            # Store the dependency for the current join (cumulative list of tables)
-            if i == 0:
-                dependencies[i] = temp  # For the first join, just add its tables
-            else:
-                dependencies[i] = dependencies[i-1] + temp  # Add the tables from the previous dependency and the current join
-
-        return True
+        return get_join_validity(joins, order)
 
 
     def generate_valid_join_orders(self, joins):
         """
         Generate all valid join orders based on the given join operations.
         """
-        # Get the table dependencies
-        all_orders = itertools.permutations(range(len(joins)))
-        
-        # Return a generator that yields only valid join orders
-        return (order for order in all_orders if self.get_join_validity(joins, order))
+        return generate_valid_join_orders(joins)
         
 
 # Set up the Tkinter window and visualize the tree
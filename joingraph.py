@@ -0,0 +1,135 @@
+class JoinGraph:
+    '''
+    Join graph of a query with one bit per relation and one bit per join
+    - join_aliases: [(alias 1, alias 2)] per join, in query_dict["joins"] order
+    A join order is valid (whatif.get_join_validity) when every join after the first
+    shares a relation with the joins before it, i.e. every prefix stays connected.
+    '''
+    def __init__(self, join_aliases):
+        self.alias_bits = {}
+        # Relations joined by each join
+        self.join_masks = []
+        for aliases in join_aliases:
+            mask = 0
+            for alias in aliases:
+                if alias not in self.alias_bits:
+                    self.alias_bits[alias] = 1 << len(self.alias_bits)
+                mask |= self.alias_bits[alias]
+            self.join_masks.append(mask)
+        # Joins touching each relation, indexed by the bit position of the relation
+        self.alias_joins = [0] * len(self.alias_bits)
+        for join_index, mask in enumerate(self.join_masks):
+            while mask:
+                bit = mask & -mask
+                self.alias_joins[bit.bit_length() - 1] |= 1 << join_index
+                mask ^= bit
+        self.n_joins = len(self.join_masks)
+        self.full = (1 << self.n_joins) - 1
+
+    def joins_touching(self, relations):
+        '''
+        Bitmask of the joins touching any relation of a relation bitmask
+        '''
+        joins = 0
+        while relations:
+            bit = relations & -relations
+            joins |= self.alias_joins[bit.bit_length() - 1]
+            relations ^= bit
+        return joins
+
+    def extend(self, state, join_index):
+        '''
+        State after appending a join to a prefix, a state is (used joins, covered relations, reachable joins)
+        '''
+        used, covered, reachable = state
+        new_relations = self.join_masks[join_index] & ~covered
+        return used | (1 << join_index), covered | self.join_masks[join_index], reachable | self.joins_touching(new_relations)
+
+    def candidates(self, state):
+        '''
+        Bitmask of the joins that can follow a prefix
+        '''
+        used, _, reachable = state
+        return (reachable if used else self.full) & ~used
+
+    def prefix_state(self, prefix):
+        '''
+        State of a prefix, None if the prefix is not valid
+        '''
+        state = (0, 0, 0)
+        for join_index in prefix:
+            if not self.candidates(state) >> join_index & 1:
+                return None
+            state = self.extend(state, join_index)
+        return state
+
+    def is_valid(self, order):
+        return len(order) == self.n_joins and self.prefix_state(order) is not None
+
+    def next_joins(self, prefix):
+        '''
+        Joins that can follow a valid prefix, in increasing order
+        '''
+        state = self.prefix_state(prefix)
+        if state is None:
+            return []
+        pending = self.candidates(state)
+        return [join_index for join_index in range(self.n_joins) if pending >> join_index & 1]
+
+    def valid_orders(self, prefix=()):
+        '''
+        Generate the valid join orders starting with a prefix, in lexicographic order
+        Depth first: only prefixes that stay connected are extended, so no invalid order is ever built
+        '''
+        state = self.prefix_state(prefix)
+        if state is None:
+            return
+        order = list(prefix)
+        stack = [(state, self.candidates(state))]
+        while stack:
+            state, pending = stack[-1]
+            if state[0] == self.full:
+                yield tuple(order)
+                pending = 0
+            if not pending:
+                stack.pop()
+                if stack:
+                    order.pop()
+                continue
+            bit = pending & -pending
+            stack[-1] = (state, pending ^ bit)
+            join_index = bit.bit_length() - 1
+            order.append(join_index)
+            next_state = self.extend(state, join_index)
+            stack.append((next_state, self.candidates(next_state)))
+
+    def count_valid_orders(self, prefix=()):
+        '''
+        Exact number of valid join orders starting with a prefix, without enumerating them
+        Dynamic programming over the sets of joins used by the valid prefixes (the order inside a set
+        does not change which joins can follow it)
+        '''
+        state = self.prefix_state(prefix)
+        if state is None:
+            return 0
+        level = {state[0]: [1, state]}
+        for _ in range(self.n_joins - len(prefix)):
+            next_level = {}
+            for count, state in level.values():
+                pending = self.candidates(state)
+                while pending:
+                    bit = pending & -pending
+                    pending ^= bit
+                    used = state[0] | bit
+                    if used in next_level:
+                        next_level[used][0] += count
+                    else:
+                        next_level[used] = [count, self.extend(state, bit.bit_length() - 1)]
+            level = next_level
+        return sum(count for count, _ in level.values())
+
+def query_join_graph(joins):
+    '''
+    JoinGraph of the joins of a query dict (query_dict["joins"])
+    '''
+    return JoinGraph([(join[0]["alias"], join[1]["alias"]) for join in joins])
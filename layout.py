@@ -0,0 +1,193 @@
+# Horizontal gap between the boxes of neighbouring nodes (px)
+node_gap = 30
+# Vertical gap between the boxes of consecutive levels (px)
+level_gap = 45
+# Padding between the text of a node and its box (px)
+box_padding = 10
+# Margin around the laid out tree (px)
+margin = 50
+
+class TextMetrics:
+    '''
+    Size of wrapped node texts, cached by text so that a text is measured once per session
+    - measure: width of a line in px (tkinter.font.Font.measure, or an estimate without display)
+    - linespace: height of a line in px (Font.metrics("linespace"))
+    - wrap_width: width the canvas text items wrap at (the "width" option of create_text)
+    '''
+    def __init__(self, measure, linespace, wrap_width):
+        self.measure = measure
+        self.linespace = linespace
+        self.wrap_width = wrap_width
+        self.sizes = {}
+
+    def wrap(self, text):
+        '''
+        Lines of a text wrapped like a canvas text item: at its newlines, then between words
+        (a word longer than the wrap width is broken inside the word)
+        '''
+        lines = []
+        for line in text.split("\n"):
+            current = ""
+            for word in line.split(" "):
+                candidate = current + " " + word if current else word
+                if not current or self.measure(candidate) <= self.wrap_width:
+                    current = candidate
+                else:
+                    lines.append(current)
+                    current = word
+                while self.measure(current) > self.wrap_width and len(current) > 1:
+                    cut = len(current) - 1
+                    while cut > 1 and self.measure(current[:cut]) > self.wrap_width:
+                        cut -= 1
+                    lines.append(current[:cut])
+                    current = current[cut:]
+            lines.append(current)
+        return lines
+
+    def size(self, text):
+        '''
+        (width, height) of a wrapped text
+        '''
+        if text not in self.sizes:
+            lines = self.wrap(text)
+            self.sizes[text] = (max(self.measure(line) for line in lines), len(lines) * self.linespace)
+        return self.sizes[text]
+
+def layout_tree(nodes, edges, sizes):
+    '''
+    Positions of the nodes of a tree in linear time (Walker's algorithm in the O(n) form of Buchheim, Junger
+    and Leipert): every subtree is placed as close to its left siblings as its contour allows, parents
+    are centred over their children and the children keep the order of the edges
+    - nodes, edges: output of whatif.get_nodes_and_edges, the first node is the root
+    - sizes: {node id: (width, height)} of the boxes
+    returns: {node id: (x, y)} of the box centres, (width, height) of the laid out tree
+    '''
+    if not nodes:
+        return {}, (0, 0)
+    ids = [node[0] for node in nodes]
+    index = {node_id: i for i, node_id in enumerate(ids)}
+    n = len(ids)
+    children = [[] for _ in range(n)]
+    parent = [None] * n
+    # Position of each node among its siblings, from 1
+    number = [1] * n
+    for parent_id, child_id in edges:
+        p, c = index[parent_id], index[child_id]
+        children[p].append(c)
+        parent[c] = p
+        number[c] = len(children[p])
+    widths = [sizes[node_id][0] for node_id in ids]
+
+    prelim = [0.0] * n
+    mod = [0.0] * n
+    shift = [0.0] * n
+    change = [0.0] * n
+    thread = [None] * n
+    ancestor = list(range(n))
+
+    def separation(left, right):
+        return (widths[left] + widths[right]) / 2 + node_gap
+
+    def left_sibling(v):
+        return children[parent[v]][number[v] - 2] if parent[v] is not None and number[v] > 1 else None
+
+    def next_left(v):
+        return children[v][0] if children[v] else thread[v]
+
+    def next_right(v):
+        return children[v][-1] if children[v] else thread[v]
+
+    def move_subtree(left, right, distance):
+        subtrees = number[right] - number[left]
+        change[right] -= distance / subtrees
+        shift[right] += distance
+        change[left] += distance / subtrees
+        prelim[right] += distance
+        mod[right] += distance
+
+    def execute_shifts(v):
+        total_shift = 0.0
+        total_change = 0.0
+        for w in reversed(children[v]):
+            prelim[w] += total_shift
+            mod[w] += total_shift
+            total_change += change[w]
+            total_shift += shift[w] + total_change
+
+    def apportion(v, default_ancestor):
+        w = left_sibling(v)
+        if w is None:
+            return default_ancestor
+        # Inner and outer contours of the right (v) and left subtrees with their accumulated modifiers
+        v_inner_right = v_outer_right = v
+        v_inner_left = w
+        v_outer_left = children[parent[v]][0]
+        s_inner_right = s_outer_right = mod[v]
+        s_inner_left = mod[v_inner_left]
+        s_outer_left = mod[v_outer_left]
+        while next_right(v_inner_left) is not None and next_left(v_inner_right) is not None:
+            v_inner_left = next_right(v_inner_left)
+            v_inner_right = next_left(v_inner_right)
+            v_outer_left = next_left(v_outer_left)
+            v_outer_right = next_right(v_outer_right)
+            ancestor[v_outer_right] = v
+            distance = (prelim[v_inner_left] + s_inner_left) - (prelim[v_inner_right] + s_inner_right) + separation(v_inner_left, v_inner_right)
+            if distance > 0:
+                left = ancestor[v_inner_left] if parent[ancestor[v_inner_left]] == parent[v] else default_ancestor
+                move_subtree(left, v, distance)
+                s_inner_right += distance
+                s_outer_right += distance
+            s_inner_left += mod[v_inner_left]
+            s_inner_right += mod[v_inner_right]
+            s_outer_left += mod[v_outer_left]
+            s_outer_right += mod[v_outer_right]
+        if next_right(v_inner_left) is not None and next_right(v_outer_right) is None:
+            thread[v_outer_right] = next_right(v_inner_left)
+            mod[v_outer_right] += s_inner_left - s_outer_right
+        if next_left(v_inner_right) is not None and next_left(v_outer_left) is None:
+            thread[v_outer_left] = next_left(v_inner_right)
+            mod[v_outer_left] += s_inner_right - s_outer_left
+            default_ancestor = v
+        return default_ancestor
+
+    def first_walk(v):
+        w = left_sibling(v)
+        if not children[v]:
+            prelim[v] = prelim[w] + separation(w, v) if w is not None else 0.0
+            return
+        default_ancestor = children[v][0]
+        for child in children[v]:
+            first_walk(child)
+            default_ancestor = apportion(child, default_ancestor)
+        execute_shifts(v)
+        midpoint = (prelim[children[v][0]] + prelim[children[v][-1]]) / 2
+        if w is not None:
+            prelim[v] = prelim[w] + separation(w, v)
+            mod[v] = prelim[v] - midpoint
+        else:
+            prelim[v] = midpoint
+
+    x = [0.0] * n
+    depth = [0] * n
+    def second_walk(v, modifier, level):
+        x[v] = prelim[v] + modifier
+        depth[v] = level
+        for child in children[v]:
+            second_walk(child, modifier + mod[v], level + 1)
+
+    first_walk(0)
+    second_walk(0, 0.0, 0)
+
+    # Each level is as tall as its tallest box
+    level_heights = [0] * (max(depth) + 1)
+    for v in range(n):
+        level_heights[depth[v]] = max(level_heights[depth[v]], sizes[ids[v]][1])
+    level_y = []
+    y = margin
+    for height in level_heights:
+        level_y.append(y + height / 2)
+        y += height + level_gap
+    left = min(x[v] - widths[v] / 2 for v in range(n))
+    right = max(x[v] + widths[v] / 2 for v in range(n))
+    positions = {ids[v]: (x[v] - left + margin, level_y[depth[v]]) for v in range(n)}
+    return positions, (right - left + 2 * margin, y - level_gap + margin)
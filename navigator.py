@@ -0,0 +1,163 @@
+from joingraph import query_join_graph
+
+# Orders enumerated past the materialized ones to reach a position, further positions are unranked instead
+materialize_limit = 10000
+# Valid orders beyond which sorting by cost (costing every order) is refused
+rank_limit = 100000
+
+class JoinOrderNavigator:
+    '''
+    Random access to the valid join orders of a query, in the lexicographic order of JoinGraph.valid_orders
+    - joins: query_dict["joins"]
+    The orders are materialized lazily as the navigation reaches them and kept, so stepping is O(1) and the
+    enumeration never restarts. A position far past the materialized orders is unranked directly from the
+    counts of JoinGraph.count_valid_orders. Stepping wraps around at both ends.
+    Once sorted by cost (set_ranking), positions follow the ranking, cheapest first.
+    '''
+    def __init__(self, joins):
+        self.graph = query_join_graph(joins)
+        self.orders = []
+        self.generator = self.graph.valid_orders()
+        # Orders reached by unranking, by enumeration index
+        self.unranked = {}
+        self.count = None
+        # Enumeration indices cheapest first when sorted by cost, with the costs and the state they were computed in
+        self.ranking = None
+        self.costs = None
+        self.cost_state = None
+        self.position = 0
+
+    def __len__(self):
+        if self.count is None:
+            self.count = self.graph.count_valid_orders()
+        return self.count
+
+    def order_at(self, index):
+        '''
+        Valid join order at an enumeration index
+        '''
+        if index < len(self.orders):
+            return self.orders[index]
+        if index in self.unranked:
+            return self.unranked[index]
+        if not 0 <= index < len(self):
+            raise IndexError(f"Join order {index} out of range ({len(self)} valid orders)")
+        if index - len(self.orders) < materialize_limit:
+            for order in self.generator:
+                self.orders.append(order)
+                if len(self.orders) > index:
+                    return order
+        self.unranked[index] = self.unrank(index)
+        return self.unranked[index]
+
+    def unrank(self, index):
+        '''
+        Join order at an enumeration index without enumerating the orders before it: each join is the
+        first candidate whose count of completions (count_valid_orders) exceeds the remaining index
+        '''
+        prefix = ()
+        for _ in range(self.graph.n_joins):
+            for join_index in self.graph.next_joins(prefix):
+                count = self.graph.count_valid_orders(prefix + (join_index,))
+                if index < count:
+                    prefix += (join_index,)
+                    break
+                index -= count
+        return prefix
+
+    def index_of(self, order):
+        '''
+        Enumeration index of a valid join order (the inverse of unrank), None if the order is not valid
+        '''
+        order = tuple(order)
+        if not self.graph.is_valid(order):
+            return None
+        index = 0
+        for depth, join_index in enumerate(order):
+            for candidate in self.graph.next_joins(order[:depth]):
+                if candidate == join_index:
+                    break
+                index += self.graph.count_valid_orders(order[:depth] + (candidate,))
+        return index
+
+    def current_index(self):
+        return self.ranking[self.position] if self.ranking is not None else self.position
+
+    def current(self):
+        return list(self.order_at(self.current_index()))
+
+    def step(self, delta):
+        '''
+        Move delta positions forward (backward when negative), wrapping around
+        returns: the join order at the new position
+        '''
+        self.position = (self.position + delta) % len(self)
+        return self.current()
+
+    def jump(self, position):
+        '''
+        Move to a position
+        returns: the join order at the position
+        '''
+        if not 0 <= position < len(self):
+            raise IndexError(f"Join order {position} out of range ({len(self)} valid orders)")
+        self.position = position
+        return self.current()
+
+    def locate(self, order):
+        '''
+        Move to the position of a join order set elsewhere (e.g. the best join order)
+        returns: True if the order is a valid one
+        '''
+        index = self.index_of(order)
+        if index is None:
+            return False
+        self.position = self.ranking.index(index) if self.ranking is not None else index
+        return True
+
+    def rank(self, cost_function):
+        '''
+        Cost every valid order with its own enumeration (safe on a worker while the navigation goes on)
+        - cost_function: cost of a join order
+        returns: (orders, costs) in enumeration order, for set_ranking
+        '''
+        orders = list(self.graph.valid_orders())
+        return orders, [cost_function(list(order)) for order in orders]
+
+    def set_ranking(self, orders, costs, state=None):
+        '''
+        Sort the positions by cost, keeping the current order
+        - orders, costs: output of rank
+        - state: what the costs depend on (types, cost model), the ranking is dropped once it changes (check_costs)
+        '''
+        index = self.current_index()
+        self.orders = orders
+        self.generator = iter(())
+        self.unranked = {}
+        self.costs = costs
+        self.cost_state = state
+        self.ranking = sorted(range(len(orders)), key=costs.__getitem__)
+        self.position = self.ranking.index(index)
+
+    def unsort(self):
+        '''
+        Back to the enumeration order, keeping the current order
+        '''
+        self.position = self.current_index()
+        self.ranking = None
+        self.costs = None
+        self.cost_state = None
+
+    def check_costs(self, state):
+        '''
+        Drop the ranking if the costs were computed in another state
+        returns: True if the positions are still sorted by cost
+        '''
+        if self.ranking is not None and state != self.cost_state:
+            self.unsort()
+        return self.ranking is not None
+
+    def describe(self):
+        if self.ranking is not None:
+            return f"Order {self.position + 1}/{len(self)} by cost ({self.costs[self.current_index()]:.2f})"
+        return f"Order {self.position + 1}/{len(self)}"
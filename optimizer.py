@@ -0,0 +1,136 @@
+import itertools
+from whatif import QueryNode, build_leaf, set_join_tuple_and_IO, total_IO_cost, covered_aliases, assign_node_ids
+
+class JoinGraphPlan:
+    '''
+    Cheapest plan found for a set of relations
+    - mask: bitmask of the relations (index in query_dict["source"]) covered by the plan
+    - node: root QueryNode of the plan, costed with the whatif model
+    - cost: total cost of the plan (sum over all nodes)
+    - join_indexes: joins of query_dict["joins"] used by the plan, in post order
+    '''
+    def __init__(self, mask, node, cost, join_indexes):
+        self.mask = mask
+        self.node = node
+        self.cost = cost
+        self.join_indexes = join_indexes
+
+def _relation_masks(query_dict):
+    '''
+    Map each alias to its bit and each join to the pair of bits it connects
+    returns: {alias: bit}, [(join_index, bit_1, bit_2)]
+    '''
+    bits = {source["alias"]: 1 << i for i, source in enumerate(query_dict["source"])}
+    edges = []
+    for join_index, join in enumerate(query_dict["joins"]):
+        if join[0]["alias"] in bits and join[1]["alias"] in bits:
+            edges.append((join_index, bits[join[0]["alias"]], bits[join[1]["alias"]]))
+    return bits, edges
+
+def _is_connected(mask, neighbours):
+    '''
+    Whether the relations of mask form a connected subgraph of the join graph
+    - neighbours: {bit: bitmask of the relations joined with it}
+    '''
+    start = mask & -mask
+    seen = start
+    frontier = start
+    while frontier:
+        bit = frontier & -frontier
+        frontier ^= bit
+        new = neighbours[bit] & mask & ~seen
+        seen |= new
+        frontier |= new
+    return seen == mask
+
+def _join_plans(query_dict, join_index, outer, inner, M, stats, cost_model=None):
+    '''
+    Join two subplans on a join of the query and cost the new join node with the whatif model
+    '''
+    join = query_dict["joins"][join_index]
+    join_node = QueryNode("Join", join[0]["alias"] + "." + join[0]["on"] + " = " + join[1]["alias"] + "." + join[1]["on"])
+    join_node.set_Q_Type(join[0]["type"])
+    join_node.join_index = join_index
+    for child in (outer.node, inner.node):
+        join_node.add_child(child)
+        for alias in covered_aliases(child):
+            join_node.add_alias(alias)
+    IO, tuples = set_join_tuple_and_IO(join, join_node, M, stats, cost_model)
+    join_node.set_IO_cost(IO)
+    join_node.set_tuples(tuples)
+    return JoinGraphPlan(outer.mask | inner.mask, join_node, outer.cost + inner.cost + IO,
+                         outer.join_indexes + inner.join_indexes + [join_index])
+
+def optimize_join_order(query_dict, Tuples, M, stats=None, bushy=True, cost_model=None):
+    '''
+    Find the cheapest join tree with dynamic programming over the connected subsets of the join graph
+    (Selinger style, the join pairs are enumerated as connected subgraph / complement pairs as in DPccp)
+    - query_dict: the processed query from preprocessing.py
+    - Tuples, M: the same inputs as build_query_tree
+    - stats: optional StatsSnapshot of the query
+    - bushy: also consider bushy trees, False restricts the search to left-deep trees
+    - cost_model: optional cost model (whatif.IOCostModel by default)
+    returns: JoinGraphPlan of the whole query, None if the join graph is not connected
+    The plan is costed with set_join_tuple_and_IO and the source/selection estimates of whatif.
+    Its joins form a tree of the join graph: the joins closing a cycle are not applied, so a plan of a
+    cyclic query has no join order build_query_tree can rebuild (join_order_from_plan returns None).
+    '''
+    bits, edges = _relation_masks(query_dict)
+    if not bits:
+        return None
+    neighbours = {bit: 0 for bit in bits.values()}
+    for join_index, bit_1, bit_2 in edges:
+        neighbours[bit_1] |= bit_2
+        neighbours[bit_2] |= bit_1
+
+    best = {}
+    for source in query_dict["source"]:
+        bit = bits[source["alias"]]
+        leaf = build_leaf(query_dict, source["alias"], source["table"], False, Tuples, stats, None, cost_model)
+        best[bit] = JoinGraphPlan(bit, leaf, total_IO_cost(leaf), [])
+
+    full = (1 << len(bits)) - 1
+    # Visiting masks in increasing numeric order guarantees every proper subset is solved first
+    for mask in range(1, full + 1):
+        if mask & (mask - 1) == 0 or not _is_connected(mask, neighbours):
+            continue
+        lowest = mask & -mask
+        candidate = None
+        # Enumerate each unordered split once: the part holding the lowest relation is the outer
+        sub = (mask - 1) & mask
+        while sub:
+            if sub & lowest:
+                rest = mask ^ sub
+                if sub in best and rest in best and (bushy or sub & (sub - 1) == 0 or rest & (rest - 1) == 0):
+                    join_index = _find_join(sub, rest, edges)
+                    if join_index is not None:
+                        plan = _join_plans(query_dict, join_index, best[sub], best[rest], M, stats, cost_model)
+                        if candidate is None or plan.cost < candidate.cost:
+                            candidate = plan
+            sub = (sub - 1) & mask
+        if candidate is not None:
+            best[mask] = candidate
+    plan = best.get(full)
+    if plan is not None:
+        assign_node_ids(plan.node, itertools.count(1))
+    return plan
+
+def _find_join(mask_1, mask_2, edges):
+    '''
+    First join of the query connecting two disjoint sets of relations
+    '''
+    for join_index, bit_1, bit_2 in edges:
+        if (bit_1 & mask_1 and bit_2 & mask_2) or (bit_1 & mask_2 and bit_2 & mask_1):
+            return join_index
+    return None
+
+def join_order_from_plan(plan, query_dict):
+    '''
+    Join order for build_query_tree that rebuilds a plan: its joins in post order
+    returns: None if the query has joins the plan does not use (cycles of the join graph), build_query_tree
+    cannot cost a join between relations already joined
+    '''
+    order = list(plan.join_indexes)
+    if len(order) < len(query_dict["joins"]):
+        return None
+    return order
@@ -0,0 +1,180 @@
+import heapq
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from batchcost import prepare_cost_inputs, encode_join_orders, evaluate_join_orders
+from joingraph import JoinGraph
+
+# Default number of cheapest join orders kept per shard and in the merged result
+default_top_k = 10
+# Shards per worker, more shards than workers balances the uneven size of the prefixes
+shards_per_worker = 4
+# Orders costed per NumPy call inside a shard
+shard_chunk_size = 4096
+
+def join_order_prefixes(graph, n_shards):
+    '''
+    Split the valid join orders into shards, one per prefix
+    Prefixes are lengthened one join at a time until there are at least n_shards of them
+    - graph: joingraph.JoinGraph of the query
+    '''
+    prefixes = [()]
+    while prefixes and len(prefixes) < n_shards and len(prefixes[0]) < graph.n_joins:
+        prefixes = [prefix + (join_index,) for prefix in prefixes for join_index in graph.next_joins(prefix)]
+    return prefixes
+
+def cost_shard(inputs, prefix, top_k=default_top_k):
+    '''
+    Cost every valid join order of one shard with batchcost and keep the cheapest
+    - inputs: output of batchcost.prepare_cost_inputs (picklable, so it can be sent to a worker process)
+    - prefix: join order prefix of the shard
+    returns: number of orders costed, [(total IO cost, join order, estimated tuples)] of the top_k cheapest
+    '''
+    n_joins = len(inputs["join_aliases"])
+    best = []
+    count = 0
+    chunk = []
+    def flush():
+        matrix = encode_join_orders(chunk, n_joins)
+        io, tuples, valid = evaluate_join_orders(inputs, matrix)
+        io = np.where(valid, io, np.inf)
+        # Only the top_k of the chunk can enter the running top_k
+        rows = np.argsort(io, kind="stable")[:top_k]
+        candidates = [(float(io[row]), chunk[row], float(tuples[row])) for row in rows if valid[row]]
+        best[:] = heapq.nsmallest(top_k, best + candidates)
+        chunk.clear()
+    for order in JoinGraph(inputs["join_aliases"]).valid_orders(prefix):
+        chunk.append(order)
+        count += 1
+        if len(chunk) >= shard_chunk_size:
+            flush()
+    if chunk:
+        flush()
+    return count, best
+
+def _cost_shard_task(task):
+    # Module level so it can be pickled by the process pool
+    return cost_shard(*task)
+
+def parallel_rank_join_orders(query_dict, Tuples, M, stats=None, workers=None, top_k=default_top_k, inputs=None):
+    '''
+    Enumerate and cost all valid join orders of a query across a process pool
+    - query_dict: the processed query from preprocessing.py
+    - Tuples, M: the same inputs as build_query_tree
+    - stats: optional StatsSnapshot of the query
+    - workers: number of worker processes, defaults to the number of CPUs (1 runs in this process)
+    - top_k: number of cheapest join orders returned
+    - inputs: precomputed batchcost.prepare_cost_inputs output, computed when None
+    returns: number of valid orders costed, [(join order, total IO cost, estimated tuples)] cheapest first
+    The statistics are read once in this process, the workers only run the cost formulas.
+    Join orders that join two relations already in the same intermediate relation (a cycle of the join graph)
+    are not costed by the whatif model and are left out of the result.
+    '''
+    if inputs is None:
+        inputs = prepare_cost_inputs(query_dict, Tuples, M, stats)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if not inputs["join_aliases"]:
+        return 0, []
+    graph = JoinGraph(inputs["join_aliases"])
+    prefixes = join_order_prefixes(graph, workers * shards_per_worker if workers > 1 else 1)
+    # Largest shards first, so the small ones fill in at the end instead of one large shard finishing last
+    prefixes.sort(key=graph.count_valid_orders, reverse=True)
+    tasks = [(inputs, prefix, top_k) for prefix in prefixes]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_cost_shard_task, tasks))
+    else:
+        results = [_cost_shard_task(task) for task in tasks]
+    count = sum(shard_count for shard_count, _ in results)
+    best = heapq.nsmallest(top_k, [entry for _, shard_best in results for entry in shard_best])
+    return count, [(order, io, tuples) for io, order, tuples in best]
+
+# TPC-H style benchmark queries (joins written in the WHERE clause for preprocess_query)
+# The join predicates closing a cycle (e.g. c_nationkey = s_nationkey in Q5) are left out,
+# the whatif model only builds trees and cannot cost a join between relations already joined
+benchmark_queries = {
+    "Q5": '''
+    SELECT c.c_name
+    FROM customer c, orders o, lineitem l, supplier s, nation n, region r
+    WHERE c.c_custkey = o.o_custkey
+        AND l.l_orderkey = o.o_orderkey
+        AND l.l_suppkey = s.s_suppkey
+        AND s.s_nationkey = n.n_nationkey
+        AND n.n_regionkey = r.r_regionkey
+        AND o.o_orderdate >= '1994-01-01'
+    ''',
+    "Q8": '''
+    SELECT o.o_orderdate
+    FROM part p, supplier s, lineitem l, orders o, customer c, nation n1, nation n2, region r
+    WHERE p.p_partkey = l.l_partkey
+        AND s.s_suppkey = l.l_suppkey
+        AND l.l_orderkey = o.o_orderkey
+        AND o.o_custkey = c.c_custkey
+        AND c.c_nationkey = n1.n_nationkey
+        AND n1.n_regionkey = r.r_regionkey
+        AND s.s_nationkey = n2.n_nationkey
+        AND o.o_orderdate BETWEEN '1995-01-01' AND '1996-12-31'
+    ''',
+    "Q9": '''
+    SELECT n.n_name
+    FROM part p, supplier s, lineitem l, partsupp ps, orders o, nation n
+    WHERE s.s_suppkey = l.l_suppkey
+        AND ps.ps_partkey = l.l_partkey
+        AND p.p_partkey = l.l_partkey
+        AND o.o_orderkey = l.l_orderkey
+        AND s.s_nationkey = n.n_nationkey
+    ''',
+    "Q8+Q9": '''
+    SELECT o.o_orderdate
+    FROM part p, supplier s, lineitem l, partsupp ps, orders o, customer c, nation n1, nation n2, region r
+    WHERE p.p_partkey = l.l_partkey
+        AND s.s_suppkey = l.l_suppkey
+        AND ps.ps_partkey = l.l_partkey
+        AND l.l_orderkey = o.o_orderkey
+        AND o.o_custkey = c.c_custkey
+        AND c.c_nationkey = n1.n_nationkey
+        AND n1.n_regionkey = r.r_regionkey
+        AND s.s_nationkey = n2.n_nationkey
+    ''',
+    "Q8+Q9 wide": '''
+    SELECT o.o_orderdate
+    FROM part p, supplier s1, lineitem l, partsupp ps, orders o, customer c, nation n1, nation n2, nation n3,
+        region r1, region r2, supplier s2
+    WHERE p.p_partkey = l.l_partkey
+        AND s1.s_suppkey = l.l_suppkey
+        AND ps.ps_partkey = l.l_partkey
+        AND l.l_orderkey = o.o_orderkey
+        AND o.o_custkey = c.c_custkey
+        AND c.c_nationkey = n1.n_nationkey
+        AND n1.n_regionkey = r1.r_regionkey
+        AND s1.s_nationkey = n2.n_nationkey
+        AND n2.n_regionkey = r2.r_regionkey
+        AND ps.ps_suppkey = s2.s_suppkey
+        AND s2.s_nationkey = n3.n_nationkey
+    '''
+}
+
+def benchmark(worker_counts=(1, 2, 4, 8), top_k=default_top_k):
+    '''
+    Time parallel_rank_join_orders on the benchmark queries for each worker count and print the speedup
+    '''
+    from preprocessing import preprocess_query
+    from pgconn import query_row_counts, get_no_working_blocks, prefetch_statistics
+    Tuples = query_row_counts()
+    M = get_no_working_blocks() or 16384
+    for name, sql_query in benchmark_queries.items():
+        query_dict = preprocess_query(sql_query)
+        inputs = prepare_cost_inputs(query_dict, Tuples, M, prefetch_statistics(query_dict))
+        baseline = None
+        for workers in worker_counts:
+            start = time.perf_counter()
+            count, ranked = parallel_rank_join_orders(query_dict, Tuples, M, workers=workers, top_k=top_k, inputs=inputs)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(f"{name}: {len(query_dict['joins'])} joins, {count} valid orders, {workers} workers: "
+                  f"{elapsed:.3f}s (speedup {baseline / elapsed:.2f}x), best {ranked[0][0]} IO {ranked[0][1]:.0f}")
+
+if __name__ == "__main__":
+    benchmark()
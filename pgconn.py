@@ -1,7 +1,13 @@
 import psycopg2
+import psycopg2.extensions
 import tkinter as tk
 from tkinter import ttk
 import re
+import threading
+import time
+from contextlib import contextmanager
+from collections import OrderedDict
+from functools import wraps
 # Database connection parameters
 host = "localhost"
 port = "5433"       
@@ -9,12 +15,305 @@ dbname = "benchmark_tpc_h"
 user = "postgres"  
 password = "password"
 
+# Connection pool parameters
+pool_min_size = 1
+pool_max_size = 4
+pool_timeout = 30  # seconds to wait for a free connection
+pool_health_check_interval = 60  # idle seconds before a connection is pinged again
+
+# Catalog statistics cache parameters
+stats_cache_size = 1024  # maximum number of cached (table, statistic) entries
+stats_cache_ttl = 600  # seconds before a cached statistic is fetched again
+
+# Plan retrieval parameters
+plan_timeout_ms = 15000  # statement_timeout of a bounded EXPLAIN ANALYSE before falling back to EXPLAIN
+
 # List of tables
 tables = [
     "lineitem", "orders", "part", "partsupp", 
     "customer", "supplier", "region", "nation"
 ]
 
+class ConnectionPool:
+    '''
+    Thread-safe pool of reusable psycopg2 connections
+    - minconn: number of connections opened when the pool is first used
+    - maxconn: maximum number of open connections, checkout waits when all are in use
+    - timeout: seconds to wait for a free connection before raising
+    - health_check_interval: idle seconds after which a connection is pinged before reuse
+    - stats: counters for connects, reconnects, checkouts and total wait time (seconds)
+    '''
+    def __init__(self, minconn=1, maxconn=4, timeout=30, health_check_interval=60):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Pool sizes must satisfy 0 <= minconn <= maxconn and maxconn >= 1")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._idle = []  # (connection, last used timestamp)
+        self._in_use = set()
+        # Connections checked out before closeall, closed when they are returned
+        self._retired = set()
+        self._lock = threading.Condition()
+        self._started = False
+        self.stats = {"connects": 0, "reconnects": 0, "checkouts": 0, "wait_time": 0.0}
+
+    def _connect(self):
+        conn = psycopg2.connect(
+            dbname=dbname,
+            user=user,
+            password=password,
+            host=host,
+            port=port
+        )
+        # Catalog and EXPLAIN queries are read only, no need to hold a transaction open
+        conn.autocommit = True
+        with self._lock:
+            self.stats["connects"] += 1
+        return conn
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _open_size(self):
+        return len(self._idle) + len(self._in_use)
+
+    def getconn(self):
+        '''
+        Check out a connection, waiting up to timeout seconds if the pool is exhausted
+        returns: an open psycopg2 connection
+        '''
+        start = time.monotonic()
+        with self._lock:
+            if not self._started:
+                self._started = True
+                for _ in range(self.minconn):
+                    self._idle.append((self._connect(), time.monotonic()))
+            while not self._idle and self._open_size() >= self.maxconn:
+                remaining = self.timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    raise TimeoutError(f"No free database connection after {self.timeout}s")
+                self._lock.wait(remaining)
+            if self._idle:
+                conn, last_used = self._idle.pop()
+            else:
+                conn, last_used = None, None
+            # Reserve the slot before leaving the lock so concurrent checkouts respect maxconn
+            placeholder = object()
+            self._in_use.add(placeholder)
+            self.stats["checkouts"] += 1
+            self.stats["wait_time"] += time.monotonic() - start
+        try:
+            if conn is not None and not self._is_healthy(conn, last_used):
+                self._close(conn)
+                conn = None
+                with self._lock:
+                    self.stats["reconnects"] += 1
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._lock:
+                self._in_use.discard(placeholder)
+                self._lock.notify()
+            raise
+        with self._lock:
+            self._in_use.discard(placeholder)
+            self._in_use.add(conn)
+            if placeholder in self._retired:
+                self._retired.discard(placeholder)
+                self._retired.add(conn)
+        return conn
+
+    def putconn(self, conn, discard=False):
+        '''
+        Return a connection to the pool
+        - discard: close the connection instead of reusing it (e.g. after a connection error)
+        '''
+        with self._lock:
+            self._in_use.discard(conn)
+            retired = conn in self._retired
+            self._retired.discard(conn)
+            if discard or retired or conn.closed or self._open_size() >= self.maxconn:
+                self._close(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._lock.notify()
+
+    def closeall(self):
+        '''
+        Close every idle connection and reset the pool, connections in use are closed when returned
+        '''
+        with self._lock:
+            for conn, _ in self._idle:
+                self._close(conn)
+            self._idle = []
+            self._retired.update(self._in_use)
+            self._started = False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+_pool = ConnectionPool(pool_min_size, pool_max_size, pool_timeout, pool_health_check_interval)
+
+def configure_pool(minconn=pool_min_size, maxconn=pool_max_size, timeout=pool_timeout, health_check_interval=pool_health_check_interval):
+    '''
+    Replace the shared connection pool, closing the idle connections of the old one
+    '''
+    global _pool
+    _pool.closeall()
+    _pool = ConnectionPool(minconn, maxconn, timeout, health_check_interval)
+    return _pool
+
+def get_pool_stats():
+    '''
+    Counters of the shared connection pool (connects, reconnects, checkouts, wait_time)
+    '''
+    return dict(_pool.stats)
+
+@contextmanager
+def pooled_connection():
+    '''
+    Check out a connection from the shared pool for the duration of a with block.
+    Connections that fail with a connection level error are dropped so the next checkout reconnects.
+    A cancelled statement or an expired statement_timeout (QueryCanceledError, an OperationalError)
+    leaves the connection usable, it is returned to the pool.
+    '''
+    # The connection goes back to the pool it came from, even if configure_pool replaced it meanwhile
+    pool = _pool
+    conn = pool.getconn()
+    discard = False
+    try:
+        yield conn
+    except psycopg2.extensions.QueryCanceledError:
+        raise
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        discard = True
+        raise
+    finally:
+        pool.putconn(conn, discard=discard)
+
+class StatsCache:
+    '''
+    LRU cache with per-entry TTL for catalog statistics (pg_class / pg_stats lookups)
+    - max_entries: entries kept before the least recently used one is evicted
+    - ttl: default seconds an entry stays valid
+    - stats: counters for hits, misses, evictions and expirations
+    Keys start with the table name so a table's entries can be invalidated together.
+    '''
+    def __init__(self, max_entries=1024, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, expiry timestamp)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def get(self, key):
+        '''
+        returns: (found, value)
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return False, None
+            value, expiry = entry
+            if time.monotonic() >= expiry:
+                del self._entries[key]
+                self.stats["expirations"] += 1
+                self.stats["misses"] += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return True, value
+
+    def put(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, table=None):
+        '''
+        Drop the cached entries of a table, or every entry if no table is given
+        returns: number of entries dropped
+        '''
+        with self._lock:
+            if table is None:
+                dropped = len(self._entries)
+                self._entries.clear()
+                return dropped
+            keys = [key for key in self._entries if key[0] == table]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def __len__(self):
+        return len(self._entries)
+
+_stats_cache = StatsCache(stats_cache_size, stats_cache_ttl)
+
+def cached_statistic(func):
+    '''
+    Decorator caching a catalog lookup whose first argument is the table name.
+    Failed lookups (None) are not cached so they are retried on the next call.
+    '''
+    @wraps(func)
+    def wrapper(table, *args):
+        key = (table, func.__name__) + args
+        found, value = _stats_cache.get(key)
+        if found:
+            return value
+        value = func(table, *args)
+        if value is not None:
+            _stats_cache.put(key, value)
+        return value
+    return wrapper
+
+def get_stats_cache_stats():
+    '''
+    Counters of the statistics cache (hits, misses, evictions, expirations) and its current size
+    '''
+    stats = dict(_stats_cache.stats)
+    stats["size"] = len(_stats_cache)
+    return stats
+
+def invalidate_statistics(table=None):
+    '''
+    Forget cached statistics of a table (or all tables), e.g. after it was re-ANALYZEd
+    '''
+    return _stats_cache.invalidate(table)
+
+def analyze_tables(analyze_list=None):
+    '''
+    Run ANALYZE on the given tables (default: all TPC-H tables) and invalidate their cached statistics
+    '''
+    analyze_list = analyze_list or tables
+    try:
+        with pooled_connection() as conn:
+            with conn.cursor() as cur:
+                for table in analyze_list:
+                    cur.execute(f"ANALYZE {table}")
+    except Exception as e:
+        print(f"Error: {e}")
+    finally:
+        for table in analyze_list:
+            invalidate_statistics(table)
+
 # Function to get the number of rows in a table
 def get_row_count(conn, table):
     with conn.cursor() as cur:
@@ -28,81 +327,128 @@ def get_row_count(conn, table):
 
 def query_row_counts():
     try:
-        # Establish the connection
-        conn = psycopg2.connect(
-            dbname=dbname,
-            user=user,
-            password=password,
-            host=host,
-            port=port
-        )
-        
-        # Iterate through each table and get the row count
-        pg_stats={}
-        for table in tables:
-            row_count = get_row_count(conn, table)
-            #print(f"Table {table} has {row_count} rows.")
-            pg_stats[table] = row_count
-
-        # Close the connection
-        conn.close()
-        return pg_stats
+        with pooled_connection() as conn:
+            # Iterate through each table and get the row count
+            pg_stats={}
+            for table in tables:
+                row_count = get_row_count(conn, table)
+                #print(f"Table {table} has {row_count} rows.")
+                pg_stats[table] = row_count
+
+            return pg_stats
 
     except Exception as e:
         print(f"Error: {e}")
 
 
 
-def get_execution_plan(query):
-    try:
-        # Establish the connection
-        conn = psycopg2.connect(
-            dbname=dbname,
-            user=user,
-            password=password,
-            host=host,
-            port=port
-        )
+# Connections currently running an EXPLAIN with the cancel token of their caller, and the ones whose EXPLAIN was cancelled
+_active_plan_conns = {}
+_cancelled_plan_conns = set()
+_plan_lock = threading.Lock()
 
-        with conn.cursor() as cur:
-            # Use EXPLAIN to get the execution plan
-            cur.execute(f"EXPLAIN ANALYSE {query}")
-            # Fetch all lines of the plan
-            plan = cur.fetchall()
-            # Join the plan lines into a single string for easy viewing
-            execution_plan = "\n".join([line[0] for line in plan])
-            conn.close()
-            return execution_plan
+def cancel_execution_plan(token=None):
+    '''
+    Cancel in-flight get_execution_plan calls on the server (pg_cancel_backend equivalent).
+    Cancelled calls return None instead of falling back to the estimated plan, and their connections are closed
+    instead of returned to the pool (the cancel request may reach the server after the statement ended).
+    - token: cancel_token of the calls to cancel (e.g. the tasks.Task running them), None to cancel every call
+    returns: number of cancelled statements
+    '''
+    # The cancel requests are sent under the lock, so a connection cannot be returned to the pool
+    # (and checked out by an unrelated query) before its cancel is sent
+    with _plan_lock:
+        conns = [conn for conn, conn_token in _active_plan_conns.items() if token is None or conn_token is token]
+        _cancelled_plan_conns.update(conns)
+        for conn in conns:
+            try:
+                conn.cancel()
+            except psycopg2.Error as e:
+                print(f"Error: {e}")
+    return len(conns)
+
+def _explain(cur, query, plan_format, analyze):
+    if plan_format == "json":
+        options = "ANALYZE, FORMAT JSON, BUFFERS" if analyze else "FORMAT JSON"
+        cur.execute(f"EXPLAIN ({options}) {query}")
+        # psycopg2 decodes the json column, a one element list holding the plan object
+        return cur.fetchone()[0][0]
+    # Use EXPLAIN to get the execution plan
+    cur.execute(f"EXPLAIN ANALYSE {query}" if analyze else f"EXPLAIN {query}")
+    # Fetch all lines of the plan
+    plan = cur.fetchall()
+    # Join the plan lines into a single string for easy viewing
+    return "\n".join([line[0] for line in plan])
+
+def get_execution_plan(query, plan_format="text", mode="analyze", timeout_ms=None, cancel_token=None):
+    '''
+    Get the execution plan of a query
+    - plan_format: "text" for the textual plan, "json" for EXPLAIN (ANALYZE, FORMAT JSON, BUFFERS)
+    - mode: "analyze" runs EXPLAIN ANALYSE (executes the query),
+            "estimate" runs plain EXPLAIN (planner estimates only, no execution),
+            "bounded" runs EXPLAIN ANALYSE under statement_timeout and falls back to "estimate" when it expires
+    - timeout_ms: statement_timeout in milliseconds for "bounded" mode (default plan_timeout_ms)
+    - cancel_token: object identifying the caller to cancel_execution_plan
+    returns: the plan as a string (text) or the parsed JSON plan object with its "Plan" root (json),
+    None if the call failed or was cancelled with cancel_execution_plan
+    '''
+    if mode not in ("analyze", "estimate", "bounded"):
+        raise ValueError(f"Unknown plan mode: {mode}")
+    try:
+        with pooled_connection() as conn:
+            with _plan_lock:
+                _active_plan_conns[conn] = cancel_token
+            reset_failed = False
+            try:
+                with conn.cursor() as cur:
+                    if mode == "estimate":
+                        return _explain(cur, query, plan_format, analyze=False)
+                    if mode == "analyze":
+                        return _explain(cur, query, plan_format, analyze=True)
+                    cur.execute(f"SET statement_timeout = {int(timeout_ms or plan_timeout_ms)}")
+                    try:
+                        return _explain(cur, query, plan_format, analyze=True)
+                    except psycopg2.extensions.QueryCanceledError:
+                        with _plan_lock:
+                            if conn in _cancelled_plan_conns:
+                                raise
+                        print(f"EXPLAIN ANALYSE exceeded {int(timeout_ms or plan_timeout_ms)} ms, using the estimated plan")
+                        return _explain(cur, query, plan_format, analyze=False)
+                    finally:
+                        try:
+                            cur.execute("RESET statement_timeout")
+                        except psycopg2.Error:
+                            reset_failed = True
+            finally:
+                with _plan_lock:
+                    _active_plan_conns.pop(conn, None)
+                    cancelled = conn in _cancelled_plan_conns
+                    _cancelled_plan_conns.discard(conn)
+                # A late cancel could hit the next query of the connection, and a failed RESET leaves the bounded
+                # statement_timeout set: the connection is closed, pooled_connection does not reuse it
+                if cancelled or reset_failed:
+                    conn.close()
     except Exception as e:
         print(f"Error: {e}")
 
+@cached_statistic
 def get_unique_count(table, key) -> int:
     '''
     Function to get the number of unique values in a column
     '''
     try:
-        # Establish the connection
-        conn = psycopg2.connect(
-            dbname=dbname,
-            user=user,
-            password=password,
-            host=host,
-            port=port
-        )
-
-        with conn.cursor() as cur:
-            # SQL query to count the distinct values
-            cur.execute(f"SELECT attname, n_distinct FROM pg_stats WHERE tablename='{table}' AND attname='{key}'")
-            # Fetch the result
-            count = cur.fetchone()[1]
+        with pooled_connection() as conn:
+            with conn.cursor() as cur:
+                # SQL query to count the distinct values
+                cur.execute(f"SELECT attname, n_distinct FROM pg_stats WHERE tablename='{table}' AND attname='{key}'")
+                # Fetch the result
+                count = cur.fetchone()[1]
             # If n_distinct is positive, it's an estimated number of distinct values.
             # If n_distinct is negative, it represents a fraction of the total rows (e.g., -0.1 means ~10% of the rows are unique).
             if count >0:
-                conn.close()
                 return count
             else:
                 total_rows = get_row_count(conn, table)
-                conn.close()
                 return int(total_rows * abs(count))
 
     except Exception as e:
@@ -113,74 +459,348 @@ def get_no_working_blocks() -> int:
     Function to get the number of working blocks in shared_buffers
     '''
     try:
-        # Establish the connection
-        conn = psycopg2.connect(
-            dbname=dbname,
-            user=user,
-            password=password,
-            host=host,
-            port=port
-        )
+        with pooled_connection() as conn:
+            with conn.cursor() as cur:
+                # SQL query to get the number of working blocks
+                cur.execute("""
+                SELECT
+                    setting AS shared_buffers_blocks,
+                    setting::bigint * current_setting('block_size')::bigint / (1024 * 1024) AS shared_buffers_size_mb
+                FROM pg_settings
+                WHERE name = 'shared_buffers';
+                """)
+                # Fetch the result
+                result = cur.fetchone()[0]
+                return result
+    except Exception as e:
+        print(f"Error: {e}")
 
-        with conn.cursor() as cur:
-            # SQL query to get the number of working blocks
-            cur.execute("""
-            SELECT
-                setting AS shared_buffers_blocks,
-                setting::bigint * current_setting('block_size')::bigint / (1024 * 1024) AS shared_buffers_size_mb
-            FROM pg_settings
-            WHERE name = 'shared_buffers';
-            """)
-            # Fetch the result
-            result = cur.fetchone()[0]
-            conn.close()
-            return result
+def get_planner_settings(names=("seq_page_cost", "random_page_cost", "cpu_tuple_cost", "cpu_index_tuple_cost",
+                                 "cpu_operator_cost", "effective_cache_size", "work_mem")):
+    '''
+    Function to get the planner cost settings
+    - names: the pg_settings names to read
+    returns: {name: value} in the units of pg_settings (effective_cache_size in blocks, work_mem in kB)
+    '''
+    try:
+        with pooled_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT name, setting FROM pg_settings WHERE name = ANY(%s)", (list(names),))
+                return {name: float(setting) for name, setting in cur.fetchall()}
     except Exception as e:
         print(f"Error: {e}")
 
+@cached_statistic
 def get_blocks(table) -> int:
     try:
-        # Establish the connection
-        conn = psycopg2.connect(
-            dbname=dbname,
-            user=user,
-            password=password,
-            host=host,
-            port=port
-        )
+        with pooled_connection() as conn:
+            with conn.cursor() as cur:
+                # SQL query to get the number of blocks used by the table
+                cur.execute(f"""
+                SELECT
+                    pg_relation_size('{table}') AS table_size_bytes,
+                    pg_size_pretty(pg_relation_size('{table}')) AS table_size_pretty,
+                    current_setting('block_size')::int AS block_size_bytes,
+                    pg_relation_size('{table}') / current_setting('block_size')::int AS blocks_used
+                FROM
+                    pg_class
+                WHERE
+                    relname = '{table}';
+                """)
+                # Fetch the result
+                result = cur.fetchone()
+                return result[3]
+    except Exception as e:
+        print(f"Error: {e}")
 
-        with conn.cursor() as cur:
-            # SQL query to get the number of blocks used by the table
-            cur.execute(f"""
-            SELECT
-                pg_relation_size('{table}') AS table_size_bytes,
-                pg_size_pretty(pg_relation_size('{table}')) AS table_size_pretty,
-                current_setting('block_size')::int AS block_size_bytes,
-                pg_relation_size('{table}') / current_setting('block_size')::int AS blocks_used
-            FROM
-                pg_class
-            WHERE
-                relname = '{table}';
-            """)
-            # Fetch the result
-            result = cur.fetchone()
-            conn.close()
-            return result[3]
+@cached_statistic
+def get_tuple_width(table):
+    '''
+    Function to get the average width of a row of a table in bytes (sum of the pg_stats avg_width of its columns, without the tuple header)
+    '''
+    try:
+        with pooled_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT sum(avg_width) FROM pg_stats WHERE tablename='{table}' AND schemaname = current_schema()")
+                width = cur.fetchone()[0]
+                return int(width) if width is not None else None
+    except Exception as e:
+        print(f"Error: {e}")
+
+@cached_statistic
+def get_column_stats(table, key):
+    '''
+    Function to get the distribution statistics of a column from pg_stats
+    returns: {n_distinct, null_frac, avg_width, most_common_vals, most_common_freqs, histogram_bounds, correlation}
+    '''
+    try:
+        with pooled_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                SELECT
+                    n_distinct,
+                    null_frac,
+                    avg_width,
+                    most_common_vals::text::text[],
+                    most_common_freqs,
+                    histogram_bounds::text::text[],
+                    correlation
+                FROM pg_stats
+                WHERE tablename = %s AND attname = %s AND schemaname = current_schema();
+                """, (table, key))
+                row = cur.fetchone()
+                if row is None:
+                    return None
+                n_distinct, null_frac, avg_width, mcv, mcf, histogram, correlation = row
+                return {
+                    "n_distinct": n_distinct,
+                    "null_frac": null_frac,
+                    "avg_width": avg_width,
+                    "most_common_vals": mcv or [],
+                    "most_common_freqs": mcf or [],
+                    "histogram_bounds": histogram or [],
+                    "correlation": correlation
+                }
+    except Exception as e:
+        print(f"Error: {e}")
+
+def _fetch_indexes(cur, table_list):
+    '''
+    Valid, non partial indexes of the tables from pg_index and pg_class
+    returns: {table: [{name, columns (key columns in index order), pages, tuples, unique, method}]}, [] for a table without index
+    '''
+    cur.execute("""
+    SELECT
+        t.relname,
+        i.relname,
+        array(
+            SELECT a.attname
+            FROM unnest(x.indkey::int2[]) WITH ORDINALITY AS k(attnum, position)
+            JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = k.attnum
+            ORDER BY k.position
+        )::text[] AS index_columns,
+        i.relpages,
+        i.reltuples::bigint,
+        x.indisunique,
+        am.amname
+    FROM pg_index x
+    JOIN pg_class t ON t.oid = x.indrelid
+    JOIN pg_class i ON i.oid = x.indexrelid
+    JOIN pg_am am ON am.oid = i.relam
+    WHERE t.relname = ANY(%s) AND x.indisvalid AND x.indpred IS NULL;
+    """, (list(table_list),))
+    indexes = {table: [] for table in table_list}
+    for table, name, index_columns, pages, tuples, unique, method in cur.fetchall():
+        if table in indexes:
+            indexes[table].append({
+                "name": name,
+                "columns": list(index_columns or []),
+                "pages": pages,
+                "tuples": tuples,
+                "unique": unique,
+                "method": method
+            })
+    return indexes
+
+@cached_statistic
+def get_indexes(table):
+    '''
+    Function to get the indexes of a table
+    returns: [{name, columns, pages, tuples, unique, method}] ([] if the table has no index, None if the lookup failed)
+    '''
+    try:
+        with pooled_connection() as conn:
+            with conn.cursor() as cur:
+                return _fetch_indexes(cur, [table])[table]
+    except Exception as e:
+        print(f"Error: {e}")
+
+def get_table_versions(table_list):
+    '''
+    Statistics version of tables from pg_stat_user_tables: changes whenever a table is
+    (auto)analyzed or rows are inserted, updated or deleted
+    - table_list: table names
+    returns: {table: [last_analyze, last_autoanalyze, n_tup_ins, n_tup_upd, n_tup_del]}
+    '''
+    try:
+        with pooled_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                SELECT relname, last_analyze, last_autoanalyze, n_tup_ins, n_tup_upd, n_tup_del
+                FROM pg_stat_user_tables
+                WHERE relname = ANY(%s);
+                """, (list(table_list),))
+                versions = {}
+                for relname, last_analyze, last_autoanalyze, n_tup_ins, n_tup_upd, n_tup_del in cur.fetchall():
+                    versions[relname] = [str(last_analyze), str(last_autoanalyze), n_tup_ins, n_tup_upd, n_tup_del]
+                return versions
+    except Exception as e:
+        print(f"Error: {e}")
+
+def _query_dict_columns(query_dict):
+    '''
+    Collect the columns referenced by joins and selections of a preprocessed query
+    returns: {table: set of columns}
+    '''
+    alias_to_table = {source["alias"]: source["table"] for source in query_dict["source"]}
+    columns = {source["table"]: set() for source in query_dict["source"]}
+    for join in query_dict["joins"]:
+        for side in join:
+            columns.setdefault(side["table"], set()).add(side["on"])
+    for select in query_dict["selects"]:
+        table = alias_to_table.get(select["alias"], select["alias"])
+        for operand in (select["left"], select["right"]):
+            name = operand.split(".")[-1].strip("() ")
+            if re.fullmatch(r"[A-Za-z_]\w*", name):
+                columns.setdefault(table, set()).add(name)
+    return columns
+
+class StatsSnapshot:
+    '''
+    Catalog statistics of the tables and columns referenced by a query, fetched in bulk by prefetch_statistics
+    - relations: table -> {reltuples, relpages, blocks, block_size, width}
+    - columns: (table, column) -> {n_distinct, null_frac, avg_width, most_common_vals, most_common_freqs, histogram_bounds, correlation}
+    - indexes: table -> [{name, columns, pages, tuples, unique, method}]
+    Exposes the same lookups as pgconn (get_blocks, get_unique_count, ...) so whatif can use either.
+    Lookups missing from the snapshot fall back to the cached pgconn functions.
+    '''
+    def __init__(self, relations=None, columns=None, indexes=None):
+        self.relations = relations or {}
+        self.columns = columns or {}
+        self.indexes = indexes or {}
+
+    def get_row_count(self, table):
+        relation = self.relations.get(table)
+        if relation is None:
+            return (query_row_counts() or {}).get(table)
+        return relation["reltuples"]
+
+    def get_blocks(self, table):
+        relation = self.relations.get(table)
+        if relation is None:
+            return get_blocks(table)
+        return relation["blocks"]
+
+    def get_tuple_width(self, table):
+        relation = self.relations.get(table)
+        if relation is None or relation["width"] is None:
+            return get_tuple_width(table)
+        return relation["width"]
+
+    def get_unique_count(self, table, key):
+        column = self.columns.get((table, key))
+        if column is None or column["n_distinct"] is None:
+            return get_unique_count(table, key)
+        count = column["n_distinct"]
+        # Negative n_distinct is a fraction of the number of rows (see get_unique_count)
+        if count > 0:
+            return count
+        reltuples = self.get_row_count(table)
+        return int(reltuples * abs(count)) if reltuples is not None else None
+
+    def get_column_stats(self, table, key):
+        column = self.columns.get((table, key))
+        if column is None:
+            return get_column_stats(table, key)
+        return column
+
+    def get_indexes(self, table):
+        if table not in self.indexes:
+            return get_indexes(table)
+        return self.indexes[table]
+
+def prefetch_statistics(query_dict):
+    '''
+    Fetch the statistics of every table and column referenced by a preprocessed query
+    with one query against pg_class and one against pg_stats (instead of one per lookup)
+    - query_dict: the processed query from preprocessing.py
+    returns: StatsSnapshot (empty if the database is unreachable)
+    '''
+    columns_by_table = _query_dict_columns(query_dict)
+    table_names = list(columns_by_table)
+    pairs = [(table, column) for table, columns in columns_by_table.items() for column in sorted(columns)]
+    relations = {}
+    columns = {}
+    indexes = {}
+    try:
+        with pooled_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                SELECT
+                    relname,
+                    reltuples::bigint,
+                    relpages,
+                    pg_relation_size(oid) / current_setting('block_size')::int AS blocks_used,
+                    current_setting('block_size')::int AS block_size_bytes,
+                    (SELECT sum(s.avg_width) FROM pg_stats s
+                     WHERE s.tablename = relname AND s.schemaname = current_schema())::int AS tuple_width
+                FROM pg_class
+                WHERE relkind IN ('r', 'm', 'p') AND relname = ANY(%s);
+                """, (table_names,))
+                for relname, reltuples, relpages, blocks, block_size, width in cur.fetchall():
+                    relations[relname] = {
+                        "reltuples": reltuples,
+                        "relpages": relpages,
+                        "blocks": blocks,
+                        "block_size": block_size,
+                        "width": width
+                    }
+                if pairs:
+                    cur.execute("""
+                    SELECT
+                        s.tablename,
+                        s.attname,
+                        s.n_distinct,
+                        s.null_frac,
+                        s.avg_width,
+                        s.most_common_vals::text::text[],
+                        s.most_common_freqs,
+                        s.histogram_bounds::text::text[],
+                        s.correlation
+                    FROM pg_stats s
+                    JOIN unnest(%s::text[], %s::text[]) AS wanted(tablename, attname)
+                        ON s.tablename = wanted.tablename AND s.attname = wanted.attname
+                    WHERE s.schemaname = current_schema();
+                    """, ([table for table, _ in pairs], [column for _, column in pairs]))
+                    for tablename, attname, n_distinct, null_frac, avg_width, mcv, mcf, histogram, correlation in cur.fetchall():
+                        columns[(tablename, attname)] = {
+                            "n_distinct": n_distinct,
+                            "null_frac": null_frac,
+                            "avg_width": avg_width,
+                            "most_common_vals": mcv or [],
+                            "most_common_freqs": mcf or [],
+                            "histogram_bounds": histogram or [],
+                            "correlation": correlation
+                        }
+                indexes = _fetch_indexes(cur, table_names)
     except Exception as e:
         print(f"Error: {e}")
+    snapshot = StatsSnapshot(relations, columns, indexes)
+    # Prime the statistics cache so direct get_blocks / get_unique_count calls are served too
+    for table, relation in relations.items():
+        _stats_cache.put((table, "get_blocks"), relation["blocks"])
+        if relation["width"] is not None:
+            _stats_cache.put((table, "get_tuple_width"), relation["width"])
+    for table, table_indexes in indexes.items():
+        _stats_cache.put((table, "get_indexes"), table_indexes)
+    for table, column in columns:
+        _stats_cache.put((table, "get_column_stats", column), columns[(table, column)])
+        unique_count = snapshot.get_unique_count(table, column)
+        if unique_count is not None:
+            _stats_cache.put((table, "get_unique_count", column), unique_count)
+    return snapshot
 
 if __name__ == "__main__":
     table = "lineitem"
     key = "l_extendedprice"
-    conn = psycopg2.connect(
-        dbname=dbname,
-        user=user,
-        password=password,
-        host=host,
-        port=port
-    )
-    print(f"Get row count of {table}: {get_row_count(conn, table)}")
+    with pooled_connection() as conn:
+        print(f"Get row count of {table}: {get_row_count(conn, table)}")
     print(f"Number of tuples in {table}: {query_row_counts()[table]}")
     print(f"Unique count of {table}: {get_unique_count(table, key)}")
     print(f"Number of working blocks: {get_no_working_blocks()}")
-    print(f"Get blocks in {table} : {get_blocks(table)}")
\ No newline at end of file
+    print(f"Get blocks in {table} : {get_blocks(table)}")
+    print(f"Get blocks in {table} (cached): {get_blocks(table)}")
+    print(f"Tuple width of {table}: {get_tuple_width(table)}")
+    print(f"Indexes of {table}: {get_indexes(table)}")
+    print(f"Connection pool: {get_pool_stats()}")
+    print(f"Statistics cache: {get_stats_cache_stats()}")
@@ -0,0 +1,171 @@
+import math
+from constants import SCANS, JOINS
+from pgconn import get_planner_settings
+from whatif import block_size
+
+# Postgres defaults of the planner settings, used when pg_settings cannot be read
+default_planner_settings = {
+    "seq_page_cost": 1.0,
+    "random_page_cost": 4.0,
+    "cpu_tuple_cost": 0.01,
+    "cpu_index_tuple_cost": 0.005,
+    "cpu_operator_cost": 0.0025,
+    "effective_cache_size": 524288,  # blocks (4GB)
+    "work_mem": 4096  # kB
+}
+# Size of a btree index entry (tuple header, key and line pointer), to estimate the index blocks
+index_tuple_bytes = 32
+# Buffer blocks per input of an external merge (MERGE_BUFFER_SIZE of tuplesort.c)
+merge_buffer_blocks = 32
+
+class PostgresCostModel:
+    '''
+    Cost model in Postgres planner units, following the structure of costsize.c
+    - settings: planner settings ({name: value} as in pg_settings), defaults for the missing ones
+    Each node is charged its own work only (its children are charged in their nodes), so the total cost
+    of a tree is on the same scale as the "cost=" of the root of a Postgres plan.
+    The name (part of the SubplanMemo keys) includes the settings, so subtrees costed under other settings are not reused.
+    '''
+    cost_label = "Postgres"
+
+    def __init__(self, settings=None):
+        self.settings = dict(default_planner_settings)
+        self.settings.update(settings or {})
+        self.seq_page_cost = self.settings["seq_page_cost"]
+        self.random_page_cost = self.settings["random_page_cost"]
+        self.cpu_tuple_cost = self.settings["cpu_tuple_cost"]
+        self.cpu_index_tuple_cost = self.settings["cpu_index_tuple_cost"]
+        self.cpu_operator_cost = self.settings["cpu_operator_cost"]
+        self.effective_cache_size = self.settings["effective_cache_size"]
+        self.work_mem_bytes = self.settings["work_mem"] * 1024
+        self.name = "Postgres(" + ", ".join(f"{key}={value}" for key, value in sorted(self.settings.items())) + ")"
+
+    @classmethod
+    def from_database(cls):
+        '''
+        Cost model with the planner settings of the connected database (pgconn.get_planner_settings)
+        '''
+        return cls(get_planner_settings())
+
+    def index_pages_fetched(self, tuples_fetched, pages):
+        '''
+        Heap blocks read to fetch tuples in index order, with the Mackert-Lohman formula (index_pages_fetched)
+        '''
+        T = max(pages, 1)
+        b = max(self.effective_cache_size, 1)
+        N = tuples_fetched
+        if T <= b:
+            fetched = min(2 * T * N / (2 * T + N), T)
+        else:
+            limit = 2 * T * b / (2 * T - b)
+            fetched = 2 * T * N / (2 * T + N) if N <= limit else b + (N - limit) * (T - b) / T
+        return math.ceil(fetched)
+
+    def index_blocks(self, tuples):
+        return max(math.ceil(tuples * index_tuple_bytes / block_size), 1)
+
+    def index_cost(self, path, tuples, selectivity):
+        '''
+        Cost of reading the matching entries of an index (btcostestimate): descent and leaf blocks, per entry cpu
+        - path: access path (accesspath.access_path), None to estimate the index size from the tuples
+        '''
+        matched = tuples * selectivity
+        index_pages = path["pages"] if path is not None and path["pages"] else self.index_blocks(tuples)
+        descent = path["levels"] if path is not None else 1
+        return (self.random_page_cost * (descent + math.ceil(selectivity * index_pages))
+                + (self.cpu_index_tuple_cost + self.cpu_operator_cost) * matched)
+
+    def source_cost(self, scan_type, number_of_blocks, tuples, selectivity, path=None):
+        '''
+        Cost of scanning a relation (cost_seqscan, cost_index, cost_bitmap_heap_scan)
+        - selectivity: fraction of the tuples fetched, the index and bitmap scans only read these
+        - path: access path of an index or bitmap scan (accesspath.scan_access_path), None if the index is unknown
+        '''
+        number_of_blocks = number_of_blocks or 0
+        tuples = tuples or 0
+        if scan_type not in SCANS[1:]:
+            return self.seq_page_cost * number_of_blocks + self.cpu_tuple_cost * tuples
+        matched = tuples * selectivity
+        index_cost = self.index_cost(path, tuples, selectivity)
+        if scan_type == SCANS[2]:
+            # Index scan: heap blocks fetched in random order, or in physical order when the column is correlated
+            max_IO_cost = self.random_page_cost * self.index_pages_fetched(matched, number_of_blocks)
+            min_pages = max(math.ceil(selectivity * number_of_blocks), 1)
+            min_IO_cost = self.random_page_cost + (min_pages - 1) * self.seq_page_cost
+            correlation = path["correlation"] if path is not None else 0
+            heap_cost = max_IO_cost + correlation ** 2 * (min_IO_cost - max_IO_cost)
+        else:
+            # Bitmap heap scan: heap blocks fetched in physical order, the cost per block moves from random to sequential
+            pages_fetched = min(2 * number_of_blocks * matched / (2 * number_of_blocks + matched) if number_of_blocks else 0, number_of_blocks)
+            if pages_fetched >= 2:
+                cost_per_page = self.random_page_cost - (self.random_page_cost - self.seq_page_cost) * math.sqrt(pages_fetched / number_of_blocks)
+            else:
+                cost_per_page = self.random_page_cost
+            heap_cost = pages_fetched * cost_per_page + self.cpu_operator_cost * matched
+        return index_cost + heap_cost + self.cpu_tuple_cost * matched
+
+    def selection_cost(self, tuples, predicates):
+        '''
+        Cost of evaluating the selection predicates on every scanned tuple
+        '''
+        return self.cpu_operator_cost * predicates * (tuples or 0)
+
+    def sort_cost(self, tuples, blocks):
+        '''
+        Cost of sorting an input (cost_sort): comparisons, plus the run IO of an external merge sort above work_mem
+        '''
+        tuples = max(tuples, 2)
+        cost = 2 * self.cpu_operator_cost * tuples * math.log2(tuples)
+        input_bytes = blocks * block_size
+        if input_bytes > self.work_mem_bytes:
+            runs = input_bytes / (2 * self.work_mem_bytes)
+            merge_order = max(6, int(self.work_mem_bytes / ((merge_buffer_blocks + 1) * block_size)))
+            passes = math.ceil(math.log(max(runs, 2)) / math.log(merge_order))
+            # Writes and reads of every pass, 3/4 sequential
+            cost += 2 * blocks * passes * (0.75 * self.seq_page_cost + 0.25 * self.random_page_cost)
+        return cost
+
+    def join_cost(self, join_type, tuples_1, block_1, V_1, tuples_2, block_2, V_2, tuples, M, path_1=None, path_2=None):
+        '''
+        Cost of a join (cost_hashjoin, cost_mergejoin, cost_nestloop), M is not used: memory comes from work_mem
+        - path_n: access path of an index on the join column of side n, an index join probes the side with an index
+        '''
+        # The smaller side is the inner (hash build side, rescanned side)
+        if tuples_1 <= tuples_2:
+            inner_tuples, inner_blocks, inner_V, outer_tuples, outer_blocks = tuples_1, block_1, V_1, tuples_2, block_2
+        else:
+            inner_tuples, inner_blocks, inner_V, outer_tuples, outer_blocks = tuples_2, block_2, V_2, tuples_1, block_1
+        output_cost = self.cpu_tuple_cost * tuples
+        # Hash
+        if join_type == JOINS[0]:
+            cost = ((self.cpu_operator_cost + self.cpu_tuple_cost) * inner_tuples
+                    + self.cpu_operator_cost * outer_tuples + self.cpu_operator_cost * tuples)
+            if inner_blocks * block_size > self.work_mem_bytes:
+                # Batches of both sides are written and read back once
+                cost += self.seq_page_cost * 2 * (inner_blocks + outer_blocks)
+            return cost + output_cost
+        # Nested loop: the inner side is materialized and rescanned for every outer tuple
+        if join_type == JOINS[1]:
+            rescan = self.cpu_operator_cost * inner_tuples
+            if inner_blocks * block_size > self.work_mem_bytes:
+                rescan += self.seq_page_cost * inner_blocks
+            return max(outer_tuples - 1, 0) * rescan + self.cpu_operator_cost * outer_tuples * inner_tuples + output_cost
+        # Merge: both sides are sorted first
+        if join_type == JOINS[2]:
+            return (self.sort_cost(tuples_1, block_1) + self.sort_cost(tuples_2, block_2)
+                    + self.cpu_operator_cost * (tuples_1 + tuples_2) + output_cost)
+        # Index/Index only: nested loop probing an index of the inner side for every outer tuple
+        sides = [(tuples_1, block_1, V_1, path_1, tuples_2), (tuples_2, block_2, V_2, path_2, tuples_1)]
+        probed = [side for side in sides if side[3] is not None] or [(inner_tuples, inner_blocks, inner_V, None, outer_tuples)]
+        costs = []
+        for inner_tuples, inner_blocks, inner_V, path, outer_tuples in probed:
+            matched = inner_tuples / max(inner_V or 1, 1)
+            probe = (self.cpu_operator_cost * math.ceil(math.log2(max(inner_tuples, 2)))
+                     + (self.cpu_index_tuple_cost + self.cpu_tuple_cost) * matched)
+            index_pages = path["pages"] if path is not None and path["pages"] else self.index_blocks(inner_tuples)
+            cost = outer_tuples * probe + self.random_page_cost * index_pages
+            if join_type != JOINS[4]:
+                # The heap blocks of the repeated probes are cached across the loop
+                cost += self.random_page_cost * self.index_pages_fetched(outer_tuples * matched, inner_blocks)
+            costs.append(cost)
+        return min(costs) + output_cost
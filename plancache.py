@@ -0,0 +1,228 @@
+import copy
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from decimal import Decimal, InvalidOperation
+from pgconn import get_table_versions
+
+# Plan cache parameters
+plan_cache_size = 64  # plans kept in memory before the least recently used one is evicted
+plan_cache_file = "generated_plan_cache.json"  # on-disk tier, None to keep the cache in memory only
+
+CLAUSE_END = r"(?=\s+(?:WHERE|GROUP\s+BY|ORDER\s+BY|HAVING|LIMIT)\b|\s*;?\s*$)"
+
+def parse_aliases(sql_query):
+    '''
+    Map the aliases of the FROM clause to their tables
+    - sql_query: The SQL query string
+    returns: {alias: table}, in FROM clause order
+    '''
+    aliases = {}
+    match = re.search(r"\bFROM\s+(.*?)" + CLAUSE_END, sql_query, re.IGNORECASE | re.DOTALL)
+    if not match:
+        return aliases
+    for item in match.group(1).split(","):
+        parts = [part for part in item.split() if part.upper() != "AS"]
+        if not parts:
+            continue
+        table = parts[0].lower()
+        alias = parts[1].lower() if len(parts) > 1 else table
+        aliases[alias] = table
+    return aliases
+
+def canonical_aliases(aliases):
+    '''
+    Canonical name of each alias: its table, numbered by occurrence when the table appears more than once
+    (FROM nation n1, nation n2 -> n1: nation#1, n2: nation#2), so that self-joins keep their aliases apart
+    - aliases: {alias: table} from parse_aliases, in FROM clause order
+    returns: {alias: canonical name}
+    '''
+    tables = list(aliases.values())
+    seen = {}
+    canonical = {}
+    for alias, table in aliases.items():
+        seen[table] = seen.get(table, 0) + 1
+        canonical[alias] = f"{table}#{seen[table]}" if tables.count(table) > 1 else table
+    return canonical
+
+def _normalize_number(literal):
+    try:
+        return format(Decimal(literal).normalize(), "f")
+    except InvalidOperation:
+        return literal
+
+def fingerprint_sql(sql_query):
+    '''
+    Normalized fingerprint of a query used as the plan cache key
+    - whitespace, comments and keyword/identifier case are normalized
+    - aliases are replaced by their canonical name (canonical_aliases)
+    - numeric literals are written in canonical form (1000.00 -> 1000); literal values are kept
+      because the cached EXPLAIN ANALYSE rows depend on them
+    returns: fingerprint string
+    '''
+    sql = re.sub(r"--[^\n]*|/\*.*?\*/", " ", sql_query, flags=re.DOTALL)
+    aliases = parse_aliases(sql)
+    canonical = canonical_aliases(aliases)
+    tokens = []
+    for string_literal, number, word, symbol in re.findall(r"('(?:[^']|'')*')|(\b\d+(?:\.\d+)?\b)|([A-Za-z_]\w*)|(\S)", sql):
+        if string_literal:
+            tokens.append(string_literal)
+        elif number:
+            tokens.append(_normalize_number(number))
+        elif word:
+            tokens.append(word.lower())
+        else:
+            tokens.append(symbol)
+    # Rewrite alias.column references and drop the alias declarations of the FROM clause
+    normalized = []
+    in_from = False
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in ("where", "group", "order", "having", "limit"):
+            in_from = False
+        if in_from and token in aliases.values() and i + 1 < len(tokens):
+            i += 1
+            if tokens[i] == "as":
+                i += 1
+            if i < len(tokens) and tokens[i] in aliases and aliases[tokens[i]] == token:
+                normalized.append(canonical[tokens[i]])
+                i += 1
+            else:
+                normalized.append(canonical.get(token, token))
+            continue
+        if token in aliases and i + 1 < len(tokens) and tokens[i + 1] == ".":
+            normalized.append(canonical[token])
+        else:
+            normalized.append(token)
+        if token == "from":
+            in_from = True
+        i += 1
+    return " ".join(normalized)
+
+def rename_aliases(obj, mapping):
+    '''
+    Rename the aliases of a cached plan tree or structured dict to the aliases of the new query
+    - obj: plan tree / structured dict (nested dicts, lists and strings)
+    - mapping: {old alias: new alias}
+    '''
+    if not mapping:
+        return obj
+    reference = re.compile(r"\b(" + "|".join(re.escape(old) for old in mapping) + r")\.")
+    def rename_string(value):
+        return reference.sub(lambda m: mapping[m.group(1)] + ".", value)
+    def walk(value, key=None):
+        if isinstance(value, dict):
+            return {k: walk(v, k) for k, v in value.items()}
+        if isinstance(value, list):
+            return [walk(v, key) for v in value]
+        if isinstance(value, str):
+            if key == "alias":
+                return mapping.get(value, value)
+            if key == "details":
+                value = re.sub(r"( on \w+ )(\w+)", lambda m: m.group(1) + mapping.get(m.group(2), m.group(2)), value)
+            return rename_string(value)
+        return value
+    return walk(obj)
+
+class PlanCache:
+    '''
+    Cache of parsed execution plans keyed on the SQL fingerprint
+    - max_entries: plans kept before the least recently used one is evicted
+    - path: JSON file of the on-disk tier (loaded on creation, rewritten on every store), None to disable
+    - stats: counters for hits, misses, invalidations and evictions
+    An entry is only reused while pg_stat_user_tables shows its tables were neither analyzed nor modified.
+    '''
+    def __init__(self, max_entries=64, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding='utf-8') as f:
+                for entry in json.load(f):
+                    self._entries[entry["key"]] = entry
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error: {e}")
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, "w", encoding='utf-8') as f:
+                json.dump(list(self._entries.values()), f)
+        except OSError as e:
+            print(f"Error: {e}")
+
+    @staticmethod
+    def make_key(sql_query, plan_format, mode):
+        return f"{plan_format}:{mode}:{fingerprint_sql(sql_query)}"
+
+    def get(self, sql_query, plan_format="json", mode="analyze"):
+        '''
+        Look up the plan of a query
+        - mode: retrieval mode of the plan (pgconn.get_execution_plan), estimate and analyzed plans are kept apart
+        returns: (tree, structured_format) with the aliases of sql_query, or None on a miss
+        '''
+        key = self.make_key(sql_query, plan_format, mode)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        if get_table_versions(list(entry["versions"])) != entry["versions"]:
+            with self._lock:
+                self._entries.pop(key, None)
+                self._save()
+            self.stats["invalidations"] += 1
+            self.stats["misses"] += 1
+            return None
+        with self._lock:
+            self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        # Cached aliases -> aliases of this query, matched through their canonical name
+        new_aliases = {name: alias for alias, name in canonical_aliases(parse_aliases(sql_query)).items()}
+        mapping = {old: new_aliases[name] for old, name in canonical_aliases(entry["aliases"]).items()
+                   if name in new_aliases and new_aliases[name] != old}
+        tree = rename_aliases(copy.deepcopy(entry["tree"]), mapping)
+        structured_format = rename_aliases(copy.deepcopy(entry["structured"]), mapping)
+        return tree, structured_format
+
+    def put(self, sql_query, tree, structured_format, plan_format="json", mode="analyze"):
+        '''
+        Store the parsed plan of a query with the current statistics version of its tables
+        '''
+        aliases = parse_aliases(sql_query)
+        versions = get_table_versions(sorted(set(aliases.values())))
+        if versions is None:
+            return
+        key = self.make_key(sql_query, plan_format, mode)
+        entry = {
+            "key": key,
+            "aliases": aliases,
+            "versions": versions,
+            "tree": copy.deepcopy(tree),
+            "structured": copy.deepcopy(structured_format)
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+            self._save()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._save()
+
+plan_cache = PlanCache(plan_cache_size, plan_cache_file)
@@ -1,8 +1,9 @@
 import re
 from pgconn import query_row_counts,get_execution_plan
+from plancache import plan_cache
 from constants import query_input_1
 import json
-from constants import JOINS,SCANS,FILTERS
+from constants import JOINS,SCANS,FILTERS,JSON_FILTERS
 def parse_tables_from_clause(from_clause):
     '''
     Extract table names and aliases in FROM clause
@@ -28,7 +29,10 @@ def split_conditions(where_clause):
     
     # First clean up the where clause
     where_clause = where_clause.replace('\n', ' ').strip()
+    # Protect the AND of "x BETWEEN low AND high" from the split
+    where_clause = re.sub(r"(\bBETWEEN\s+\S+)\s+AND\s+", r"\1 __BETWEEN_AND__ ", where_clause, flags=re.IGNORECASE)
     result = re.split(r'\s+(?:AND|OR)\s+', where_clause, flags=re.IGNORECASE)
+    result = [condition.replace("__BETWEEN_AND__", "AND") for condition in result]
         
     # Clean up conditions
     return result
@@ -45,24 +49,32 @@ def parse_conditions(where_clause, tables):
     # Split the where clause into individual conditions
     conditions = split_conditions(where_clause)
     for condition in conditions:
+        # BETWEEN and IN predicates are always selections
+        range_match = re.match(r"(.+?)\s+(BETWEEN|IN)\s+(.+)", condition.strip(), re.IGNORECASE)
         # Find comparison operator
-        operators = ['<=', '>=', '=', '<', '>']
+        operators = ['<=', '>=', '!=', '<>', '=', '<', '>']
         operator = None
-        for op in operators:
-            if op in condition:
-                operator = op
-                break
+        if range_match:
+            operator = range_match.group(2).upper()
+        else:
+            for op in operators:
+                if op in condition:
+                    operator = op
+                    break
                 
         if not operator:
             continue
             
-        left_side, right_side = [s.strip() for s in condition.split(operator)]
+        if range_match:
+            left_side, right_side = range_match.group(1).strip(), range_match.group(3).strip()
+        else:
+            left_side, right_side = [s.strip() for s in condition.split(operator, 1)]
         
         # Count dots to determine if the condition is a join or select
         left_dots = left_side.count(".")
         right_dots = right_side.count(".")
 
-        if left_dots == 1 and right_dots == 1 and not right_side.split('.')[0].isdigit():
+        if not range_match and left_dots == 1 and right_dots == 1 and not right_side.split('.')[0].isdigit():
             # It's a join condition
             left_alias, left_column = left_side.split(".")
             right_alias, right_column = right_side.split(".")
@@ -193,6 +205,61 @@ def parse_execution_plan(plan):
             stack.pop()
 
     return root
+def format_json_plan_node(plan_node):
+    """Rebuild the EXPLAIN ANALYSE text line of a JSON plan node (used as the node details)"""
+    details = plan_node['Node Type']
+    if 'Index Name' in plan_node:
+        details += f" using {plan_node['Index Name']}"
+    if 'Relation Name' in plan_node:
+        details += f" on {plan_node['Relation Name']}"
+        if plan_node.get('Alias') and plan_node['Alias'] != plan_node['Relation Name']:
+            details += f" {plan_node['Alias']}"
+    details += f"  (cost={plan_node['Startup Cost']:.2f}..{plan_node['Total Cost']:.2f} rows={plan_node['Plan Rows']} width={plan_node['Plan Width']})"
+    if 'Actual Rows' in plan_node:
+        details += f" (actual time={plan_node.get('Actual Startup Time', 0):.3f}..{plan_node.get('Actual Total Time', 0):.3f} rows={plan_node['Actual Rows']} loops={plan_node['Actual Loops']})"
+    return details
+
+def parse_execution_plan_json(plan_json):
+    """
+    Build the plan tree from EXPLAIN (ANALYZE, FORMAT JSON, BUFFERS) output
+    - plan_json: the plan object returned by get_execution_plan(query, plan_format="json")
+    returns: root node with the same keys as parse_execution_plan (type, details, children, conditions)
+    plus the estimated/actual rows, loops, timings and buffer counters of every node
+    """
+    if plan_json is None:
+        return None
+    plan_root = plan_json['Plan'] if 'Plan' in plan_json else plan_json
+
+    def build_node(plan_node):
+        node = {
+            'type': plan_node['Node Type'],
+            'details': format_json_plan_node(plan_node),
+            'children': [],
+            'relation': plan_node.get('Relation Name'),
+            'alias': plan_node.get('Alias'),
+            'index_name': plan_node.get('Index Name'),
+            'startup_cost': plan_node.get('Startup Cost'),
+            'total_cost': plan_node.get('Total Cost'),
+            'plan_rows': plan_node.get('Plan Rows'),
+            'plan_width': plan_node.get('Plan Width'),
+            'actual_rows': plan_node.get('Actual Rows'),
+            'actual_loops': plan_node.get('Actual Loops'),
+            'actual_startup_time': plan_node.get('Actual Startup Time'),
+            'actual_total_time': plan_node.get('Actual Total Time'),
+            'buffers': {key: value for key, value in plan_node.items() if key.endswith('Blocks')}
+        }
+        for key in JSON_FILTERS:
+            if key in plan_node:
+                node.setdefault('conditions', []).append(plan_node[key])
+        for child in plan_node.get('Plans', []):
+            node['children'].append(build_node(child))
+        return node
+
+    root = build_node(plan_root)
+    root['planning_time'] = plan_json.get('Planning Time')
+    root['execution_time'] = plan_json.get('Execution Time')
+    return root
+
 def print_tree(node, indent="", is_last=True, is_root=True):
     if not node:
         return
@@ -288,6 +355,29 @@ def extract_table_info(details):
             return table, alias
     return None, None
 
+def node_cost_and_rows(node):
+    """Total cost and estimated rows of a plan node, read from the JSON fields when present"""
+    if node.get('total_cost') is not None:
+        return node['total_cost'], node['plan_rows']
+    return extract_cost_and_rows(node['details'])
+
+def node_width(node):
+    """Estimated width of the rows of a plan node in bytes, read from the JSON fields when present"""
+    if node.get('plan_width') is not None:
+        return node['plan_width']
+    match = re.search(r'width=(\d+)', node['details'])
+    return int(match.group(1)) if match else None
+
+def node_table_info(node):
+    """Table name and alias of a plan node, read from the JSON fields when present"""
+    if node.get('relation'):
+        return node['relation'], node.get('alias') or node['relation'][0]
+    return extract_table_info(node['details'])
+
+def strip_type_cast(value):
+    """Remove a trailing ::type cast (and closing parenthesis) from a plan constant, e.g. '1000'::numeric)"""
+    return re.sub(r"::[\w\s]+\)*$", "", value.strip())
+
 def extract_join_condition(condition, is_index_join = False):
     """Extract table aliases and columns from join conditions"""
     if not condition:
@@ -322,6 +412,14 @@ def extract_join_condition(condition, is_index_join = False):
 def parse_execution_plan_to_dict(plan):
     """Parse execution plan and convert to structured dictionary format"""
     tree = parse_execution_plan(plan)  # Using your existing parser
+    return plan_tree_to_dict(tree)
+
+def parse_execution_plan_json_to_dict(plan_json):
+    """Parse an EXPLAIN (FORMAT JSON) plan and convert to structured dictionary format"""
+    return plan_tree_to_dict(parse_execution_plan_json(plan_json))
+
+def plan_tree_to_dict(tree):
+    """Convert a plan tree (text or JSON parser output) to structured dictionary format"""
     result = {
         'operation': 'SELECT + Join',
         'source': [],
@@ -332,19 +430,20 @@ def parse_execution_plan_to_dict(plan):
     def traverse_tree(node):
         if not node:
             return
-        io_cost, tuples_returned = extract_cost_and_rows(node['details'])
+        io_cost, tuples_returned = node_cost_and_rows(node)
         alias = None
         is_a_join = True
         # Handle Seq Scan nodes (source tables)
         if node['type'] in SCANS:
-            table, alias = extract_table_info(node['details'])
+            table, alias = node_table_info(node)
             if table:
                 source_info = {
                     'table': table,
                     'alias': alias,
                     'type': node['type'],
                     'IO_cost': io_cost,
-                    'tuples': tuples_returned
+                    'tuples': tuples_returned,
+                    'width': node_width(node)
                 }
                 result['source'].append(source_info)
             
@@ -354,6 +453,7 @@ def parse_execution_plan_to_dict(plan):
                     match = re.search(r"(\S+)\s*(>|<|=)\s*(\S+)", condition)
                     if match: 
                         left, operator, right = match.groups()
+                        right = strip_type_cast(right)
                         if '.' not in right or right.split(".")[0].strip().isdigit():
                             is_a_join = False
                             select_info = {
@@ -370,8 +470,8 @@ def parse_execution_plan_to_dict(plan):
                             is_a_join = True
         # Handle Join nodes
         if node['type'] in JOINS and is_a_join:
-            io_cost, tuples_returned = extract_cost_and_rows(node['details'])
-            table, alias = extract_table_info(node['details'])
+            io_cost, tuples_returned = node_cost_and_rows(node)
+            table, alias = node_table_info(node)
             if 'conditions' in node:
                 for condition in node['conditions']:
                     if('AND' in condition or 'OR' in condition):
@@ -439,25 +539,57 @@ def parse_execution_plan_to_dict(plan):
     traverse_tree(tree)
     ## Reverse the joins since we want the order to be top down
     result['joins'] = result['joins'][::-1]
+    # False for an EXPLAIN without ANALYSE (estimate mode, or the fallback of bounded mode)
+    result['analyzed'] = tree is not None and (tree.get('actual_rows') is not None or 'actual time=' in tree['details'])
     return result
 
-def process_query_plan_full(sql_query):
-    """Process query plan and return both tree visualization and structured format"""
-    plan = get_execution_plan(sql_query)
-    
-    # Generate tree visualization
-    tree = parse_execution_plan(plan)
+def process_query_plan_full(sql_query, plan_format="text", mode="analyze", timeout_ms=None, use_cache=True, write_files=True, cancel_token=None):
+    """
+    Process query plan and return both tree visualization and structured format
+    - plan_format: "json" to ingest EXPLAIN (ANALYZE, FORMAT JSON, BUFFERS), "text" to scrape the textual plan
+    - mode / timeout_ms / cancel_token: plan retrieval mode of get_execution_plan ("analyze", "estimate" or "bounded")
+      and the token its EXPLAIN can be cancelled with (pgconn.cancel_execution_plan)
+    - use_cache: reuse the plan of an equivalent query from plancache.plan_cache while its tables are unchanged
+    - write_files: save the plan to the generated_postgres_* files shown by the interface
+    returns: (None, None) if the plan could not be retrieved or was cancelled
+    """
+    if use_cache:
+        cached = plan_cache.get(sql_query, plan_format, mode)
+        if cached is not None:
+            return cached
+    if plan_format == "json":
+        plan_json = get_execution_plan(sql_query, plan_format="json", mode=mode, timeout_ms=timeout_ms, cancel_token=cancel_token)
+        if plan_json is None:
+            return None, None
+        tree = parse_execution_plan_json(plan_json)
+        if write_files:
+            with open("generated_postgres_plan.json", "w", encoding='utf-8') as f:
+                json.dump(plan_json, f, indent=2)
+            save_tree_to_file(tree, "generated_postgres_query_plan_tree.txt")
+        structured_format = plan_tree_to_dict(tree)
+    else:
+        plan = get_execution_plan(sql_query, mode=mode, timeout_ms=timeout_ms, cancel_token=cancel_token)
+        if plan is None:
+            return None, None
 
-    with open("generated_postgres_plan.txt", "w", encoding='utf-8') as f:
-        f.write(plan)
-    save_tree_to_file(tree, "generated_postgres_query_plan_tree.txt")
-    
-    # Generate structured dictionary format
-    structured_format = parse_execution_plan_to_dict(plan)
+        # Generate tree visualization
+        tree = parse_execution_plan(plan)
+
+        if write_files:
+            with open("generated_postgres_plan.txt", "w", encoding='utf-8') as f:
+                f.write(plan)
+            save_tree_to_file(tree, "generated_postgres_query_plan_tree.txt")
+
+        # Generate structured dictionary format
+        structured_format = parse_execution_plan_to_dict(plan)
     
     # Save structured format to file
-    with open("generated_postgres_query_plan_structured.json", "w", encoding='utf-8') as f:
-        json.dump(structured_format, f, indent=2)
+    if write_files:
+        with open("generated_postgres_query_plan_structured.json", "w", encoding='utf-8') as f:
+            json.dump(structured_format, f, indent=2)
+
+    if use_cache:
+        plan_cache.put(sql_query, tree, structured_format, plan_format, mode)
     
     return tree, structured_format
     
@@ -4,7 +4,9 @@ import tkinter as tk
 from tkinter import scrolledtext  # Import scrolledtext for multi-line input
 from tkinter import ttk
 from interface import TreeVisualizer
-from pgconn import query_row_counts,get_no_working_blocks
+from pgconn import query_row_counts,get_no_working_blocks,analyze_tables,prefetch_statistics,cancel_execution_plan
+from tasks import TaskExecutor
+from functools import partial
 M=int(get_no_working_blocks())
 Tuples=query_row_counts()
 if M is None:
@@ -124,6 +126,35 @@ SELECT
 
 '''
 ##
+# Retrieve the plan of a query and prefetch its statistics (runs on a worker of the task executor)
+def load_query(task, sql_query):
+    task.report("Retrieving the execution plan")
+    # JSON plan under statement_timeout, only the EXPLAIN of this task is cancelled with it
+    tree, original_QEP_formatted = process_query_plan_full(sql_query, "json", "bounded", cancel_token=task)
+    if original_QEP_formatted is None:
+        return None
+    task.check()
+    task.report("Preprocessing the query")
+    modified_QEP_formatted = preprocess_query(sql_query)
+    task.check()
+    # Fetch the catalog statistics of the whole query in bulk
+    task.report("Fetching catalog statistics")
+    stats = prefetch_statistics(modified_QEP_formatted)
+    return original_QEP_formatted, modified_QEP_formatted, stats
+
+# Show a query loaded by load_query (on the Tk thread)
+def show_query(result, screen_ratios=(2.5, 2.5)):
+    if result is None:
+        print("Error: could not retrieve the execution plan")
+        return
+    original_QEP_formatted, modified_QEP_formatted, stats = result
+    for item in original_QEP_formatted["source"]:
+        table_name = item["table"]
+        if table_name in Tuples:
+            Tuples[table_name] = item["tuples"]
+    # Recreate the TreeVisualizers
+    recreate_visualizers(original_QEP_formatted, modified_QEP_formatted, stats, screen_ratios)
+
 # Function to open the overlay input box
 def open_sql_input_overlay():
     # Create a Toplevel window for the SQL input box
@@ -146,22 +177,20 @@ def open_sql_input_overlay():
         sql_query = query_input.get("1.0", tk.END).strip()  # Get the input SQL query
         overlay.destroy()  # Close the overlay
 
-        # Process the SQL query
-        tree, original_QEP_formatted = process_query_plan_full(sql_query)
-        modified_QEP_formatted = preprocess_query(sql_query)
-        for item in original_QEP_formatted["source"]:
-            table_name = item["table"]
-            if table_name in Tuples:
-                Tuples[table_name] = item["tuples"]
-        # Recreate the TreeVisualizers
-        recreate_visualizers(original_QEP_formatted, modified_QEP_formatted)
+        # Process the SQL query in the background, a query still loading is cancelled and its result discarded
+        executor.submit("query", load_query, sql_query, on_done=show_query, cancel_hook=cancel_execution_plan)
 
     # Add a Submit button
     submit_button = tk.Button(overlay, text="Submit", command=submit_query)
     submit_button.pack(pady=10)
 
 # Function to recreate TreeVisualizers
-def recreate_visualizers(original_QEP, modified_QEP):
+def recreate_visualizers(original_QEP, modified_QEP, stats=None, screen_ratios=(2.5, 2.5)):
+    global visualizer1, visualizer2
+    # Results of the old visualizers are discarded
+    for visualizer in (visualizer1, visualizer2):
+        if visualizer is not None:
+            visualizer.cancel_tasks()
     # Clear existing frames
     for widget in frame1.winfo_children():
         widget.destroy()
@@ -169,9 +198,8 @@ def recreate_visualizers(original_QEP, modified_QEP):
         widget.destroy()
 
     # Recreate TreeVisualizers
-    global visualizer1, visualizer2
-    visualizer1 = TreeVisualizer(frame1, original_QEP, use_dict_IO_tuples=True, disable_buttons=True, screen_ratio=2.5, Tuples=Tuples, M=M)
-    visualizer2 = TreeVisualizer(frame2, modified_QEP, use_dict_IO_tuples=False, disable_buttons=False, screen_ratio=2.5, Tuples=Tuples, M=M)
+    visualizer1 = TreeVisualizer(frame1, original_QEP, use_dict_IO_tuples=True, disable_buttons=True, screen_ratio=screen_ratios[0], Tuples=Tuples, M=M)
+    visualizer2 = TreeVisualizer(frame2, modified_QEP, use_dict_IO_tuples=False, disable_buttons=False, screen_ratio=screen_ratios[1], Tuples=Tuples, M=M, stats=stats, executor=executor)
 
 # Root window setup
 root = tk.Tk()
@@ -220,18 +248,49 @@ def set_min_size_based_on_canvas():
 
 root.after(100, set_min_size_based_on_canvas)
 
-tree, original_QEP_formatted = process_query_plan_full(sql_query)
-modified_QEP_formatted = preprocess_query(sql_query)
-for item in original_QEP_formatted["source"]:
-    table_name = item["table"]
-    if table_name in Tuples:
-        Tuples[table_name] = item["tuples"]
-visualizer1 = TreeVisualizer(frame1, original_QEP_formatted, use_dict_IO_tuples=True, disable_buttons=True, screen_ratio=3, Tuples=Tuples, M=M)
-visualizer2 = TreeVisualizer(frame2, modified_QEP_formatted, use_dict_IO_tuples=False, disable_buttons=False, screen_ratio=2, Tuples=Tuples, M=M)
+# Progress of the background work, the database is never queried on the Tk thread once the window is up
+status_label = tk.Label(root, text="", font=("Arial", 10))
+executor = TaskExecutor(root, on_status=lambda message: status_label.config(text=message))
+
+# Load the initial query in the background
+visualizer1 = visualizer2 = None
+executor.submit("query", load_query, sql_query, on_done=lambda result: show_query(result, (3, 2)), cancel_hook=cancel_execution_plan)
 
 # Add a button to open the SQL input overlay
 overlay_button = tk.Button(root, text="Enter SQL Query", command=open_sql_input_overlay)
 overlay_button.pack(pady=10)
 
+# Cancel the query being loaded (its EXPLAIN ANALYSE is cancelled on the server)
+cancel_button = tk.Button(root, text="Cancel", command=lambda: executor.cancel("query"))
+cancel_button.pack(pady=10)
+status_label.pack(pady=10)
+
+# Re-ANALYZE the tables and fetch the new statistics of the modified QEP (runs on a worker)
+def reanalyze(task, query_dict):
+    task.report("Analyzing the tables")
+    analyze_tables()
+    task.check()
+    task.report("Fetching catalog statistics")
+    return query_row_counts(), prefetch_statistics(query_dict)
+
+# Drop the cached catalog statistics and re-estimate the modified QEP
+def show_reanalyzed(result, visualizer):
+    row_counts, stats = result
+    if row_counts is not None:
+        Tuples.update(row_counts)
+    # A query submitted meanwhile was prefetched with the new statistics already
+    if visualizer is not visualizer2:
+        return
+    visualizer2.set_stats(stats)
+
+def reanalyze_tables():
+    if visualizer2 is None:
+        return
+    executor.submit("analyze", reanalyze, visualizer2.query_dict, on_done=partial(show_reanalyzed, visualizer=visualizer2))
+
+analyze_button = tk.Button(root, text="Re-ANALYZE Tables", command=reanalyze_tables)
+analyze_button.pack(pady=10)
+
 # Run the application
-root.mainloop()
\ No newline at end of file
+root.mainloop()
+executor.shutdown()
\ No newline at end of file
@@ -0,0 +1,254 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import time
+from xml.sax.saxutils import escape
+from layout import TextMetrics, layout_tree, box_padding
+from whatif import get_nodes_and_edges, build_query_tree, total_IO_cost, get_cost_model
+from preprocessing import parse_execution_plan, parse_execution_plan_json, node_cost_and_rows, node_table_info, preprocess_query, process_query_plan_full
+from pgconn import query_row_counts, get_no_working_blocks, prefetch_statistics
+from joingraph import query_join_graph
+
+# Estimated text metrics of the node font (Arial 10pt, as on the canvas) without a display to measure with
+char_width = 7
+line_height = 16
+wrap_width = 150
+font_size_px = 13
+# Output formats, png is converted from the DOT source by Graphviz (dot must be on the PATH)
+formats = ("svg", "dot", "png")
+
+def format_number(value):
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    return str(value)
+
+def query_tree_diagram(root, cost_model=None):
+    '''
+    Nodes and edges of a QueryNode tree from whatif.build_query_tree, with the texts of the interface
+    returns: ids (preorder, root first), {id: text}, edges (parent id, child id)
+    '''
+    nodes, edges = get_nodes_and_edges(root)
+    cost_label = get_cost_model(cost_model).cost_label
+    texts = {}
+    for node_id, node_type, value, IO_cost, tuples, Q_type in nodes:
+        texts[node_id] = f"{node_type}: {value}\nEst {cost_label}: {format_number(IO_cost)}, Est Tup: {format_number(tuples)}\nType: {Q_type}"
+    return [node[0] for node in nodes], texts, edges
+
+def plan_tree_diagram(root):
+    '''
+    Nodes and edges of a Postgres plan tree from preprocessing.parse_execution_plan(_json)
+    returns: ids (preorder, root first), {id: text}, edges (parent id, child id)
+    '''
+    ids = []
+    texts = {}
+    edges = []
+    def traverse(node):
+        node_id = len(ids)
+        ids.append(node_id)
+        lines = [node['type']]
+        table, alias = node_table_info(node)
+        if table is not None and node['type'] not in ("Hash Join", "Merge Join", "Nested Loop"):
+            lines[0] += f" on {table} {alias}"
+        if node.get('index_name'):
+            lines.append(f"using {node['index_name']}")
+        for condition in node.get('conditions', []):
+            lines.append(condition)
+        cost, rows = node_cost_and_rows(node)
+        lines.append(f"Cost: {format_number(cost)}, Rows: {format_number(rows)}")
+        if node.get('actual_rows') is not None:
+            lines.append(f"Actual rows: {node['actual_rows']} x {node['actual_loops']}, {node['actual_total_time']:.3f} ms")
+        texts[node_id] = "\n".join(lines)
+        for child in node['children']:
+            child_id = traverse(child)
+            edges.append((node_id, child_id))
+        return node_id
+    traverse(root)
+    return ids, texts, edges
+
+def layout_diagram(ids, texts, edges, metrics):
+    '''
+    Box sizes and positions of a diagram (layout.layout_tree)
+    returns: {id: wrapped lines}, {id: (width, height)} of the boxes, {id: (x, y)}, (width, height) of the drawing
+    '''
+    lines = {node_id: metrics.wrap(texts[node_id]) for node_id in ids}
+    box_sizes = {}
+    for node_id in ids:
+        width, height = metrics.size(texts[node_id])
+        box_sizes[node_id] = (width + 2 * box_padding, height + 2 * box_padding)
+    positions, size = layout_tree([(node_id,) for node_id in ids], edges, box_sizes)
+    return lines, box_sizes, positions, size
+
+def to_svg(ids, texts, edges, title=None, metrics=None):
+    '''
+    SVG drawing of a diagram, laid out like the canvas of the interface
+    '''
+    metrics = metrics or TextMetrics(lambda text: char_width * len(text), line_height, wrap_width)
+    lines, box_sizes, positions, (width, height) = layout_diagram(ids, texts, edges, metrics)
+    top = 2 * line_height if title else 0
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:.0f}" height="{height + top:.0f}" '
+             f'font-family="Arial" font-size="{font_size_px}px">',
+             '<defs><marker id="arrow" markerWidth="10" markerHeight="8" refX="10" refY="4" orient="auto">'
+             '<path d="M0,0 L10,4 L0,8 z"/></marker></defs>',
+             f'<rect width="100%" height="100%" fill="white"/>']
+    if title:
+        parts.append(f'<text x="{box_padding}" y="{line_height * 1.5:.0f}" font-weight="bold">{escape(title)}</text>')
+    # Edges from the top of each child box to the bottom of its parent box
+    for parent_id, child_id in edges:
+        parent_x, parent_y = positions[parent_id]
+        child_x, child_y = positions[child_id]
+        parts.append(f'<line x1="{child_x:.1f}" y1="{child_y - box_sizes[child_id][1] / 2 + top:.1f}" '
+                     f'x2="{parent_x:.1f}" y2="{parent_y + box_sizes[parent_id][1] / 2 + top:.1f}" '
+                     f'stroke="black" marker-end="url(#arrow)"/>')
+    for node_id in ids:
+        x, y = positions[node_id]
+        box_width, box_height = box_sizes[node_id]
+        y += top
+        parts.append(f'<rect x="{x - box_width / 2:.1f}" y="{y - box_height / 2:.1f}" width="{box_width:.1f}" '
+                     f'height="{box_height:.1f}" fill="lightblue" stroke="black"/>')
+        first_line = y - box_height / 2 + box_padding + line_height * 0.75
+        spans = "".join(f'<tspan x="{x:.1f}" y="{first_line + i * line_height:.1f}">{escape(line)}</tspan>'
+                        for i, line in enumerate(lines[node_id]))
+        parts.append(f'<text text-anchor="middle">{spans}</text>')
+    parts.append('</svg>')
+    return "\n".join(parts)
+
+def to_dot(ids, texts, edges, title=None):
+    '''
+    Graphviz DOT source of a diagram (laid out by dot, root at the top, arrows towards the parents)
+    '''
+    def quote(text):
+        return '"' + text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+    parts = ["digraph plan {",
+             '  node [shape=box, style=filled, fillcolor=lightblue, fontname="Arial", fontsize=10];',
+             "  edge [dir=back];"]
+    if title:
+        parts.append(f"  label={quote(title)}; labelloc=t;")
+    for node_id in ids:
+        parts.append(f"  n{node_id} [label={quote(texts[node_id])}];")
+    for parent_id, child_id in edges:
+        parts.append(f"  n{parent_id} -> n{child_id};")
+    parts.append("}")
+    return "\n".join(parts)
+
+def write_diagram(ids, texts, edges, path, output_format, title=None):
+    '''
+    Write a diagram to a file in svg, dot or png format
+    returns: True if the file was written
+    '''
+    try:
+        if output_format == "svg":
+            with open(path, "w", encoding='utf-8') as f:
+                f.write(to_svg(ids, texts, edges, title))
+        elif output_format == "dot":
+            with open(path, "w", encoding='utf-8') as f:
+                f.write(to_dot(ids, texts, edges, title))
+        elif output_format == "png":
+            subprocess.run(["dot", "-Tpng", "-o", path], input=to_dot(ids, texts, edges, title).encode(), check=True)
+        else:
+            raise ValueError(f"Unknown output format: {output_format}")
+        return True
+    except Exception as e:
+        print(f"Error: {e}")
+        return False
+
+def load_plan_file(path):
+    '''
+    Parse a saved plan: EXPLAIN (FORMAT JSON) output (.json) or textual EXPLAIN output (any other extension)
+    '''
+    with open(path, encoding='utf-8') as f:
+        content = f.read()
+    if path.endswith(".json"):
+        plan_json = json.loads(content)
+        # psql prints the JSON plan as a one element list
+        if isinstance(plan_json, list):
+            plan_json = plan_json[0]
+        return parse_execution_plan_json(plan_json)
+    return parse_execution_plan(content)
+
+def modified_tree(query_dict, Tuples, M, stats=None, cost_model=None):
+    '''
+    QueryNode tree of the modified QEP of a query in its first valid join order (as first shown by the interface)
+    '''
+    try:
+        join_order = next(query_join_graph(query_dict["joins"]).valid_orders(), ())
+        return build_query_tree(query_dict, list(join_order), False, Tuples, M, stats, None, cost_model)[0]
+    except Exception as e:
+        print(f"Error: {e}")
+        return None
+
+def render_inputs(inputs, out_dir, output_formats=("svg",), mode="estimate"):
+    '''
+    Render the Postgres plan (and the modified QEP of SQL inputs) of each input to out_dir
+    - inputs: .sql files, saved plans (.json / .txt, rendered without database) or directories of them
+    - mode: plan retrieval mode of the SQL inputs (pgconn.get_execution_plan), "estimate" runs no query
+    returns: paths of the written files
+    '''
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths += sorted(os.path.join(item, name) for name in os.listdir(item) if name.endswith((".sql", ".json", ".txt")))
+        else:
+            paths.append(item)
+    if "png" in output_formats and shutil.which("dot") is None:
+        print("Error: png output needs Graphviz (dot) on the PATH, rendering the other formats")
+        output_formats = [output_format for output_format in output_formats if output_format != "png"]
+    os.makedirs(out_dir, exist_ok=True)
+    database = None
+    written = []
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        diagrams = []
+        if path.endswith(".sql"):
+            if database is None:
+                database = (query_row_counts() or {}, get_no_working_blocks() or 16384)
+            with open(path, encoding='utf-8') as f:
+                sql_query = f.read().strip().rstrip(";")
+            # Batch renders neither touch the shared plan cache nor overwrite the files of the interface
+            plan_tree, _ = process_query_plan_full(sql_query, "json", mode, use_cache=False, write_files=False)
+            if plan_tree is None:
+                print(f"Error: could not retrieve the execution plan of {path}")
+                continue
+            diagrams.append(("postgres", plan_tree_diagram(plan_tree), f"{name}: Postgres plan"))
+            # Only the queries in the syntax of preprocess_query have a modified QEP
+            try:
+                query_dict = preprocess_query(sql_query)
+            except Exception as e:
+                print(f"Error: {e}")
+                query_dict = None
+            if query_dict is not None:
+                tree = modified_tree(query_dict, database[0], database[1], prefetch_statistics(query_dict))
+                if tree is not None:
+                    diagrams.append(("modified", query_tree_diagram(tree), f"{name}: modified QEP, total IO {format_number(total_IO_cost(tree))}"))
+        else:
+            try:
+                plan_tree = load_plan_file(path)
+            except Exception as e:
+                print(f"Error: {e}")
+                continue
+            if plan_tree is None:
+                print(f"Error: no plan found in {path}")
+                continue
+            diagrams.append(("postgres", plan_tree_diagram(plan_tree), f"{name}: Postgres plan"))
+        for kind, (ids, texts, edges), title in diagrams:
+            for output_format in output_formats:
+                output = os.path.join(out_dir, f"{name}_{kind}.{output_format}")
+                if write_diagram(ids, texts, edges, output, output_format, title):
+                    written.append(output)
+    return written
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render query plans to SVG, DOT or PNG without a display")
+    parser.add_argument("inputs", nargs="+", help=".sql files, saved plans (.json EXPLAIN FORMAT JSON, .txt EXPLAIN) or directories")
+    parser.add_argument("-o", "--out", default="rendered", help="output directory (default: rendered)")
+    parser.add_argument("-f", "--format", action="append", choices=formats, help="output format, repeatable (default: svg)")
+    parser.add_argument("--mode", default="estimate", choices=("estimate", "analyze", "bounded"),
+                        help="plan retrieval of .sql inputs (default: estimate, the query is not executed)")
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    written = render_inputs(args.inputs, args.out, args.format or ["svg"], args.mode)
+    print(f"{len(written)} files written to {args.out} in {time.perf_counter() - start:.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+import math
+import random
+import time
+from batchcost import prepare_cost_inputs, encode_join_orders, evaluate_join_orders
+from whatif import build_query_tree, total_IO_cost, get_cost_model, IOCostModel, SubplanMemo
+
+# Relations from which the heuristic search replaces the exhaustive optimizer (as geqo_threshold in Postgres)
+heuristic_threshold = 12
+# Seconds a heuristic search may run for
+default_time_budget = 1.0
+# Genetic algorithm settings
+population_size = 64
+elite_size = 2
+mutation_rate = 0.2
+# Simulated annealing temperatures, on the log of the cost (a temperature of 0.5 accepts ~60% of moves 1.3x worse)
+start_temperature = 0.5
+end_temperature = 0.001
+
+class JoinOrderCosts:
+    '''
+    Cost join orders with the vectorized whatif model, remembering every order already costed
+    - inputs: output of batchcost.prepare_cost_inputs
+    - scalar_cost: cost of one join order, replaces the vectorized evaluation (which implements the IO model only)
+    '''
+    def __init__(self, inputs, scalar_cost=None):
+        self.inputs = inputs
+        self.n_joins = len(inputs["join_aliases"])
+        self.scalar_cost = scalar_cost
+        self.cache = {}
+
+    def costs(self, orders):
+        '''
+        Total IO cost of each order, inf for orders the whatif model cannot build
+        '''
+        orders = [tuple(order) for order in orders]
+        missing = list(dict.fromkeys(order for order in orders if order not in self.cache))
+        if missing and self.scalar_cost is not None:
+            for order in missing:
+                self.cache[order] = self.scalar_cost(order)
+        elif missing:
+            io, _, valid = evaluate_join_orders(self.inputs, encode_join_orders(missing, self.n_joins))
+            for order, cost, is_valid in zip(missing, io, valid):
+                self.cache[order] = float(cost) if is_valid else math.inf
+        return [self.cache[order] for order in orders]
+
+    def cost(self, order):
+        return self.costs([order])[0]
+
+def greedy_join_order(inputs):
+    '''
+    Greedy operator ordering: repeatedly perform the join with the smallest estimated result
+    among the joins between two different intermediate relations
+    returns: join order
+    '''
+    component = list(range(len(inputs["aliases"])))
+    tuples = list(inputs["leaf_tuples"])
+    remaining = list(range(len(inputs["join_aliases"])))
+    order = []
+    while remaining:
+        best = None
+        for join_index in remaining:
+            alias_1, alias_2 = inputs["join_aliases"][join_index]
+            component_1, component_2 = component[alias_1], component[alias_2]
+            if component_1 == component_2:
+                continue
+            V_1, V_2 = inputs["join_unique"][join_index]
+            V_1 = tuples[component_1] if math.isnan(V_1) else V_1
+            V_2 = tuples[component_2] if math.isnan(V_2) else V_2
+            result = tuples[component_1] * tuples[component_2] / max(V_1, V_2, 1)
+            if best is None or result < best[0]:
+                best = (result, join_index, component_1, component_2)
+        if best is None:
+            # Only joins closing a cycle of the join graph are left
+            order += remaining
+            break
+        result, join_index, component_1, component_2 = best
+        tuples[component_1] = result
+        component = [component_1 if c == component_2 else c for c in component]
+        remaining.remove(join_index)
+        order.append(join_index)
+    return order
+
+def neighbours(order):
+    '''
+    All join orders one move away: swapping two joins or moving one join to another position
+    '''
+    order = list(order)
+    n = len(order)
+    for i in range(n):
+        for j in range(i + 1, n):
+            swapped = order[:]
+            swapped[i], swapped[j] = swapped[j], swapped[i]
+            yield swapped
+    for i in range(n):
+        rest = order[:i] + order[i + 1:]
+        for j in range(n):
+            if j != i and j != i + 1:
+                yield rest[:j] + [order[i]] + rest[j:]
+
+def random_neighbour(order, rng):
+    order = list(order)
+    i, j = rng.sample(range(len(order)), 2)
+    if rng.random() < 0.5:
+        order[i], order[j] = order[j], order[i]
+    else:
+        order.insert(j, order.pop(i))
+    return order
+
+def iterated_improvement(costs, start, rng, deadline):
+    '''
+    Steepest descent from the start order, then from random orders until the deadline
+    (every neighbourhood is costed in one vectorized call)
+    '''
+    best_order, best_cost = list(start), costs.cost(start)
+    order, cost = best_order, best_cost
+    while time.perf_counter() < deadline:
+        candidates = list(neighbours(order))
+        candidate_costs = costs.costs(candidates)
+        i = min(range(len(candidates)), key=candidate_costs.__getitem__)
+        if candidate_costs[i] < cost:
+            order, cost = candidates[i], candidate_costs[i]
+            if cost < best_cost:
+                best_order, best_cost = order, cost
+        else:
+            # Local minimum: restart from a random order
+            order = rng.sample(range(costs.n_joins), costs.n_joins)
+            cost = costs.cost(order)
+    return best_order, best_cost
+
+def simulated_annealing(costs, start, rng, deadline):
+    '''
+    Random moves, accepting worse orders with a probability that drops as the temperature cools down to the deadline
+    '''
+    order, cost = list(start), costs.cost(start)
+    best_order, best_cost = order, cost
+    begin = time.perf_counter()
+    budget = max(deadline - begin, 1e-9)
+    while True:
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+        temperature = start_temperature * (end_temperature / start_temperature) ** ((now - begin) / budget)
+        candidate = random_neighbour(order, rng)
+        candidate_cost = costs.cost(candidate)
+        if candidate_cost == math.inf:
+            continue
+        if cost == math.inf or candidate_cost <= cost or rng.random() < math.exp(-(math.log(candidate_cost + 1) - math.log(cost + 1)) / temperature):
+            order, cost = candidate, candidate_cost
+            if cost < best_cost:
+                best_order, best_cost = order, cost
+    return best_order, best_cost
+
+def order_crossover(parent_1, parent_2, rng):
+    '''
+    OX crossover: a slice of the first parent, the other joins in the order of the second parent
+    '''
+    n = len(parent_1)
+    i, j = sorted(rng.sample(range(n + 1), 2))
+    middle = parent_1[i:j]
+    rest = [join_index for join_index in parent_2 if join_index not in middle]
+    return rest[:i] + middle + rest[i:]
+
+def genetic_search(costs, start, rng, deadline):
+    '''
+    Genetic algorithm over join orders (as GEQO): tournament selection, OX crossover, move mutation
+    and elitism, each generation is costed in one vectorized call
+    '''
+    n = costs.n_joins
+    population = [list(start)] + [rng.sample(range(n), n) for _ in range(population_size - 1)]
+    fitness = costs.costs(population)
+    def tournament():
+        a, b = rng.randrange(len(population)), rng.randrange(len(population))
+        return population[a] if fitness[a] <= fitness[b] else population[b]
+    while time.perf_counter() < deadline:
+        ranked = sorted(range(len(population)), key=fitness.__getitem__)
+        children = [population[i] for i in ranked[:elite_size]]
+        while len(children) < population_size:
+            child = order_crossover(tournament(), tournament(), rng)
+            if rng.random() < mutation_rate:
+                child = random_neighbour(child, rng)
+            children.append(child)
+        population = children
+        fitness = costs.costs(population)
+    i = min(range(len(population)), key=fitness.__getitem__)
+    return population[i], fitness[i]
+
+search_methods = {
+    "ii": iterated_improvement,
+    "sa": simulated_annealing,
+    "ga": genetic_search
+}
+
+def scalar_join_order_cost(query_dict, Tuples, M, stats=None, cost_model=None):
+    '''
+    Cost function of single join orders built with whatif.build_query_tree (any cost model), sharing a SubplanMemo
+    returns: function of a join order returning its total cost, inf if the order cannot be built
+    '''
+    memo = SubplanMemo()
+    def cost(order):
+        tree, intermediate_relations = build_query_tree(query_dict, list(order), False, Tuples, M, stats, memo, cost_model)
+        return total_IO_cost(tree) if len(intermediate_relations) <= 1 else math.inf
+    return cost
+
+def heuristic_join_order(query_dict, Tuples, M, stats=None, method="ga", time_budget=default_time_budget, seed=None, inputs=None, cost_model=None):
+    '''
+    Search a good join order without enumerating them all, for queries beyond exhaustive reach
+    - query_dict: the processed query from preprocessing.py
+    - Tuples, M: the same inputs as build_query_tree
+    - stats: optional StatsSnapshot of the query
+    - method: "goo" (greedy operator ordering), "ii" (iterated improvement), "sa" (simulated annealing) or "ga" (genetic algorithm)
+    - time_budget: seconds the search may run for (the statistics are read before the clock starts)
+    - seed: random seed of the randomized methods
+    - inputs: precomputed batchcost.prepare_cost_inputs output, computed when None
+    - cost_model: cost model of the orders (whatif.IOCostModel when None), the models other than IO cost
+      each order with build_query_tree instead of the vectorized evaluation
+    returns: join order for build_query_tree, its total cost (inf if no order could be built)
+    The randomized methods start from the greedy order, so they never return a worse one.
+    '''
+    if inputs is None:
+        inputs = prepare_cost_inputs(query_dict, Tuples, M, stats)
+    scalar_cost = None
+    if not isinstance(get_cost_model(cost_model), IOCostModel):
+        scalar_cost = scalar_join_order_cost(query_dict, Tuples, M, stats, cost_model)
+    costs = JoinOrderCosts(inputs, scalar_cost)
+    deadline = time.perf_counter() + time_budget
+    start = greedy_join_order(inputs)
+    if method == "goo" or costs.n_joins < 2:
+        return start, costs.cost(start)
+    if method not in search_methods:
+        raise ValueError(f"Unknown join order search method: {method}")
+    order, cost = search_methods[method](costs, start, random.Random(seed), deadline)
+    return list(order), cost
@@ -0,0 +1,157 @@
+import re
+
+# Defaults when a column has no statistics (same rules as the textbook estimation)
+DEFAULT_RANGE_SELECTIVITY = 1/3
+FLIPPED_OPERATORS = {'<': '>', '>': '<', '<=': '>=', '>=': '<=', '=': '=', '!=': '!=', '<>': '<>'}
+
+def parse_value(value):
+    '''
+    Strip quotes and casts from a constant and convert it to a float when it is numeric
+    - value: constant from the query (e.g. 1000, '1995-01-01', '1000'::numeric)
+    '''
+    value = re.sub(r"::[\w\s]+$", "", str(value).strip()).strip("()' ")
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+def _compare_key(value):
+    # Numbers compare with numbers, everything else (dates, strings) as text
+    return (0, value, "") if isinstance(value, float) else (1, 0.0, str(value))
+
+def _less_than(a, b):
+    return _compare_key(a) < _compare_key(b)
+
+def split_select(select_item):
+    '''
+    Find the column and the constant of a selection
+    - select_item: the selection obj from the query dict
+    returns: column, operator (as if the column were on the left), constant text
+    '''
+    left, operator, right = select_item['left'], select_item['operator'], select_item['right']
+    if re.match(r"^\(*[A-Za-z_]", left.strip()):
+        column = left.split('(')[-1].split('.')[-1].strip("() ")
+        return column, operator, right
+    column = right.split('(')[-1].split('.')[-1].strip("() ")
+    return column, FLIPPED_OPERATORS.get(operator, operator), left
+
+def histogram_fraction_below(bounds, value, inclusive=False):
+    '''
+    Fraction of the histogram population below a value, interpolating linearly inside the bucket
+    - bounds: histogram_bounds of the column (equi-depth buckets)
+    '''
+    if len(bounds) < 2:
+        return None
+    bounds = [parse_value(bound) for bound in bounds]
+    if _less_than(value, bounds[0]) or (value == bounds[0] and not inclusive):
+        return 0.0
+    if _less_than(bounds[-1], value) or value == bounds[-1]:
+        return 1.0
+    buckets = len(bounds) - 1
+    for i in range(buckets):
+        low, high = bounds[i], bounds[i + 1]
+        if _less_than(value, high) or (value == high and not inclusive):
+            if isinstance(value, float) and isinstance(low, float) and isinstance(high, float) and high > low:
+                within = (value - low) / (high - low)
+            else:
+                within = 0.5
+            return (i + within) / buckets
+    return 1.0
+
+def _range_selectivity(column_stats, operator, value):
+    '''
+    Selectivity of column <op> value using the MCV list and the histogram (as in scalarineqsel)
+    '''
+    null_frac = column_stats.get('null_frac') or 0.0
+    mcv = [parse_value(v) for v in column_stats.get('most_common_vals') or []]
+    mcf = column_stats.get('most_common_freqs') or []
+    less = operator in ('<', '<=')
+    mcv_selectivity = 0.0
+    for common_value, frequency in zip(mcv, mcf):
+        if common_value == value:
+            matches = operator in ('<=', '>=')
+        elif less:
+            matches = _less_than(common_value, value)
+        else:
+            matches = _less_than(value, common_value)
+        if matches:
+            mcv_selectivity += frequency
+    # x > v is 1 - P(x <= v) and x >= v is 1 - P(x < v)
+    below = histogram_fraction_below(column_stats.get('histogram_bounds') or [], value, inclusive=operator in ('<=', '>'))
+    if below is None:
+        histogram_selectivity = DEFAULT_RANGE_SELECTIVITY
+    else:
+        histogram_selectivity = below if less else 1.0 - below
+    rest = max(0.0, 1.0 - null_frac - sum(mcf))
+    return mcv_selectivity + histogram_selectivity * rest
+
+def _equality_selectivity(column_stats, value, n_distinct):
+    '''
+    Selectivity of column = value: the MCV frequency, or the remaining population spread over the other distinct values
+    '''
+    null_frac = column_stats.get('null_frac') or 0.0
+    mcv = [parse_value(v) for v in column_stats.get('most_common_vals') or []]
+    mcf = column_stats.get('most_common_freqs') or []
+    for common_value, frequency in zip(mcv, mcf):
+        if common_value == value:
+            return frequency
+    other_values = max((n_distinct or 1) - len(mcv), 1)
+    return max(0.0, 1.0 - null_frac - sum(mcf)) / other_values
+
+def estimate_selectivity(operator, constant, column_stats, n_distinct):
+    '''
+    Estimate the fraction of rows satisfying column <operator> constant
+    - operator: <, >, <=, >=, =, !=, <>, BETWEEN (constant "low AND high") or IN (constant "(a, b, ...)")
+    - column_stats: pg_stats row of the column (pgconn.get_column_stats), None if unknown
+    - n_distinct: number of distinct values of the column (pgconn.get_unique_count)
+    returns: selectivity between 0 and 1
+    '''
+    operator = operator.upper()
+    if column_stats is None:
+        # No statistics: fall back to 1/3 for ranges and 1/V for equality
+        V = max(n_distinct or 1, 1)
+        if operator in ('<', '>', '<=', '>='):
+            return DEFAULT_RANGE_SELECTIVITY
+        if operator == 'BETWEEN':
+            return DEFAULT_RANGE_SELECTIVITY ** 2
+        if operator == 'IN':
+            return min(1.0, len(split_in_list(constant)) / V)
+        if operator in ('!=', '<>'):
+            return (V - 1) / V
+        return 1 / V
+    null_frac = column_stats.get('null_frac') or 0.0
+    if operator in ('<', '>', '<=', '>='):
+        selectivity = _range_selectivity(column_stats, operator, parse_value(constant))
+    elif operator == 'BETWEEN':
+        low, high = re.split(r"\s+AND\s+", constant, maxsplit=1, flags=re.IGNORECASE)
+        selectivity = _range_selectivity(column_stats, '<=', parse_value(high)) - _range_selectivity(column_stats, '<', parse_value(low))
+    elif operator == 'IN':
+        selectivity = sum(_equality_selectivity(column_stats, parse_value(v), n_distinct) for v in split_in_list(constant))
+    elif operator in ('!=', '<>'):
+        selectivity = 1.0 - null_frac - _equality_selectivity(column_stats, parse_value(constant), n_distinct)
+    else:
+        selectivity = _equality_selectivity(column_stats, parse_value(constant), n_distinct)
+    return min(max(selectivity, 0.0), 1.0 - null_frac)
+
+def split_in_list(constant):
+    '''
+    Values of an IN list, e.g. "(1, 2, 'x')" -> ['1', '2', "'x'"]
+    '''
+    return [value.strip() for value in constant.strip().strip("()").split(",") if value.strip()]
+
+def estimate_selectivities(select_items, table_name, stats):
+    '''
+    Estimate the selectivity of every selection on a table in one pass
+    - select_items: selection objs from the query dict (all on table_name)
+    - stats: statistics provider (pgconn or a pgconn.StatsSnapshot), column statistics are fetched once per column
+    returns: list of (column, selectivity) aligned with select_items
+    '''
+    column_cache = {}
+    results = []
+    for select_item in select_items:
+        column, operator, constant = split_select(select_item)
+        if column not in column_cache:
+            column_cache[column] = (stats.get_column_stats(table_name, column), stats.get_unique_count(table_name, column))
+        column_stats, n_distinct = column_cache[column]
+        results.append((column, estimate_selectivity(operator, constant, column_stats, n_distinct)))
+    return results
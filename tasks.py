@@ -0,0 +1,151 @@
+import itertools
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Worker threads (plan retrieval and costing wait on the database, so threads share the caches and the pool)
+task_workers = 2
+# Milliseconds between two checks of the running tasks on the Tk thread
+poll_interval_ms = 50
+
+class TaskCancelled(Exception):
+    '''
+    Raised by Task.check in a task that was cancelled or superseded
+    '''
+
+class Task:
+    '''
+    A function running on a worker thread
+    - channel: tasks of a channel run one at a time, a newer task supersedes the older ones
+    - generation: submission number of the task in its channel
+    - cancel_hook: called on the Tk thread with the task when it is cancelled (e.g. pgconn.cancel_execution_plan,
+      which cancels the statements the task started with itself as cancel_token)
+    The function receives the task as its first argument: report() shows its progress and check() stops it
+    between two steps once it is cancelled.
+    '''
+    def __init__(self, channel, generation, func, args, on_done, on_error, cancel_hook):
+        self.channel = channel
+        self.generation = generation
+        self.func = func
+        self.args = args
+        self.on_done = on_done
+        self.on_error = on_error
+        self.cancel_hook = cancel_hook
+        self.cancelled = threading.Event()
+        self.future = None
+        self.progress = queue.Queue()
+
+    def report(self, message):
+        '''
+        Show a progress message (called from the worker)
+        '''
+        self.progress.put(message)
+
+    def check(self):
+        '''
+        Stop the task if it was cancelled (called from the worker between two steps)
+        '''
+        if self.cancelled.is_set():
+            raise TaskCancelled(self.channel)
+
+class TaskExecutor:
+    '''
+    Runs database and costing work off the Tk thread and hands the results back to it
+    - root: Tk widget whose after() polls the running tasks
+    - on_status: called on the Tk thread with the progress message of the running tasks ("" when idle)
+    The callbacks of a task run on the Tk thread, and only if the task is still the latest of its channel:
+    the results of cancelled and superseded tasks are discarded.
+    '''
+    def __init__(self, root, workers=task_workers, on_status=None):
+        self.root = root
+        self.on_status = on_status
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.generations = itertools.count(1)
+        # Latest generation, running task and task waiting for it, per channel
+        self.latest = {}
+        self.running = {}
+        self.waiting = {}
+        self.messages = {}
+        self.polling = False
+
+    def submit(self, channel, func, *args, on_done=None, on_error=None, cancel_hook=None):
+        '''
+        Run func(task, *args) on a worker and call on_done(result) (on_error(exception)) on the Tk thread
+        A running task of the channel is cancelled and the new one starts once it stopped, a task still
+        waiting for it is dropped.
+        returns: the Task
+        '''
+        task = Task(channel, next(self.generations), func, args, on_done, on_error, cancel_hook)
+        self.latest[channel] = task.generation
+        if channel in self.running:
+            self._cancel_task(self.running[channel])
+            self.waiting[channel] = task
+        else:
+            self._start(task)
+        return task
+
+    def cancel(self, channel):
+        '''
+        Cancel the running and waiting tasks of a channel, their results are discarded
+        returns: True if a task was cancelled
+        '''
+        self.latest[channel] = next(self.generations)
+        waiting = self.waiting.pop(channel, None)
+        running = self.running.get(channel)
+        if running is not None:
+            self._cancel_task(running)
+        self.messages.pop(channel, None)
+        self._show_status()
+        return running is not None or waiting is not None
+
+    def busy(self, channel):
+        return channel in self.running or channel in self.waiting
+
+    def shutdown(self):
+        for channel in list(self.running):
+            self.cancel(channel)
+        self.pool.shutdown(wait=False)
+
+    def _cancel_task(self, task):
+        if task.cancelled.is_set():
+            return
+        task.cancelled.set()
+        if task.future.cancel() is False and task.cancel_hook is not None:
+            task.cancel_hook(task)
+
+    def _start(self, task):
+        self.running[task.channel] = task
+        task.future = self.pool.submit(task.func, task, *task.args)
+        if not self.polling:
+            self.polling = True
+            self.root.after(poll_interval_ms, self._poll)
+
+    def _poll(self):
+        for channel, task in list(self.running.items()):
+            while not task.progress.empty():
+                self.messages[channel] = task.progress.get()
+            if not task.future.done():
+                continue
+            del self.running[channel]
+            self.messages.pop(channel, None)
+            if channel in self.waiting:
+                self._start(self.waiting.pop(channel))
+            if task.cancelled.is_set() or self.latest.get(channel) != task.generation:
+                continue
+            error = task.future.exception()
+            if error is None:
+                if task.on_done is not None:
+                    task.on_done(task.future.result())
+            elif task.on_error is not None:
+                task.on_error(error)
+            elif not isinstance(error, TaskCancelled):
+                print(f"Error: {error}")
+        self._show_status()
+        if self.running:
+            self.root.after(poll_interval_ms, self._poll)
+        else:
+            self.polling = False
+
+    def _show_status(self):
+        if self.on_status is not None:
+            self.on_status(" | ".join(self.messages.values()))
@@ -0,0 +1,185 @@
+import heapq
+import itertools
+import math
+import time
+from whatif import QueryNode, build_leaf, set_join_tuple_and_IO, total_IO_cost, covered_aliases, get_stats_source
+from joingraph import query_join_graph
+from accesspath import feasible_scan_types, feasible_join_types
+
+# Plans listed by the "Top Plans" panel
+default_k = 10
+# Seconds the panel search may run for, the best plans found so far are listed when it runs out
+default_time_budget = 5.0
+
+class RankedPlan:
+    '''
+    A complete modified plan of a query
+    - cost: total cost of the tree (total_IO_cost of build_query_tree)
+    - join_order: order of the joins for build_query_tree
+    - join_types: join type of each join, indexed like query_dict["joins"]
+    - scan_types: {alias: scan type} of the relations in the tree
+    '''
+    def __init__(self, cost, join_order, join_types, scan_types):
+        self.cost = cost
+        self.join_order = join_order
+        self.join_types = join_types
+        self.scan_types = scan_types
+
+    def describe(self):
+        joins = ", ".join(self.join_types[join_index] for join_index in self.join_order)
+        scans = ", ".join(f"{alias}: {scan_type}" for alias, scan_type in self.scan_types.items())
+        return f"{self.cost:.2f} | order {list(self.join_order)} | joins {joins} | scans {scans}"
+
+def with_scan_type(query_dict, alias, scan_type):
+    '''
+    Shallow copy of a query dict with the scan type of a relation (and its selections) replaced
+    '''
+    return dict(query_dict,
+                source=[dict(source, type=scan_type) if source["alias"] == alias else source for source in query_dict["source"]],
+                selects=[dict(select, type=scan_type) if select["alias"] == alias else select for select in query_dict["selects"]])
+
+def apply_plan(query_dict, plan):
+    '''
+    Set the join and scan types of a plan in a query dict
+    returns: the join order of the plan
+    '''
+    for join, join_type in zip(query_dict["joins"], plan.join_types):
+        join[0]["type"] = join_type
+        join[1]["type"] = join_type
+    for item in query_dict["source"] + query_dict["selects"]:
+        if item["alias"] in plan.scan_types:
+            item["type"] = plan.scan_types[item["alias"]]
+    return list(plan.join_order)
+
+def top_k_plans(query_dict, Tuples, M, k=default_k, stats=None, cost_model=None, time_budget=None):
+    '''
+    The k cheapest modified plans of a query over join orders, feasible join types and feasible scan types
+    - query_dict: the processed query from preprocessing.py
+    - Tuples, M: the same inputs as build_query_tree
+    - stats: optional StatsSnapshot of the query
+    - cost_model: optional cost model (whatif.IOCostModel by default)
+    - time_budget: seconds the search may run for, None to search until the k cheapest plans are proven
+    returns: [RankedPlan] cheapest first, counters {expanded, pruned, plans}
+    Depth first branch and bound over the join orders (the connected orders of generate_valid_join_orders):
+    the joins are added one at a time, cheapest extension first, and a partial order is dropped as soon as its
+    accumulated cost with the cheapest types and scans reaches the cost of the k-th best plan so far (kept in
+    a max-heap). The tuples of a join do not depend on its type or on the scan types, so the cost of each type
+    and scan is independent of the others: they are chosen once the order is complete, by the same bound.
+    '''
+    catalog = get_stats_source(stats)
+    joins = query_dict["joins"]
+    graph = query_join_graph(joins)
+    if joins:
+        aliases = list(dict.fromkeys(side["alias"] for join in joins for side in join))
+    else:
+        aliases = [source["alias"] for source in query_dict["source"][:1]]
+    tables = {source["alias"]: source["table"] for source in query_dict["source"]}
+
+    # Cost of each relation per feasible scan type, cheapest first
+    leaves = {}
+    scan_options = []
+    for alias in aliases:
+        table = tables.get(alias, alias)
+        options = []
+        for scan_type in feasible_scan_types(query_dict, alias, table, catalog):
+            leaf = build_leaf(with_scan_type(query_dict, alias, scan_type), alias, table, False, Tuples, stats, None, cost_model)
+            options.append((total_IO_cost(leaf), scan_type))
+            leaves.setdefault(alias, leaf)
+        options.sort(key=lambda option: option[0])
+        scan_options.append(options)
+    scan_choices = list(zip(aliases, scan_options))
+    # Cost of the cheapest scans, part of the bound of every partial plan
+    remaining_scans = sum(options[0][0] for options in scan_options)
+    # Each join with each of its feasible types (the join items carry the type, as in query_dict)
+    typed_joins = [[[dict(side, type=join_type) for side in join] for join_type in feasible_join_types(query_dict, join, catalog)]
+                   for join in joins]
+
+    best = []
+    tie_breaker = itertools.count()
+    counters = {"expanded": 0, "pruned": 0, "plans": 0}
+    deadline = time.perf_counter() + time_budget if time_budget is not None else None
+
+    def kth_cost():
+        return -best[0][0] if len(best) >= k else math.inf
+
+    def choose_types(order, choices, cost):
+        '''
+        Cheapest combinations of independent choices (the type of each join, then the scan of each relation)
+        - choices: [(join index or alias, [(cost, type)] cheapest first)]
+        - cost: cost of the plan with the cheapest choices, the others add their difference to the cheapest
+        '''
+        picks = [None] * len(choices)
+        def choose(i, extra):
+            if i == len(choices):
+                counters["plans"] += 1
+                join_types = [join[0]["type"] for join in joins]
+                scan_types = {}
+                for (key, _), pick in zip(choices, picks):
+                    if isinstance(key, int):
+                        join_types[key] = pick
+                    else:
+                        scan_types[key] = pick
+                plan = RankedPlan(cost + extra, order, join_types, scan_types)
+                heapq.heappush(best, (-plan.cost, next(tie_breaker), plan))
+                if len(best) > k:
+                    heapq.heappop(best)
+                return
+            key, options = choices[i]
+            for option_cost, option in options:
+                option_extra = extra + option_cost - options[0][0]
+                if cost + option_extra >= kth_cost():
+                    counters["pruned"] += 1
+                    break
+                picks[i] = option
+                choose(i + 1, option_extra)
+        choose(0, 0.0)
+
+    def add_joins(state, components, cost, order, join_options):
+        if deadline is not None and time.perf_counter() > deadline:
+            return
+        if state[0] == graph.full:
+            choose_types(order, join_options + scan_choices, cost + remaining_scans)
+            return
+        extensions = []
+        pending = graph.candidates(state)
+        while pending:
+            bit = pending & -pending
+            pending ^= bit
+            join_index = bit.bit_length() - 1
+            join = joins[join_index]
+            child_1, child_2 = components[join[0]["alias"]], components[join[1]["alias"]]
+            # A join inside one intermediate relation closes a cycle, build_query_tree cannot cost it
+            if child_1 is child_2:
+                continue
+            options = []
+            for typed_join in typed_joins[join_index]:
+                join_node = QueryNode("Join", join[0]["alias"] + "." + join[0]["on"] + " = " + join[1]["alias"] + "." + join[1]["on"])
+                join_node.set_Q_Type(typed_join[0]["type"])
+                join_node.join_index = join_index
+                for child in (child_1, child_2):
+                    join_node.add_child(child)
+                    for alias in covered_aliases(child):
+                        join_node.add_alias(alias)
+                IO, tuples = set_join_tuple_and_IO(typed_join, join_node, M, stats, cost_model)
+                join_node.set_IO_cost(IO)
+                join_node.set_tuples(tuples)
+                counters["expanded"] += 1
+                options.append((IO, typed_join[0]["type"], join_node))
+            options.sort(key=lambda option: option[0])
+            extensions.append((cost + options[0][0], join_index, options))
+        extensions.sort(key=lambda extension: extension[0])
+        for new_cost, join_index, options in extensions:
+            if new_cost + remaining_scans >= kth_cost():
+                counters["pruned"] += 1
+                break
+            # The tuples and width of a join do not depend on its type, any node can be the input of the next joins
+            join_node = options[0][2]
+            new_components = dict(components)
+            for alias in join_node.get_alias():
+                new_components[alias] = join_node
+            add_joins(graph.extend(state, join_index), new_components, new_cost, order + (join_index,),
+                      join_options + [(join_index, [(IO, join_type) for IO, join_type, _ in options])])
+
+    add_joins((0, 0, 0), dict(leaves), 0.0, (), [])
+    plans = [plan for _, _, plan in sorted(best, key=lambda entry: (-entry[0], entry[1]))]
+    return plans, counters
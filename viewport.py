@@ -0,0 +1,83 @@
+import math
+
+# Side of the cells of the spatial index (px, in layout coordinates)
+grid_cell_size = 400
+# Margin drawn around the visible area so that short scrolls find their items already created (px)
+viewport_margin = 200
+# Zoom levels: (scale, text lines shown per node (None: all), depth from which subtrees are collapsed (None: never))
+zoom_levels = [
+    (0.25, 1, 3),
+    (0.5, 1, None),
+    (0.75, None, None),
+    (1.0, None, None),
+    (1.5, None, None)
+]
+default_zoom = 3
+
+class SpatialGrid:
+    '''
+    Uniform grid over the bounding boxes of the drawn items (nodes and edges), to find the items
+    intersecting the viewport without scanning the whole tree
+    - cell_size: side of a cell in layout coordinates
+    '''
+    def __init__(self, cell_size=grid_cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def _cells(self, x1, y1, x2, y2):
+        for cell_x in range(math.floor(x1 / self.cell_size), math.floor(x2 / self.cell_size) + 1):
+            for cell_y in range(math.floor(y1 / self.cell_size), math.floor(y2 / self.cell_size) + 1):
+                yield cell_x, cell_y
+
+    def insert(self, key, x1, y1, x2, y2):
+        for cell in self._cells(x1, y1, x2, y2):
+            self.cells.setdefault(cell, []).append(key)
+
+    def rename(self, key, new_key, x1, y1, x2, y2):
+        '''
+        Change the key of an item whose bounding box is unchanged
+        '''
+        for cell in self._cells(x1, y1, x2, y2):
+            items = self.cells[cell]
+            items[items.index(key)] = new_key
+
+    def query(self, x1, y1, x2, y2):
+        '''
+        Keys of the items whose cells intersect a rectangle (a superset of the intersecting items)
+        '''
+        found = set()
+        for cell in self._cells(x1, y1, x2, y2):
+            found.update(self.cells.get(cell, ()))
+        return found
+
+def collapse_subtrees(nodes, edges, depth):
+    '''
+    Replace the subtrees rooted at a depth with their root, to draw them as one summary box
+    - nodes, edges: output of whatif.get_nodes_and_edges, the first node is the root
+    - depth: depth of the collapsed subtrees (the root is at depth 0), None to keep the whole tree
+    returns: nodes, edges of the kept tree, {id of a collapsed root: nodes of its subtree}
+    '''
+    if depth is None or not nodes:
+        return nodes, edges, {}
+    children = {}
+    for parent_id, child_id in edges:
+        children.setdefault(parent_id, []).append(child_id)
+    node_by_id = {node[0]: node for node in nodes}
+    kept_nodes = []
+    kept_edges = []
+    collapsed = {}
+    def subtree(node_id):
+        members = [node_by_id[node_id]]
+        for child_id in children.get(node_id, ()):
+            members += subtree(child_id)
+        return members
+    def visit(node_id, level):
+        kept_nodes.append(node_by_id[node_id])
+        if level == depth and node_id in children:
+            collapsed[node_id] = subtree(node_id)
+            return
+        for child_id in children.get(node_id, ()):
+            kept_edges.append((node_id, child_id))
+            visit(child_id, level + 1)
+    visit(nodes[0][0], 0)
+    return kept_nodes, kept_edges, collapsed
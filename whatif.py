@@ -1,38 +1,54 @@
 from constants import query_input_1
-from pgconn import get_blocks,get_unique_count
+import pgconn
 from constants import SCANS,JOINS
+from selectivity import estimate_selectivities
 import math
+from collections import OrderedDict
+import itertools
+from joingraph import query_join_graph
+from accesspath import scan_access_path, join_access_path, index_scan_IO
+
+# Block size of the database and the overhead of a heap tuple (header and line pointer), in bytes, to size intermediate results
+block_size = 8192
+tuple_overhead = 28
 
 class QueryNode:
     '''
     QueryNode class
     - node_type: the type of the node (e.g. Source, Projection, Selection, Join)
     - value: the value of the node (e.g. table name, condition)
-    - children: the list of child nodes
-    - alias (optional params for Join): the alias of the node
+    - children: the child nodes (tuple)
+    - alias (optional params for Join): the aliases of the relations under the node (tuple)
     - tuples: tuples for that node
     - IO_cost: IO cost for that node
     - Q_type: The query type (choose from SCANS, JOINS and FILTERS depending on the query type)
-    - id: the unique identifier of the node (auto-incremented, to prevent collisions)
+    - id: the identifier of the node in its tree, given by assign_node_ids when the tree is built (None until then)
+    - memo_key: key of the subtree in a SubplanMemo (None if the node is not memoized)
+    - join_index: index of the join in query_dict["joins"] (join nodes only)
+    - width: estimated width of the tuples of the node in bytes, None if unknown
+    Slots and tuples keep a node small (no per instance dict, the empty tuple is shared),
+    so thousands of candidate trees can be held at once.
     '''
-    _id_counter = 1
+    __slots__ = ("node_type", "value", "children", "alias", "tuples", "IO_cost", "Q_type", "id", "memo_key", "join_index", "width")
     def __init__(self, node_type, value=None):
         self.node_type = node_type 
         self.value = value 
-        self.children = []
-        self.alias = []
+        self.children = ()
+        self.alias = ()
         ## This part returns the tuples
         self.tuples=0
         self.IO_cost=0
         self.Q_type="None"
-        self.id = QueryNode._id_counter
-        QueryNode._id_counter += 1
+        self.id = None
+        self.memo_key = None
+        self.join_index = None
+        self.width = None
 
     def add_child(self, child_node):
-        self.children.append(child_node)
+        self.children += (child_node,)
 
     def add_alias(self, alias):
-        self.alias.append(alias)
+        self.alias += (alias,)
 
     def set_tuples(self, tuples):
         self.tuples=tuples
@@ -67,121 +83,378 @@ class QueryNode:
             repr_str += child.__repr__(level + 1)
         return repr_str
     
-def set_source_IO(query_dict_itm,table_name):
+def assign_node_ids(root, ids):
+    '''
+    Give an id to the nodes of a tree that do not have one yet, in pre order
+    - ids: id allocator of the tree (itertools.count), trees sharing nodes through a SubplanMemo share its allocator
+    A node with an id heads a subtree that already has its ids, so only the new nodes are visited.
+    '''
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node.id is not None:
+            continue
+        node.id = next(ids)
+        stack.extend(reversed(node.get_children()))
+
+class SubplanMemo:
+    '''
+    Memo of costed subtrees shared by the trees built for the join orders of a query
+    - max_entries: subtrees kept before the least recently used one is evicted
+    - stats: counters for hits, misses and evictions
+    A subtree is keyed on its shape: the relation, scan type and selections of a leaf,
+    the join index, join type and child keys of a join. Two join orders that build the same
+    subtree (e.g. a shared prefix) reuse the same costed nodes, and toggling a join or scan type
+    only misses for the subtrees that contain it.
+    Memoized nodes are shared between trees and must not be modified.
+    The trees built with a memo take their node ids from its allocator (ids), so shared nodes keep unique ids.
+    '''
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.ids = itertools.count(1)
+        self._entries = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key):
+        node = self._entries.get(key)
+        if node is None:
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return node
+
+    def put(self, key, node):
+        node.memo_key = key
+        self._entries[key] = node
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def hit_rate(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+def leaf_memo_key(query_dict,source_alias,source_Q_type,use_dict_IO_tuples,cost_model=None):
+    '''
+    Memo key of the leaf of a relation: its scan type and the type of each of its selections
+    '''
+    selections = tuple((format_select(select), select["type"]) for select in query_dict["selects"] if select["alias"]==source_alias)
+    return ("leaf", use_dict_IO_tuples, get_cost_model(cost_model).name, source_alias, source_Q_type, selections)
+
+def join_memo_key(join_index,join_type,children,M,use_dict_IO_tuples,cost_model=None):
+    '''
+    Memo key of a join node from its join and the keys of its children (None if a child is not memoized)
+    '''
+    child_keys = tuple(child.memo_key for child in children)
+    if None in child_keys:
+        return None
+    return ("join", use_dict_IO_tuples, get_cost_model(cost_model).name, M, join_index, join_type, child_keys)
+
+def get_stats_source(stats):
+    '''
+    Statistics provider used by the estimations
+    - stats: StatsSnapshot from pgconn.prefetch_statistics, or None to query pgconn directly
+    '''
+    return pgconn if stats is None else stats
+
+def hash_partition_passes(build_blocks, M):
+    '''
+    Partitioning passes of a Grace hash join before every partition of the build side fits in memory
+    (each pass splits a partition into M-1 buckets, a partition fits when it has at most M-1 blocks)
+    returns: 0 when the build side fits in memory and the join runs in one pass
+    With fewer than 3 memory blocks a pass is counted as a split in 2 buckets.
+    '''
+    if build_blocks <= M - 1:
+        return 0
+    fanout = max(M - 1, 2)
+    return max(math.ceil(math.log(build_blocks / fanout) / math.log(fanout)), 1)
+
+def hash_join_IO(block_1, block_2, M):
+    '''
+    IO of a hash join with M memory blocks, the smaller side is the build side
+    - one pass: both sides are read once
+    - Grace: every partitioning pass reads and writes both sides, then the partitions are joined
+    - hybrid: the share of the build side that stays in memory during partitioning is never written
+    '''
+    build_blocks = min(block_1, block_2)
+    passes = hash_partition_passes(build_blocks, M)
+    if passes == 0:
+        return block_1 + block_2
+    in_memory = min((M - 1) / build_blocks, 1)
+    return (2 * passes + 1 - 2 * in_memory) * (block_1 + block_2)
+
+def sort_merge_passes(blocks, runs_merged, M):
+    '''
+    Merge passes of the external sort of one side before the join merges its runs
+    - blocks: size of the side, sorted into runs of M blocks
+    - runs_merged: number of runs of this side the final merge can take
+    With fewer than 3 memory blocks a pass is counted as a merge of 2 runs.
+    '''
+    runs = math.ceil(blocks / M)
+    if runs <= runs_merged:
+        return 0
+    return max(math.ceil(math.log(runs / runs_merged) / math.log(max(M - 1, 2))), 1)
+
+def sort_merge_join_IO(block_1, block_2, M):
+    '''
+    IO of a sort-merge join with M memory blocks
+    - both sides fit in memory: read once and sorted in memory
+    - otherwise every side is read and written as sorted runs, merged by the extra passes until the
+      runs of both sides fit in one merge, and read a last time by the merge that joins them
+    '''
+    if block_1 + block_2 <= M:
+        return block_1 + block_2
+    if math.ceil(block_1 / M) + math.ceil(block_2 / M) <= M - 1:
+        return 3 * (block_1 + block_2)
+    runs_merged = max((M - 1) // 2, 1)
+    return ((3 + 2 * sort_merge_passes(block_1, runs_merged, M)) * block_1
+            + (3 + 2 * sort_merge_passes(block_2, runs_merged, M)) * block_2)
+
+class IOCostModel:
+    '''
+    Textbook cost model (the default): the cost of a node is the number of blocks it reads and writes
+    - name: identifies the model in the SubplanMemo keys
+    - cost_label: name of the cost unit shown in the interface
+    Other models (pgcost.PostgresCostModel) implement the same three methods.
+    '''
+    name = "IO"
+    cost_label = "IO"
+
+    def source_cost(self, scan_type, number_of_blocks, tuples, selectivity, path=None):
+        '''
+        Cost of scanning a relation
+        - scan_type: the scan type of the source (Q_type)
+        - number_of_blocks, tuples: size of the relation
+        - selectivity: fraction of the tuples fetched (kept by the selections, or served by the index of path)
+        - path: access path of an index or bitmap scan (accesspath.scan_access_path), None if the index is unknown
+        Without access path an index or bitmap scan is approximated as log2(blocks) + half the blocks.
+        '''
+        if path is not None and scan_type in SCANS[1:]:
+            return index_scan_IO(path, number_of_blocks, tuples, selectivity, scan_type)
+        selectivity = 0.5 # default selectivity value
+        matching_blocks = int(number_of_blocks * selectivity)
+        if scan_type in SCANS:
+            if scan_type==SCANS[0]:
+                ## seq
+                return number_of_blocks
+            else:
+                ## bitmap and index
+                bitmap_index_cost = int(math.log2(number_of_blocks))
+                if(bitmap_index_cost + matching_blocks<1):
+                    return 1
+                return bitmap_index_cost + matching_blocks
+        else:
+            # Hash
+            return number_of_blocks
+
+    def selection_cost(self, tuples, predicates):
+        '''
+        Cost of the selections on a relation: none, they are applied while scanning
+        '''
+        return 0
+
+    def join_cost(self, join_type, tuples_1, block_1, V_1, tuples_2, block_2, V_2, tuples, M, path_1=None, path_2=None):
+        '''
+        Cost of a join (side 1 is the relation of the first join column)
+        - tuples_n, block_n, V_n: tuples, blocks and distinct join column values of each side
+        - tuples: estimated output tuples
+        - M: number of memory blocks
+        - path_n: access path of an index on the join column of side n when it is a base relation
+          (accesspath.join_access_path), the index joins probe it once per tuple of the other side
+        '''
+        # Hash
+        if(join_type==JOINS[0]):
+            return hash_join_IO(block_1, block_2, M)
+        # Nested loop
+        elif join_type==JOINS[1]:
+            if block_1< block_2:
+                return block_1 + (block_1 * block_2)/(M-1)
+            else:
+                return block_2 + (block_1 * block_2)/(M-1)
+        # Merge
+        elif join_type==JOINS[2]:
+            return sort_merge_join_IO(block_1, block_2, M)
+        # Index/Index only
+        else:
+            probes = []
+            if path_2 is not None:
+                probes.append(block_1 + tuples_1 * index_scan_IO(path_2, block_2, tuples_2, 1 / max(V_2, 1), join_type))
+            if path_1 is not None:
+                probes.append(block_2 + tuples_2 * index_scan_IO(path_1, block_1, tuples_1, 1 / max(V_1, 1), join_type))
+            if probes:
+                return min(probes)
+            if block_1< block_2:
+                return block_1 + (tuples_1 * block_2)/V_2
+            else:
+                return block_2 + (tuples_2 * block_1)/V_1
+
+default_cost_model = IOCostModel()
+
+def get_cost_model(cost_model):
+    '''
+    Cost model used by the estimations
+    - cost_model: IOCostModel, pgcost.PostgresCostModel or None for the default textbook model
+    '''
+    return default_cost_model if cost_model is None else cost_model
+
+def set_source_IO(query_dict_itm,table_name,stats=None,cost_model=None,tuples=0,selectivity=1.0,path=None):
     '''
     query_dict_itm: the object from the query dict
     node: selection or source node
     mode: source or selects
+    stats: optional StatsSnapshot of the query
+    cost_model: optional cost model (IOCostModel by default)
+    tuples, selectivity: tuples of the relation and selectivity of its selections, for the models using them
+    path: access path of an index or bitmap scan, selectivity is then the one of the indexed column
     '''
-    number_of_blocks=get_blocks(table_name)
-    
-    selectivity = 0.5 # default selectivity value
-    matching_blocks = int(number_of_blocks * selectivity)
-    if query_dict_itm['type'] in SCANS:
-        if query_dict_itm['type']==SCANS[0]:
-            ## seq
-            return number_of_blocks
-        else:
-            ## bitmap and index
-            bitmap_index_cost = int(math.log2(number_of_blocks))
-            if(bitmap_index_cost + matching_blocks<1):
-                return 1
-            return bitmap_index_cost + matching_blocks
-    else:
-        # Hash
-        return number_of_blocks
+    number_of_blocks=get_stats_source(stats).get_blocks(table_name)
+    return get_cost_model(cost_model).source_cost(query_dict_itm['type'], number_of_blocks, tuples, selectivity, path)
+
+def source_access_path(query_dict,source_alias,source_table,scan_type,stats=None):
+    '''
+    Access path of a scan and the selectivity it is costed with
+    returns: (index access path, selectivity of the indexed column) for an index or bitmap scan with a usable index,
+    else (None, selectivity of all the selections on the relation)
+    '''
+    if scan_type in SCANS[1:]:
+        path, selectivity = scan_access_path(query_dict,source_alias,source_table,get_stats_source(stats))
+        if path is not None:
+            return path, selectivity
+    return None, relation_selectivity(query_dict,source_alias,source_table,stats)
+
+def relation_selectivity(query_dict,source_alias,source_table,stats=None):
+    '''
+    Combined selectivity of the selections on a relation (predicates assumed independent)
+    '''
+    select_items = [select for select in query_dict["selects"] if select["alias"]==source_alias]
+    selectivity = 1.0
+    for column, column_selectivity in estimate_selectivities(select_items, source_table, get_stats_source(stats)):
+        selectivity *= column_selectivity
+    return selectivity
     
-def set_selection_tuples(query_dict_itm,node,table_name,columns):
+def set_selection_tuples(select_items,node,table_name,stats=None):
     '''
     Get the number of tuples from a relation
-    - query_dict_itm: the selection obj from the query dict
+    - select_items: the selection objs from the query dict on this relation
     - node: the selection node
-    
+    - stats: optional StatsSnapshot of the query
+    The selectivity of each predicate comes from the column histogram, MCV list and null_frac
+    (selectivity.py), predicates are assumed independent.
     '''
-
-    #number_of_blocks=get_blocks(table_name)
-    number_of_tuples=0
     # selection means that there is only 1 child
     child = node.get_children()[0]
     number_of_child_tuples=child.get_tuples()
-    number_of_tuples=number_of_child_tuples
-    for column in columns:
-        
-        V=get_unique_count(table_name,column)
-        if V is None:
-            V=number_of_tuples
-        
-        if query_dict_itm['operator']=="<" or query_dict_itm['operator']==">":
-            # divide by 3
-            number_of_child_tuples=number_of_child_tuples/3
-        elif query_dict_itm['operator']=="=":
-            number_of_child_tuples=number_of_child_tuples/V
-        elif query_dict_itm['operator']=="!=":
-            number_of_child_tuples=number_of_child_tuples(V-1)/V
+    for column, selectivity in estimate_selectivities(select_items, table_name, get_stats_source(stats)):
+        number_of_child_tuples=number_of_child_tuples*selectivity
     return number_of_child_tuples
+
+def format_select(select_item):
+    '''
+    Text of a selection predicate for the selection node
+    '''
+    if select_item["operator"].isalpha():
+        return select_item["left"]+" "+select_item["operator"]+" "+select_item["right"]
+    return select_item["left"]+select_item["operator"]+select_item["right"]
    
-def set_join_tuple_and_IO(query_dict_itm,join_node,M):
+def covered_aliases(node):
+    '''
+    Aliases of the relations under a node (join nodes keep them in alias, sources in value)
+    '''
+    if node.get_alias():
+        return node.get_alias()
+    while node.get_node_type() != "Source" and node.get_children():
+        node = node.get_children()[0]
+    return (node.value,)
+
+def intermediate_blocks(tuples, width):
+    '''
+    Blocks of an intermediate result of tuples rows of width bytes
+    '''
+    return math.ceil(tuples * (width + tuple_overhead) / block_size)
+
+def relation_width(query_dict_itm, table_name, tuples, stats=None):
+    '''
+    Width of the rows of a relation in bytes
+    - query_dict_itm: the source obj from the query dict, its width is the EXPLAIN width= of the scan when it comes from a plan
+    - tuples: rows of the relation, to derive the width from its size when pg_stats has no avg_width
+    returns: the width, None if it cannot be estimated
+    '''
+    if query_dict_itm is not None and query_dict_itm.get('width') is not None:
+        return query_dict_itm['width']
+    catalog = get_stats_source(stats)
+    width = catalog.get_tuple_width(table_name)
+    if width is not None:
+        return width
+    number_of_blocks = catalog.get_blocks(table_name)
+    if number_of_blocks and tuples:
+        return max(number_of_blocks * block_size / tuples - tuple_overhead, 1)
+    return None
+
+def set_join_tuple_and_IO(query_dict_itm,join_node,M,stats=None,cost_model=None):
     '''
     Get the join tuple and IO
     - query_dict_itm: the join obj from the query dict
     - join_node: the join node
+    - stats: optional StatsSnapshot of the query
+    - cost_model: optional cost model (IOCostModel by default)
     Parse outer relation to be smaller
+    A side that is a base relation is read from its table, a side that is an intermediate result
+    is sized from its tuples and width. Also sets the width of join_node.
     '''    
+    catalog = get_stats_source(stats)
     def get_relation_data(query_item, child_node):
         """
         Get relational_data
         """
         tuples = child_node.get_tuples()
-        blocks = get_blocks(query_item['table'])
-        unique_count = get_unique_count(query_item['table'], query_item['on'])
+        path = None
+        if child_node.get_node_type() == "Join" and child_node.width is not None:
+            blocks = intermediate_blocks(tuples, child_node.width)
+        else:
+            blocks = catalog.get_blocks(query_item['table'])
+            # Only a base relation can be probed through its index
+            if child_node.get_node_type() != "Join" and query_item['type'] in JOINS[3:]:
+                path = join_access_path(catalog, query_item['table'], query_item['on'])
+        unique_count = catalog.get_unique_count(query_item['table'], query_item['on'])
         if unique_count is None:  # If it's a key, set unique count to the number of tuples
             unique_count = tuples
-        return tuples, blocks, unique_count
+        return tuples, blocks, unique_count, path
 
     # Determine which child is outer or inner based on alias matching
-    if query_dict_itm[0]['alias'] in join_node.get_children()[0].get_alias():
+    if query_dict_itm[0]['alias'] in covered_aliases(join_node.get_children()[0]):
         outer_child, inner_child = 0, 1
     else:
         outer_child, inner_child = 1, 0
 
-    # Fetch data for both relations
-    tuples_1, block_1, V_1 = get_relation_data(query_dict_itm[outer_child], join_node.get_children()[outer_child])
-    tuples_2, block_2, V_2 = get_relation_data(query_dict_itm[inner_child], join_node.get_children()[inner_child])
+    # Fetch data for both relations (each join column with the child holding its relation)
+    tuples_1, block_1, V_1, path_1 = get_relation_data(query_dict_itm[0], join_node.get_children()[outer_child])
+    tuples_2, block_2, V_2, path_2 = get_relation_data(query_dict_itm[1], join_node.get_children()[inner_child])
     
-    # Hash
-    if(query_dict_itm[0]['type']==JOINS[0]):
-        n_IO= 3 * (block_1 + block_2)
-    # Nested loop
-    elif query_dict_itm[0]['type']==JOINS[1]:
-        if block_1< block_2:
-            n_IO=block_1 + (block_1 * block_2)/(M-1)
-        else:
-            n_IO=block_2 + (block_1 * block_2)/(M-1)
-
-    # Merge
-    elif query_dict_itm[0]['type']==JOINS[2]:
-        n_IO = block_1 + block_2
-    # Index/Index only
-    else:
-        if block_1< block_2:
-            n_IO=block_1 + (tuples_1 * block_2)/V_2
-        else:
-            n_IO=block_2 + (tuples_2 * block_1)/V_1
     ## Est tuples:
     tuples = (tuples_1 * tuples_2) / max(V_1,V_2)
+    widths = [child.width for child in join_node.get_children()]
+    join_node.width = sum(widths) if None not in widths else None
+    n_IO = get_cost_model(cost_model).join_cost(query_dict_itm[0]['type'], tuples_1, block_1, V_1, tuples_2, block_2, V_2, tuples, M, path_1, path_2)
     return n_IO,tuples
     
-def select_and_project(query_dict,source_alias,source_table,scan_type,use_dict_IO_tuples,Tuples):
-
+def build_source_node(query_dict,source_alias,source_table,scan_type,use_dict_IO_tuples,Tuples,stats=None,cost_model=None):
     '''
-    Select a source
+    Create the source node of a relation with its tuples and IO cost
     - query_dict: the processed query from preprocessing.py
-    - source_alias: the alias of the source to be selected then projected
-    returns: selection node
+    - source_alias: the alias of the source
+    - scan_type: the scan type of the source (Q_type)
+    - stats: optional StatsSnapshot of the query
+    - cost_model: optional cost model (IOCostModel by default)
+    returns: source node
     '''
-    
-    #projections = []
-    selections = []
     source_node=QueryNode("Source",source_alias)
     # If cannot get from source table, then use alias
     if use_dict_IO_tuples==False:
@@ -191,7 +464,8 @@ def select_and_project(query_dict,source_alias,source_table,scan_type,use_dict_I
             
             for i in range(len(query_dict['source'])):
                 if query_dict['source'][i]['alias'].lower()==(source_alias.lower()):
-                    IO_cost = set_source_IO(query_dict['source'][i],source_table)
+                    path, selectivity = source_access_path(query_dict,source_alias,source_table,scan_type,stats)
+                    IO_cost = set_source_IO(query_dict['source'][i],source_table,stats,cost_model,tuples_value,selectivity,path)
                     source_node.set_IO_cost(IO_cost)
                     break
         else:
@@ -201,59 +475,130 @@ def select_and_project(query_dict,source_alias,source_table,scan_type,use_dict_I
                     # key match
                     for i in range(len(query_dict['source'])):
                         if query_dict['source'][i]['alias'].lower()==(source_alias.lower()):
-                            #print("alias")
-                            IO_cost = set_source_IO(query_dict['source'][i],source_table)
+                            path, selectivity = source_access_path(query_dict,source_alias,source_table,scan_type,stats)
+                            IO_cost = set_source_IO(query_dict['source'][i],source_table,stats,cost_model,Tuples[key],selectivity,path)
                             source_node.set_IO_cost(IO_cost)
                     break
+        source_item = next((x for x in query_dict['source'] if x['alias'].lower()==source_alias.lower()), None)
+        source_node.width = relation_width(source_item,source_table,source_node.get_tuples(),stats)
     else:
         for i in range(len(query_dict["source"])):
             if query_dict["source"][i]["alias"].lower().startswith(source_alias.lower()):
                 source_node.set_tuples(query_dict["source"][i]["tuples"])
                 source_node.set_IO_cost(float(query_dict["source"][i]["IO_cost"]))
+                # EXPLAIN width of the scan, the database is not queried for the original plan
+                source_node.width = query_dict["source"][i].get("width")
                 
     source_node.set_Q_Type(scan_type)
+    return source_node
+
+def select_and_project(query_dict,source_alias,source_table,scan_type,use_dict_IO_tuples,Tuples,stats=None,cost_model=None):
+
+    '''
+    Select a source
+    - query_dict: the processed query from preprocessing.py
+    - source_alias: the alias of the source to be selected then projected
+    - stats: optional StatsSnapshot of the query
+    - cost_model: optional cost model (IOCostModel by default)
+    returns: selection node
+    '''
+    
+    #projections = []
+    selections = []
+    source_node=build_source_node(query_dict,source_alias,source_table,scan_type,use_dict_IO_tuples,Tuples,stats,cost_model)
     # Check for Selections (range queries)
     selection_node=None
     #projection_node=None
     # selection (if there is)
-    columns=[]
+    select_items=[]
     for m in range(len(query_dict["selects"])):
         selection_alias=query_dict["selects"][m]["alias"]
         if(source_alias == selection_alias):
-            selections.append(query_dict["selects"][m]["left"]+query_dict["selects"][m]["operator"]+query_dict["selects"][m]["right"])
+            select_items.append(query_dict["selects"][m])
+            selections.append(format_select(query_dict["selects"][m]))
             selection_node=QueryNode("Selection",selections)
             selection_node.add_child(source_node)
+            selection_node.width = source_node.width
             selection_node.set_Q_Type(query_dict["selects"][m]["type"])
-            if "(" in query_dict["selects"][m]["left"]:
-                columns.append(query_dict["selects"][m]["left"].split('(')[1])
-            elif "(" in query_dict["selects"][m]["right"]:
-                columns.append(query_dict["selects"][m]["right"].split('(')[1])
-            elif "." in query_dict["selects"][m]["left"]:
-                columns.append(query_dict["selects"][m]["left"].split('.')[1])
-            elif "." in query_dict["selects"][m]["right"]:
-                columns.append(query_dict["selects"][m]["right"].split('.')[1])
     if selection_node is not None:
         if use_dict_IO_tuples:
-            selection_node.set_tuples(query_dict["selects"][m]["tuples"])
+            selection_node.set_tuples(select_items[-1]["tuples"])
             # !!scan is done in the first step:
             selection_node.set_IO_cost(0)
             
         else: #use our own estimation
-            # !!scan is done in the first step:
-            selection_node.set_IO_cost(0)
-            tuples=set_selection_tuples(query_dict["selects"][m], selection_node,source_table,columns)
+            # !!scan is done in the first step (the textbook model charges nothing for the predicates)
+            selection_node.set_IO_cost(get_cost_model(cost_model).selection_cost(source_node.get_tuples(), len(select_items)))
+            tuples=set_selection_tuples(select_items, selection_node,source_table,stats)
             selection_node.set_tuples(tuples)
             
     
     return selection_node
 
-def join_tables(query_dict,join_index,current_intermediate_relations,use_dict_IO_tuples,Tuples,M):
+def build_leaf(query_dict,source_alias,source_table,use_dict_IO_tuples,Tuples,stats=None,memo=None,cost_model=None):
+    '''
+    Build the bottom of the tree for a relation: its selection node if it has selections, else its source node
+    - query_dict: the processed query from preprocessing.py
+    - source_alias: the alias of the source
+    - stats: optional StatsSnapshot of the query
+    - memo: optional SubplanMemo to reuse the leaf built by a previous tree
+    - cost_model: optional cost model (IOCostModel by default)
+    returns: selection or source node
+    '''
+    source_Q_type = "None"
+    for x in query_dict["source"]:
+        if x["alias"]==source_alias:
+            source_Q_type=x["type"]
+            break
+    if memo is not None:
+        key = leaf_memo_key(query_dict,source_alias,source_Q_type,use_dict_IO_tuples,cost_model)
+        leaf = memo.get(key)
+        if leaf is not None:
+            return leaf
+    leaf=select_and_project(query_dict,source_alias,source_table,source_Q_type,use_dict_IO_tuples,Tuples,stats,cost_model)
+    if leaf is None:
+        leaf=build_source_node(query_dict,source_alias,source_table,source_Q_type,use_dict_IO_tuples,Tuples,stats,cost_model)
+    if memo is not None:
+        memo.put(key, leaf)
+    return leaf
+
+def cost_join_node(query_dict,join_index,join_node,use_dict_IO_tuples,M,stats=None,memo=None,cost_model=None):
+    '''
+    Set the IO cost and tuples of a join node whose children are in place
+    - memo: optional SubplanMemo, returns the memoized node instead when the same subtree was costed before
+    - cost_model: optional cost model (IOCostModel by default)
+    returns: the costed join node
+    '''
+    join_node.join_index = join_index
+    if memo is not None:
+        key = join_memo_key(join_index,join_node.get_Q_type(),join_node.get_children(),M,use_dict_IO_tuples,cost_model)
+        if key is not None:
+            cached = memo.get(key)
+            if cached is not None:
+                return cached
+    if use_dict_IO_tuples:
+        join_node.set_tuples(query_dict["joins"][join_index][0]["tuples"])
+        join_node.set_IO_cost(query_dict["joins"][join_index][0]["IO_cost"])
+        widths = [child.width for child in join_node.get_children()]
+        join_node.width = sum(widths) if None not in widths else None
+    else:
+        IO, tuples = set_join_tuple_and_IO(query_dict["joins"][join_index],join_node,M,stats,cost_model)
+        join_node.set_IO_cost(IO)
+        join_node.set_tuples(tuples)
+    if memo is not None and key is not None:
+        memo.put(key, join_node)
+    return join_node
+
+def join_tables(query_dict,join_index,current_intermediate_relations,use_dict_IO_tuples,Tuples,M,stats=None,memo=None,cost_model=None):
     '''
     Join 2 tables from the bottom up
     - query_dict: the processed query from preprocessing.py
     - join_index: the index of the join to be performed in the query_dict
     - intermediate_relations: the array of checkpoint nodes (intermediate relations)
     - use_dict_IO_tuples: whether to use the dictionary of IO costs and tuples
+    - stats: optional StatsSnapshot of the query
+    - memo: optional SubplanMemo shared by the trees of the query
+    - cost_model: optional cost model (IOCostModel by default)
     returns: a new root, current set of intermediate relations
     '''
     # Build the tree bottom up (start with the source) (On^2)
@@ -282,18 +627,11 @@ def join_tables(query_dict,join_index,current_intermediate_relations,use_dict_IO
         join=join_alias_1 + "." + query_dict["joins"][join_index][0]["on"] + " = " +join_alias_2+ "." +query_dict["joins"][join_index][1]["on"]
         join_node = QueryNode("Join", join)
         join_node.set_Q_Type(query_dict["joins"][join_index][0]["type"])
-        aliases=[]
         for k in intermediate_relations:
             join_node.add_child(k)
-            aliases=aliases+k.get_alias()
-        join_node.add_alias(aliases)
-        if use_dict_IO_tuples:
-            join_node.set_tuples(query_dict["joins"][join_index][0]["tuples"])
-            join_node.set_IO_cost(query_dict["joins"][join_index][0]["IO_cost"])
-        else:
-            IO, tuples = set_join_tuple_and_IO(query_dict["joins"][join_index],join_node,M)
-            join_node.set_IO_cost(IO)
-            join_node.set_tuples(tuples)
+            for alias in k.get_alias():
+                join_node.add_alias(alias)
+        join_node=cost_join_node(query_dict,join_index,join_node,use_dict_IO_tuples,M,stats,memo,cost_model)
         
         root=join_node
         updated_intermediate_relations.append(root)
@@ -322,47 +660,9 @@ def join_tables(query_dict,join_index,current_intermediate_relations,use_dict_IO
         source_alias=join_aliases[i]
         source_table=join_tables[i]
 
-        for x in query_dict["source"]:
-            if x["alias"]==source_alias:
-                source_Q_type=x["type"]
-                break
-            else: source_Q_type = "None"
         # Perform selection and projection on the source if there is no checkpoint
         if checkpoint == None or (checkpoint and source_alias not in checkpoint.get_alias()):
-            source_node=QueryNode("Source",source_alias)
-            if use_dict_IO_tuples==False:
-                tuples_value = Tuples.get(source_table)
-                if tuples_value is not None:
-                    source_node.set_tuples(tuples_value)
-                    for i in range(len(query_dict['source'])):
-                        if query_dict['source'][i]['alias'].lower()==(source_alias.lower()):
-                            #print("alias")
-                            IO_cost = set_source_IO(query_dict['source'][i],source_table)
-                            source_node.set_IO_cost(IO_cost)
-                            break
-                else:
-                    for key in Tuples:
-                        if key.lower().startswith(source_alias.lower()):
-                            source_node.set_tuples(Tuples[key])
-                            for i in range(len(query_dict['source'])):
-                                if query_dict['source'][i]['alias'].lower()==(source_alias.lower()):
-                                    #print("alias")
-                                    IO_cost = set_source_IO(query_dict['source'][i],source_table)
-                                    source_node.set_IO_cost(IO_cost)
-                            break
-            else:
-                for i in range(len(query_dict["source"])):
-                    if query_dict["source"][i]["alias"].lower().startswith(source_alias.lower()):
-                        source_node.set_tuples(query_dict["source"][i]["tuples"])
-                        source_node.set_IO_cost(query_dict["source"][i]["IO_cost"])
-            source_node.set_Q_Type(source_Q_type)
-            # Check for Selections (range queries)
-            selection_node=select_and_project(query_dict,source_alias,source_table,source_Q_type,use_dict_IO_tuples,Tuples)
-                    
-            if selection_node is not None:
-                top_level_sources.append(selection_node)
-            else:
-                top_level_sources.append(source_node)
+            top_level_sources.append(build_leaf(query_dict,source_alias,source_table,use_dict_IO_tuples,Tuples,stats,memo,cost_model))
     # Join all top_level_sources
     if(source_alias==join_alias_1):
         join=join_alias_1 + "." + query_dict["joins"][join_index][0]["on"] + " = " +join_alias_2+ "." +query_dict["joins"][join_index][1]["on"]
@@ -393,24 +693,21 @@ def join_tables(query_dict,join_index,current_intermediate_relations,use_dict_IO
         
         join_node.add_alias(join_alias_1)
         join_node.add_alias(join_alias_2)
-    if use_dict_IO_tuples:
-        join_node.set_tuples(query_dict["joins"][join_index][0]["tuples"])
-        join_node.set_IO_cost(query_dict["joins"][join_index][0]["IO_cost"])
-    else:
-        IO, tuples = set_join_tuple_and_IO(query_dict["joins"][join_index],join_node,M)
-        join_node.set_IO_cost(IO)
-        join_node.set_tuples(tuples)
+    join_node=cost_join_node(query_dict,join_index,join_node,use_dict_IO_tuples,M,stats,memo,cost_model)
     
     root=join_node
     updated_intermediate_relations.append(root)
     return root,updated_intermediate_relations
 
-def build_query_tree(query_dict,join_order,use_dict_IO_tuples,Tuples,M):
+def build_query_tree(query_dict,join_order,use_dict_IO_tuples,Tuples,M,stats=None,memo=None,cost_model=None):
     '''
     Main function to build the query tree
     - query_dict: the processed query from preprocessing.py
     - join_order: the order of joins to be performed
     - use_dict_IO_tuples: whether to use the dictionary of IO costs and tuples
+    - stats: optional StatsSnapshot from pgconn.prefetch_statistics, avoids one catalog query per lookup
+    - memo: optional SubplanMemo to reuse the costed subtrees of previously built join orders
+    - cost_model: optional cost model (IOCostModel by default, pgcost.PostgresCostModel for planner units)
     returns: next_top, the top of the query tree
     '''
     ## Used to store all intermediate relations
@@ -419,51 +716,126 @@ def build_query_tree(query_dict,join_order,use_dict_IO_tuples,Tuples,M):
     if(len(query_dict["joins"])==0 and len(query_dict["source"])==1):
         source_alias= query_dict["source"][0]["alias"]
         source_table= query_dict["source"][0]["table"]
-        source_Q_type=query_dict["source"][0]["type"]
-        
-        selection_node=select_and_project(query_dict,source_alias,source_table,source_Q_type,use_dict_IO_tuples,Tuples)
-        if selection_node is not None:
-            return selection_node,[]
-        else:
-            source_node=QueryNode("Source",source_alias)
-            if use_dict_IO_tuples==False:
-                tuples_value = Tuples.get(source_table)
-                if tuples_value is not None:
-                    source_node.set_tuples(tuples_value)
-                    
-                    for i in range(len(query_dict['source'])):
-                        if query_dict['source'][i]['alias'].lower()==(source_alias.lower()):
-                            IO_cost = set_source_IO(query_dict['source'][i],source_table)
-                            source_node.set_IO_cost(IO_cost)
-                            break
-                else:
-                    for key in Tuples:
-                        if key.lower().startswith(source_alias.lower()):
-                            source_node.set_tuples(Tuples[key])
-                            # key match
-                            for i in range(len(query_dict['source'])):
-                                if query_dict['source'][i]['alias'].lower()==(source_alias.lower()):
-                                    #print("alias")
-                                    IO_cost = set_source_IO(query_dict['source'][i],source_table)
-                                    source_node.set_IO_cost(IO_cost)
-                            break
-            else:
-                for i in range(len(query_dict["source"])):
-                    if query_dict["source"][i]["alias"].lower().startswith(source_alias.lower()):
-                        source_node.set_tuples(query_dict["source"][i]["tuples"])
-                        source_node.set_IO_cost(float(query_dict["source"][i]["IO_cost"]))
-        source_node.set_Q_Type(source_Q_type)
-    
-        return source_node,[]
+        leaf=build_leaf(query_dict,source_alias,source_table,use_dict_IO_tuples,Tuples,stats,memo,cost_model)
+        assign_node_ids(leaf, memo.ids if memo is not None else itertools.count(1))
+        return leaf,[]
     # Cond #2 There are joins
     for i in join_order:
         # get the current top of the join as the checkpoint
-        next_top, updated_intermediate_relations = join_tables(query_dict,i,intermediate_relations,use_dict_IO_tuples,Tuples,M)
+        next_top, updated_intermediate_relations = join_tables(query_dict,i,intermediate_relations,use_dict_IO_tuples,Tuples,M,stats,memo,cost_model)
         intermediate_relations=updated_intermediate_relations
         #print(next_top)
+    # Ids are allocated per tree (or per memo), never from a global counter
+    ids = memo.ids if memo is not None else itertools.count(1)
+    for relation in intermediate_relations:
+        assign_node_ids(relation, ids)
         
     return next_top,intermediate_relations
 
+def recost_join_node(query_dict,join_node,children,use_dict_IO_tuples,M,stats=None,memo=None,cost_model=None):
+    '''
+    New version of a join node over the given children, costed with the current join type
+    - join_node: the join node to replace (not modified, it may be shared through a SubplanMemo)
+    - children: the children of the new node
+    - memo: optional SubplanMemo, only its IO, tuples and width are reused so the new node keeps these children
+    returns: the new join node
+    '''
+    new_node = QueryNode("Join", join_node.value)
+    new_node.set_Q_Type(query_dict["joins"][join_node.join_index][0]["type"])
+    for child in children:
+        new_node.add_child(child)
+    for alias in join_node.get_alias():
+        new_node.add_alias(alias)
+    costed = cost_join_node(query_dict,join_node.join_index,new_node,use_dict_IO_tuples,M,stats,memo,cost_model)
+    if costed is not new_node:
+        new_node.set_IO_cost(costed.get_IO_cost())
+        new_node.set_tuples(costed.get_tuples())
+        new_node.width = costed.width
+        new_node.memo_key = costed.memo_key
+    return new_node
+
+class QueryTreeIndex:
+    '''
+    Parent links of a query tree and the nodes of each join and relation, to update a tree without rebuilding it
+    - root: the root of the query tree
+    - parents: {node id: parent node}
+    - joins: {join index: join node}
+    - leaves: {alias: leaf node (selection node, or source node without selections)}
+    - ids: id allocator of the tree (SubplanMemo.ids when the tree was built with a memo),
+      None to continue after the largest id of the tree
+    '''
+    def __init__(self, root, ids=None):
+        self.root = root
+        self.parents = {}
+        self.joins = {}
+        self.leaves = {}
+        self._add(root, None)
+        if ids is None:
+            ids = itertools.count(max(self.parents.keys(), default=root.id) + 1)
+        self.ids = ids
+
+    def _add(self, node, parent):
+        if parent is not None:
+            self.parents[node.id] = parent
+        if node.get_node_type() == "Join":
+            self.joins[node.join_index] = node
+            for child in node.get_children():
+                self._add(child, node)
+        else:
+            self.leaves[covered_aliases(node)[0]] = node
+
+    def copy(self):
+        '''
+        Index of the same tree whose replacements leave this one unchanged (the nodes and the id allocator are shared)
+        '''
+        index = QueryTreeIndex.__new__(QueryTreeIndex)
+        index.root = self.root
+        index.parents = dict(self.parents)
+        index.joins = dict(self.joins)
+        index.leaves = dict(self.leaves)
+        index.ids = self.ids
+        return index
+
+    def replace(self, query_dict, node, new_node, use_dict_IO_tuples, M, stats=None, memo=None, cost_model=None):
+        '''
+        Replace a node of the tree and recost its ancestors only (path copying, the old nodes are not modified)
+        returns: [(old node, new node)] from the replaced node up to the root
+        '''
+        replaced = [(node, new_node)]
+        while node.id in self.parents:
+            parent = self.parents[node.id]
+            children = [new_node if child is node else child for child in parent.get_children()]
+            new_parent = recost_join_node(query_dict,parent,children,use_dict_IO_tuples,M,stats,memo,cost_model)
+            replaced.append((parent, new_parent))
+            node, new_node = parent, new_parent
+        for old, new in replaced:
+            assign_node_ids(new, self.ids)
+        for old, new in replaced:
+            self.parents.pop(old.id, None)
+            if new.get_node_type() == "Join":
+                self.joins[new.join_index] = new
+                for child in new.get_children():
+                    self.parents[child.id] = new
+            else:
+                self.leaves[covered_aliases(new)[0]] = new
+        self.root = replaced[-1][1]
+        return replaced
+
+def get_join_validity(joins, order):
+    """
+    Determine the validity between joins based on the tables involved for a given order.
+    The order is valid if each join contains at least one table from the previous join's dependency.
+    """
+    return query_join_graph(joins).prefix_state(order) is not None
+
+
+def generate_valid_join_orders(joins):
+    """
+    Generate all valid join orders based on the given join operations.
+    Only prefixes that stay connected are extended (joingraph.JoinGraph), instead of filtering all permutations.
+    """
+    return query_join_graph(joins).valid_orders()
+
 def get_nodes_and_edges(node):
     '''
     Get the nodes and edges of the query tree